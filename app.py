@@ -1,10 +1,32 @@
 import streamlit as st
-from query_src.fdp_crawler import query_orchestrator 
+from query_src.service import EvaluationService, ServiceClient
+from query_src.refresh import RefreshScheduler
+from query_src.instrumentation import configure_logging, start_metrics_server
 import pandas as pd
 import rdflib
 import io
+import os
+import time
+
+configure_logging(os.environ.get("ODRL_LOG_LEVEL", "INFO"))
+if os.environ.get("ODRL_METRICS_PORT"): # Prometheus can scrape http://localhost:<port>/metrics
+    start_metrics_server(int(os.environ["ODRL_METRICS_PORT"]))
 
 st.set_page_config(page_title="ODRL-FDP Query Evaluator", layout="wide")
+
+SNAPSHOT_PATH = "crawl_snapshot.sqlite"
+REFRESH_INTERVAL = 300 # seconds, the FDPs are re-crawled in the background
+
+@st.cache_resource
+def get_evaluator():
+    """Shared by all sessions and reruns, so crawls, policies and connections stay warm. With ODRL_SERVICE_URL
+    set the app is only a client of a running evaluation service (python -m query_src.service)."""
+    if os.environ.get("ODRL_SERVICE_URL"):
+        return ServiceClient(os.environ["ODRL_SERVICE_URL"])
+    with open("fdp_uris.txt") as f:
+        scheduler = RefreshScheduler([line.strip() for line in f if line.strip()], interval=REFRESH_INTERVAL,
+                                     snapshot_path=SNAPSHOT_PATH)
+    return EvaluationService(scheduler=scheduler.start())
 st.title("🔍 FDP Access Evaluator via ODRL Policies")
 
 # --- FDP Inputs ---
@@ -31,6 +53,8 @@ st.markdown(f"**Loaded {len(fdp_uris)} FDP URIs**")
 if fdp_uris:
     selected_fdp = st.selectbox("View a loaded FDP URI:", options=fdp_uris)
 
+refresh_crawl = st.checkbox("Re-crawl the FDPs now (this run still uses the current crawl)", value=False)
+
 # --- Query & Metadata ---
 st.header("2. SPARQL Query & Parameters")
 default_query = """SELECT ?s ?p ?o WHERE { ?s ?p ?o } LIMIT 25"""
@@ -79,6 +103,36 @@ def build_query_graph(query_text, purpose_text):
 
     return g
 
+# --- Render a single endpoint result ---
+def render_result(placeholder, res):
+    """Draw one endpoint result into its placeholder. Called again when the query data comes in,
+    which replaces the earlier content."""
+    with placeholder.container():
+        fdp_text = res.get("fdp", "[Unknown FDP]")
+        st.subheader(f"FDP: {fdp_text}")
+        st.write(f"Endpoint: {res.get('endpoint')}")
+
+        if res.get("allowed"):
+            st.success("✅ Query Permitted")
+            allowed_by = res.get('policy', 'Unknown policy.')
+            st.markdown(f"**Allowed by:** {allowed_by}")
+            if "data" not in res:
+                st.info("⏳ Running query...")
+            elif res.get("data") is None:
+                st.error(f"Failed to get data. {res.get('error', 'Unkown error. Probably occured at the triplestore.')}")
+            else:
+                if res.get("truncated"):
+                    st.warning(f"Result truncated after {res.get('row_count')} rows ({res.get('truncated_reason')}).")
+                if res.get("cached"):
+                    st.caption("Result from the query cache (access was checked again for this run).")
+                st.json(res.get("data", {}))
+        else:
+            st.error("❌ Query Denied")
+            st.markdown(f"**Reason:** {res.get('reason', 'No reason provided.')}")
+            denied_by = res.get('policy', False)
+            if denied_by:
+                st.markdown(f"**Denied by:** {denied_by}")
+
 # --- Evaluate ---
 st.header("4. Evaluate")
 if st.button("Evaluate Query"):
@@ -88,42 +142,20 @@ if st.button("Evaluate Query"):
         with st.spinner("Evaluating query..."):
             try:
                 query_graph = build_query_graph(sparql_query, query_purpose)
-                results = query_orchestrator(
-                    fdp_uris=fdp_uris,
-                    input_user_graph=user_graph,
-                    input_query_graph=query_graph,
-                    input_graph_type = 'graph'                         
-                )
-
-                #st.write('Finshed the program')
-                #st.write(results)
-                print(len(results))
-
-                if not isinstance(results, list):
-                    st.error("❌ Unexpected response format from evaluate_query. Expected a list of results.")
-                elif len(results) == 0:
+                # Results are drawn as soon as they come in: first the access decision, later the data
+                placeholders = {}
+                evaluator = get_evaluator()
+                start = time.perf_counter()
+                for event, res in evaluator.iter_evaluate(fdp_uris, user_graph, query_graph, refresh=refresh_crawl):
+                    if event == "decision":
+                        placeholders[res["result_id"]] = st.empty()
+                    render_result(placeholders[res["result_id"]], res)
+
+                if len(placeholders) == 0:
                     st.warning("No FDPs returned any results or all queries were denied.")
-                else:
-                    for res in results:
-                        fdp_text = res.get("fdp", "[Unknown FDP]")
-                        #endpoint_text = res.get("endpoint")
-                        st.subheader(f"FDP: {fdp_text}")
-                        st.write(f"Endpoint: {res.get('endpoint')}")
-
-                        if res.get("allowed"):
-                            st.success("✅ Query Permitted")
-                            allowed_by = res.get('policy', 'Unknown policy.')
-                            st.markdown(f"**Allowed by:** {allowed_by}")
-                            if res.get("data") is None:
-                                st.error(f"Failed to get data. {res.get('error', 'Unkown error. Probably occured at the triplestore.')}")
-                            else:
-                                st.json(res.get("data", {}))
-                        else:
-                            st.error("❌ Query Denied")
-                            st.markdown(f"**Reason:** {res.get('reason', 'No reason provided.')}")
-                            denied_by = res.get('policy', False)
-                            if denied_by:
-                                st.markdown(f"**Denied by:** {denied_by}")
+                server_seconds = getattr(evaluator, "last_server_seconds", None)
+                st.caption(f"Evaluated in {time.perf_counter() - start:.2f}s"
+                           + (f" ({server_seconds:.2f}s in the evaluation service)" if server_seconds is not None else ""))
 
             except Exception as e:
                 st.exception(e)
@@ -0,0 +1,113 @@
+"""Memory held by a crawled FDP tree. Crawls a synthetic FDP and measures, with tracemalloc, how much memory
+is still allocated once only the FDP object is kept (caches are dropped first). The FDP is crawled once
+before measuring, so the synthetic server (it runs in this process) has built all its documents already.
+
+    python -m benchmarks.memory_benchmark --catalogs 20 --datasets 20 --distributions 10
+    python -m benchmarks.memory_benchmark --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from query_src.fdp_crawler import crawl_fdps
+from query_src.http_cache import HTTPCache, set_default_cache
+from query_src.policy_store import PolicyDocumentStore, set_default_policy_store
+from .run_benchmark import RESULTS_DIR, git_commit
+from .synthetic_fdp import serve
+
+
+def count_nodes(fdp):
+    counts = {"catalogs": 0, "datasets": 0, "distributions": 0, "policies": len(fdp.policies)}
+    for catalog in fdp.catalogs:
+        counts["catalogs"] += 1
+        counts["policies"] += len(catalog.policies)
+        for dataset in catalog.datasets:
+            counts["datasets"] += 1
+            counts["policies"] += len(dataset.policies)
+            for distribution in dataset.distributions:
+                counts["distributions"] += 1
+                counts["policies"] += len(distribution.policies)
+    return counts
+
+def fresh_caches(cache_dir):
+    set_default_cache(HTTPCache(cache_dir=cache_dir))
+    set_default_policy_store(PolicyDocumentStore())
+
+def measure(fdp_uri):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        fresh_caches(cache_dir)
+        crawl_fdps([fdp_uri]) # Warm up the server
+    with tempfile.TemporaryDirectory() as cache_dir:
+        fresh_caches(cache_dir)
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        fdp = crawl_fdps([fdp_uri])[0]
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] - before
+        # Only the tree should be left: drop the caches that were filled while crawling
+        set_default_cache(None)
+        set_default_policy_store(None)
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+    return fdp, {"retained_bytes": retained, "peak_bytes": peak, "crawl_seconds": seconds}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the memory held by a crawled FDP tree")
+    parser.add_argument("--catalogs", type=int, default=10)
+    parser.add_argument("--datasets", type=int, default=10)
+    parser.add_argument("--distributions", type=int, default=10)
+    parser.add_argument("--policies-per-node", type=int, default=1)
+    parser.add_argument("--bnode-fraction", type=float, default=0.5)
+    parser.add_argument("--no-ntriples", dest="ntriples", action="store_false", help="Only serve turtle")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help=f"Result file (default: a new file in {RESULTS_DIR})")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    settings = {key: getattr(args, key) for key in ("catalogs", "datasets", "distributions", "policies_per_node",
+                                                     "bnode_fraction", "seed")}
+    server, synthetic = serve(ntriples=args.ntriples, **settings)
+    try:
+        fdp, memory = measure(synthetic.fdp_uri)
+    finally:
+        server.shutdown()
+    counts = count_nodes(fdp)
+    memory["bytes_per_distribution"] = memory["retained_bytes"] / max(1, counts["distributions"])
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": dict(settings, ntriples=args.ntriples),
+        "counts": counts,
+        "memory": memory,
+    }
+    out = args.out
+    if out is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"memory_{result['timestamp'].replace(':', '')}_{result['commit']}.json")
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"{counts['distributions']} distributions, {counts['policies']} policy references, written to {out}")
+    print(f"  retained  {memory['retained_bytes'] / 1e6:10.2f} MB  ({memory['bytes_per_distribution']:.0f} bytes per distribution)")
+    print(f"  peak      {memory['peak_bytes'] / 1e6:10.2f} MB")
+    print(f"  crawl     {memory['crawl_seconds']:10.2f} s")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"\nCompared to {previous.get('commit')} ({args.compare}):")
+        for key in ("retained_bytes", "peak_bytes", "crawl_seconds"):
+            before, now = previous["memory"][key], memory[key]
+            print(f"  {key:<16} {before:14.2f} -> {now:14.2f}  ({now / before:5.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""End-to-end benchmark on a synthetic FDP. Times crawl_fdp, check_policy and run_query separately and the
+whole query_orchestrator run, and saves the numbers so runs on different commits can be compared.
+
+    python -m benchmarks.run_benchmark --catalogs 20 --datasets 10 --distributions 5
+    python -m benchmarks.run_benchmark --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+from rdflib import Graph
+
+from query_src.fdp_crawler import crawl_fdps, prepare_query, evaluate_fdp, query_orchestrator
+from query_src.decision_cache import DecisionCache
+from query_src.http_cache import HTTPCache, set_default_cache
+from query_src.policy_checker import check_policy
+from query_src.policy_store import PolicyDocumentStore, set_default_policy_store
+from query_src.query_runner import QueryExecutor
+from query_src.result_cache import ResultCache, set_default_result_cache
+from query_src.endpoints import CapabilityCache, CircuitBreaker, set_default_capability_cache, set_default_circuit_breaker
+from .synthetic_fdp import serve
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def fresh_caches(cache_dir):
+    """Start from cold HTTP, policy, result and endpoint probe caches so every repetition measures the same work"""
+    set_default_cache(HTTPCache(cache_dir=tempfile.mkdtemp(dir=cache_dir)))
+    set_default_policy_store(PolicyDocumentStore())
+    set_default_result_cache(ResultCache())
+    set_default_capability_cache(CapabilityCache())
+    set_default_circuit_breaker(CircuitBreaker())
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+def all_endpoints(fdp):
+    for catalog in fdp.catalogs:
+        for dataset in catalog.datasets:
+            for distribution in dataset.distributions:
+                for endpoint_url in distribution.sparql_endpoints:
+                    yield [fdp.policies, catalog.policies, dataset.policies, distribution.policies], endpoint_url
+
+def run_once(fdp, server, cache_dir, crawl_options, query_workers):
+    timings = {}
+    user_graph = Graph().parse(data=fdp.user_graph(0), format="turtle")
+    query_graph = Graph().parse(data=fdp.query_graph(), format="turtle")
+
+    fresh_caches(cache_dir)
+    timings["crawl_cold"], fdps = timed(lambda: crawl_fdps([fdp.fdp_uri], **crawl_options))
+    timings["crawl_warm"], _ = timed(lambda: crawl_fdps([fdp.fdp_uri], **crawl_options))
+    crawled = fdps[0]
+
+    prepared = prepare_query(user_graph, query_graph, 'graph')
+    query_graph, query_sbj, query_action, user_graph, user = prepared
+
+    def check_all():
+        # Every level and both modes for every endpoint, without memoization
+        for levels, endpoint_url in all_endpoints(crawled):
+            for policy_refs in levels:
+                for mode in ("prohibition", "permission"):
+                    check_policy(policy_refs, query_graph, query_sbj, query_action, user_graph, user, endpoint_url, mode)
+    timings["check_policy_cold"], _ = timed(check_all) # Includes loading and compiling the policy documents
+    timings["check_policy_warm"], _ = timed(check_all)
+
+    timings["evaluate_memoized"], decisions = timed(lambda: list(evaluate_fdp(
+        fdp.fdp_uri, crawled, query_graph, query_sbj, query_action, user_graph, user, DecisionCache())))
+    permitted = [res["endpoint"] for res in decisions if res["allowed"]]
+
+    with QueryExecutor(max_workers=query_workers) as executor:
+        timings["run_query"], _ = timed(lambda: executor.run_all(
+            [(query_graph, query_sbj, user_graph, user, endpoint_url) for endpoint_url in permitted]))
+
+    fresh_caches(cache_dir)
+    timings["end_to_end_cold"], _ = timed(lambda: query_orchestrator(
+        [fdp.fdp_uri], user_graph, query_graph, 'graph', crawl_options=crawl_options))
+    timings["end_to_end_warm"], _ = timed(lambda: query_orchestrator(
+        [fdp.fdp_uri], user_graph, query_graph, 'graph', crawl_options=crawl_options))
+
+    counts = {"endpoints": len(decisions), "permitted": len(permitted)}
+    return timings, counts
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nCompared to {previous.get('commit')} ({previous_path}):")
+    for stage, seconds in current["timings"].items():
+        before = previous.get("timings", {}).get(stage)
+        if before:
+            print(f"  {stage:<20} {before:8.3f}s -> {seconds:8.3f}s  ({seconds / before:5.2f}x)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the crawl / policy / query pipeline on a synthetic FDP")
+    parser.add_argument("--catalogs", type=int, default=10)
+    parser.add_argument("--datasets", type=int, default=10)
+    parser.add_argument("--distributions", type=int, default=3)
+    parser.add_argument("--policies-per-node", type=int, default=1)
+    parser.add_argument("--rules-per-policy", type=int, default=2)
+    parser.add_argument("--bnode-fraction", type=float, default=0.2)
+    parser.add_argument("--constraint-fraction", type=float, default=0.3)
+    parser.add_argument("--prohibition-fraction", type=float, default=0.1)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--query-delay", type=float, default=0.0, help="Seconds the stub triplestore waits per query")
+    parser.add_argument("--query-workers", type=int, default=8)
+    parser.add_argument("--sequential", action="store_true", help="Crawl with the sequential crawl_fdp")
+    parser.add_argument("--no-ntriples", dest="ntriples", action="store_false",
+                        help="Let the synthetic FDP ignore N-Triples requests, so every document is parsed as turtle")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help=f"Result file (default: a new file in {RESULTS_DIR})")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    settings = {key: getattr(args, key) for key in ("catalogs", "datasets", "distributions", "policies_per_node",
+                                                     "rules_per_policy", "bnode_fraction", "constraint_fraction",
+                                                     "prohibition_fraction", "users", "rows", "seed")}
+    server, fdp = serve(query_delay=args.query_delay, ntriples=args.ntriples, **settings)
+    crawl_options = {"concurrent": not args.sequential}
+    print(f"Synthetic FDP: {len(fdp.documents)} documents, {fdp.endpoint_count} endpoints")
+
+    runs = []
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for i in range(args.repeat):
+                timings, counts = run_once(fdp, server, cache_dir, crawl_options, args.query_workers)
+                runs.append(timings)
+                print(f"Run {i + 1}/{args.repeat}: " + ", ".join(f"{k} {v:.3f}s" for k, v in timings.items()))
+    finally:
+        server.shutdown()
+        set_default_cache(None)
+        set_default_policy_store(None)
+        set_default_result_cache(None)
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": dict(settings, query_delay=args.query_delay, query_workers=args.query_workers,
+                         sequential=args.sequential, ntriples=args.ntriples, repeat=args.repeat),
+        "counts": dict(counts, documents=len(fdp.documents), requests=dict(server.counts)),
+        "timings": {stage: statistics.median(run[stage] for run in runs) for stage in runs[0]},
+        "runs": runs,
+    }
+
+    out = args.out
+    if out is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"{result['timestamp'].replace(':', '')}_{result['commit']}.json")
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nMedian of {args.repeat} runs written to {out}")
+    for stage, seconds in result["timings"].items():
+        print(f"  {stage:<20} {seconds:8.3f}s")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""Synthetic FDPs for benchmarking. Generates an FDP -> catalogs -> datasets -> distributions tree with
+ODRL policies at every level and serves it, together with a stub SPARQL endpoint, from a local HTTP server.
+
+    python -m benchmarks.synthetic_fdp --catalogs 10 --datasets 10 --distributions 5 --port 8000
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from rdflib import Graph
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIXES = """@prefix ldp: <http://www.w3.org/ns/ldp#> .
+@prefix dcat: <http://www.w3.org/ns/dcat#> .
+@prefix dct: <http://purl.org/dc/terms/> .
+@prefix odrl: <http://www.w3.org/ns/odrl/2/> .
+@prefix ex: <http://example.org/> .
+"""
+
+
+class SyntheticFDP:
+    """Generates the turtle documents of one synthetic FDP. All randomness comes from seed, so the same
+    settings always give the same documents.
+
+    catalogs, datasets, distributions: fan-out at each level (datasets per catalog, distributions per dataset)
+    policies_per_node: number of policies attached to every node
+    rules_per_policy: permissions/prohibitions per policy
+    bnode_fraction: share of the policies that are defined inline as BNodes instead of in a policy document
+    constraint_fraction: share of the rules with an odrl:purpose constraint
+    prohibition_fraction: share of the rules that are prohibitions
+    users: number of users (ex:User0 ... ex:UserN) that rules are assigned to
+    rows: number of bindings the stub SPARQL endpoint returns per query"""
+    def __init__(self, base_url, catalogs=5, datasets=5, distributions=3, policies_per_node=1, rules_per_policy=2,
+                 bnode_fraction=0.2, constraint_fraction=0.3, prohibition_fraction=0.1, users=10, rows=100, seed=0):
+        self.base_url = base_url.rstrip("/")
+        self.catalogs = catalogs
+        self.datasets = datasets
+        self.distributions = distributions
+        self.policies_per_node = policies_per_node
+        self.rules_per_policy = rules_per_policy
+        self.bnode_fraction = bnode_fraction
+        self.constraint_fraction = constraint_fraction
+        self.prohibition_fraction = prohibition_fraction
+        self.users = users
+        self.rows = rows
+        self.random = random.Random(seed)
+        self.documents = {} # path -> turtle text
+        self._ntriples = {} # path -> N-Triples text, converted on first request
+        self.endpoint_count = 0
+        self._generate()
+
+    @property
+    def fdp_uri(self):
+        return f"{self.base_url}/fdp.ttl"
+
+    def _rule(self):
+        mode = "prohibition" if self.random.random() < self.prohibition_fraction else "permission"
+        assignee = f"ex:User{self.random.randrange(self.users)}"
+        constraint = ""
+        if self.random.random() < self.constraint_fraction:
+            purpose = self.random.choice(["research", "education", "commercial"])
+            constraint = (f" ; odrl:constraint [ odrl:leftOperand odrl:purpose ; odrl:operator odrl:eq ; "
+                          f"odrl:rightOperand ex:{purpose} ]")
+        return f"odrl:{mode} [ odrl:assignee {assignee} ; odrl:action odrl:read{constraint} ]"
+
+    def _policy_body(self):
+        return "a odrl:Policy ;\n    " + " ;\n    ".join(self._rule() for _ in range(self.rules_per_policy))
+
+    def _policies(self, node_id, policy_doc):
+        """Returns the odrl:hasPolicy objects for a node and adds its URI policies to policy_doc"""
+        refs = []
+        for i in range(self.policies_per_node):
+            if self.random.random() < self.bnode_fraction:
+                refs.append(f"[ {self._policy_body()} ]")
+            else:
+                name = f"{node_id}_p{i}"
+                policy_doc.append(f"<#{name}> {self._policy_body()} .")
+                refs.append(f"<{self.base_url}/policies.ttl#{name}>")
+        return refs
+
+    def _node(self, path, predicate_objects, extra=""):
+        lines = [f"<{self.base_url}/{path}>"]
+        statements = [f"{predicate} {obj}" for predicate, objects in predicate_objects for obj in objects]
+        statements.append(f'dct:modified "{formatdate(usegmt=True)}"')
+        lines.append("    " + " ;\n    ".join(statements) + " .")
+        self.documents[f"/{path}"] = PREFIXES + "\n" + "\n".join(lines) + extra + "\n"
+
+    def _generate(self):
+        policy_doc = []
+        catalog_paths = [f"catalog/{c}.ttl" for c in range(self.catalogs)]
+        self._node("fdp.ttl", [("ldp:contains", [f"<{self.base_url}/{p}>" for p in catalog_paths]),
+                               ("odrl:hasPolicy", self._policies("fdp", policy_doc))])
+        for c, catalog_path in enumerate(catalog_paths):
+            dataset_paths = [f"dataset/{c}_{d}.ttl" for d in range(self.datasets)]
+            self._node(catalog_path, [("ldp:contains", [f"<{self.base_url}/{p}>" for p in dataset_paths]),
+                                      ("odrl:hasPolicy", self._policies(f"c{c}", policy_doc))])
+            for d, dataset_path in enumerate(dataset_paths):
+                distribution_paths = [f"distribution/{c}_{d}_{x}.ttl" for x in range(self.distributions)]
+                self._node(dataset_path, [("ldp:contains", [f"<{self.base_url}/{p}>" for p in distribution_paths]),
+                                          ("odrl:hasPolicy", self._policies(f"c{c}d{d}", policy_doc))])
+                for x, distribution_path in enumerate(distribution_paths):
+                    endpoint = f"<{self.base_url}/allegrograph/repositories/repo{c}_{d}_{x}/sparql>"
+                    self.endpoint_count += 1
+                    self._node(distribution_path, [("dcat:accessURL", [endpoint]),
+                                                   ("odrl:hasPolicy", self._policies(f"c{c}d{d}x{x}", policy_doc))])
+        self.documents["/policies.ttl"] = PREFIXES + "\n" + "\n\n".join(policy_doc) + "\n"
+
+    def ntriples(self, path):
+        if path not in self._ntriples:
+            g = Graph().parse(data=self.documents[path], format="turtle", publicID=f"{self.base_url}{path}")
+            self._ntriples[path] = g.serialize(format="nt")
+        return self._ntriples[path]
+
+    def user_graph(self, user=0, with_credentials=False):
+        ttl = PREFIXES + f"@prefix foaf: <http://xmlns.com/foaf/0.1/> .\n\nex:User{user} a foaf:Person"
+        if with_credentials:
+            ttl += f' ;\n    ex:userName "user{user}" ;\n    ex:password "password{user}"'
+        return ttl + " .\n"
+
+    def query_graph(self, query="SELECT ?s ?p ?o WHERE { ?s ?p ?o } LIMIT 50", purpose="research"):
+        return PREFIXES + f'\nex:Q1 a odrl:Action ;\n    ex:queryText """{query}""" ;\n    odrl:purpose ex:{purpose} .\n'
+
+    def sparql_result(self, path):
+        bindings = [{"s": {"type": "uri", "value": f"{self.base_url}{path}/s{i}"},
+                     "p": {"type": "uri", "value": "http://example.org/p"},
+                     "o": {"type": "literal", "value": str(i)}} for i in range(self.rows)]
+        return json.dumps({"head": {"vars": ["s", "p", "o"]}, "results": {"bindings": bindings}})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, like a real FDP server
+
+    def _send(self, status, body=b"", content_type="text/turtle", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        fdp = self.server.fdp
+        path = self.path.split("#")[0]
+        self.server.counts["GET"] += 1
+        if path not in fdp.documents:
+            return self._send(404)
+        body, content_type = fdp.documents[path], "text/turtle"
+        if self.server.ntriples and "application/n-triples" in self.headers.get("Accept", ""):
+            body, content_type = fdp.ntriples(path), "application/n-triples"
+        etag = f'"{hash(body) & 0xffffffff:x}"'
+        headers = {"ETag": etag, "Vary": "Accept"}
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(304, content_type=content_type, headers=headers)
+        self._send(200, body.encode("utf-8"), content_type, headers=headers)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.counts["POST"] += 1
+        if self.server.query_delay:
+            time.sleep(self.server.query_delay)
+        self._send(200, self.server.fdp.sparql_result(self.path).encode("utf-8"), "application/sparql-results+json")
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=0, query_delay=0.0, ntriples=True, **settings):
+    """Start a server for a new SyntheticFDP in a background thread. Returns (server, fdp).
+    Call server.shutdown() when done. query_delay simulates a slow triplestore, ntriples=False makes the
+    server ignore Accept: application/n-triples like a turtle-only FDP."""
+    server = ThreadingHTTPServer(("localhost", port), _Handler)
+    server.daemon_threads = True
+    server.fdp = SyntheticFDP(f"http://localhost:{server.server_address[1]}", **settings)
+    server.query_delay = query_delay
+    server.ntriples = ntriples
+    server.counts = {"GET": 0, "POST": 0}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.fdp
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a synthetic FDP with a stub SPARQL endpoint")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--catalogs", type=int, default=5)
+    parser.add_argument("--datasets", type=int, default=5)
+    parser.add_argument("--distributions", type=int, default=3)
+    parser.add_argument("--policies-per-node", type=int, default=1)
+    parser.add_argument("--rules-per-policy", type=int, default=2)
+    parser.add_argument("--bnode-fraction", type=float, default=0.2)
+    parser.add_argument("--constraint-fraction", type=float, default=0.3)
+    parser.add_argument("--prohibition-fraction", type=float, default=0.1)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-ntriples", dest="ntriples", action="store_false", help="Only serve turtle")
+    args = vars(parser.parse_args())
+    server, fdp = serve(**args)
+    print(f"Serving {len(fdp.documents)} documents and {fdp.endpoint_count} endpoints, FDP at {fdp.fdp_uri}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
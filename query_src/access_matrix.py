@@ -0,0 +1,203 @@
+"""Which users may run a query at which endpoints, for many users at once and without sending any query.
+
+Gives the same answers as evaluate_fdp, but evaluates every compiled rule for all users in one go: the set
+of users a rule applies to is a python int used as a bitset (bit i is users[i]). A constraint that the query
+itself satisfies matches every user, otherwise the users with the right attribute value are looked up in an
+index over the user graphs. The allow/deny masks of each hierarchy level are computed once per combination of
+policy references, so endpoints that share their FDP/Catalog/Dataset policies only pay for their own level.
+
+    matrix = access_matrix(fdp_uris, ["users/bob.ttl", "users/alice.ttl"], "questions/query1.ttl", 'path')
+    matrix.to_dataframe() # one row per (query, user, endpoint)
+    matrix.pivot() # users x endpoints"""
+import logging
+
+import pandas as pd
+from rdflib import Graph, RDF, FOAF
+
+from .fdp_crawler import crawl_fdps, check_if_supported, prepare_queries
+from .policy_index import ODRL
+from .policy_store import get_default_policy_store
+
+logger = logging.getLogger(__name__)
+
+ALLOWED = "allowed"
+DENIED = "denied"
+NO_PERMISSION = "no_permission"
+
+
+def iter_endpoints(fdp):
+    """Yields (hierarchy, endpoint_url) for every supported endpoint, in the same order as evaluate_fdp"""
+    for catalog in fdp.catalogs:
+        for dataset in catalog.datasets:
+            for distribution in dataset.distributions:
+                for endpoint_url in distribution.sparql_endpoints:
+                    if not check_if_supported(endpoint_url):
+                        continue
+                    yield [
+                        ("FDP", fdp.policies),
+                        ("Catalog", catalog.policies),
+                        ("Dataset", dataset.policies),
+                        ("Distribution", distribution.policies),
+                    ], endpoint_url
+
+
+class UserIndex:
+    """Bit positions of the users and, per leftOperand, a mask of the users for every attribute value"""
+    def __init__(self, users):
+        self.users = users # list of (user_graph, user)
+        self.bits = {}
+        for i, (_, user) in enumerate(users):
+            self.bits[user] = self.bits.get(user, 0) | (1 << i) # The same IRI may be in several user files
+        self.all = (1 << len(users)) - 1
+        self._attributes = {} # leftOperand -> {value: mask}
+
+    def attribute_mask(self, left, value):
+        if left not in self._attributes:
+            masks = {}
+            for i, (user_graph, user) in enumerate(self.users):
+                v = user_graph.value(user, left)
+                if v is not None:
+                    masks[v] = masks.get(v, 0) | (1 << i)
+            self._attributes[left] = masks
+        return self._attributes[left].get(value, 0)
+
+
+class AccessMatrix:
+    """Decisions of one access matrix run. cells[(query, endpoint_index)] is a list with one
+    (decision, policy, level) tuple per user."""
+    def __init__(self, users, endpoints):
+        self.users = users # user IRIs, one per column of the bitsets
+        self.endpoints = endpoints # list of (fdp_uri, endpoint_url)
+        self.cells = {}
+
+    def to_dataframe(self):
+        rows = []
+        for (query, e), decisions in self.cells.items():
+            fdp_uri, endpoint_url = self.endpoints[e]
+            for user, (decision, policy, level) in zip(self.users, decisions):
+                rows.append({
+                    "query": str(query),
+                    "user": str(user),
+                    "fdp": fdp_uri,
+                    "endpoint": endpoint_url,
+                    "decision": decision,
+                    "policy": str(policy) if policy is not None else None,
+                    "level": level,
+                })
+        return pd.DataFrame(rows, columns=["query", "user", "fdp", "endpoint", "decision", "policy", "level"])
+
+    def pivot(self, query=None):
+        """users x endpoints table of the decisions for one query (the first one if not given)"""
+        df = self.to_dataframe()
+        if query is None and len(df):
+            query = df["query"].iloc[0]
+        df = df[df["query"] == str(query)]
+        return df.pivot_table(index="user", columns="endpoint", values="decision", aggfunc="first")
+
+
+def iter_bits(mask):
+    """Indices of the set bits of mask, lowest first. Takes as many steps as there are set bits."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class MatrixEvaluator:
+    """Bitset version of check_policy for one query and a fixed list of users"""
+    def __init__(self, users, query_graph, query_sbj, query_action, policy_store=None):
+        self.index = UserIndex(users)
+        self.query_graph = query_graph
+        self.query_sbj = query_sbj
+        self.query_action = query_action
+        self.policy_store = policy_store or get_default_policy_store()
+        self._levels = {} # (policy refs, mode) -> (mask, [policy per user])
+
+    def constraints_mask(self, constraints):
+        mask = self.index.all
+        for left, op, right in constraints:
+            if op != ODRL.eq:
+                logger.warning("ODRL Operator %s not yet supported.", op)
+                return 0
+            if self.query_graph.value(self.query_sbj, left) != right:
+                mask &= self.index.attribute_mask(left, right)
+            if not mask:
+                break
+        return mask
+
+    def level_mask(self, policy_refs, mode):
+        """Users for which one of these policies has a matching rule of this mode, and per user the first
+        policy that matched (the one check_policy would return)"""
+        policy_set = self.policy_store.get_policy_set(policy_refs)
+        key = (policy_set.policy_refs, mode)
+        if key in self._levels:
+            return self._levels[key]
+
+        matched = 0
+        policies = [None] * len(self.index.users)
+        for user, user_bits in self.index.bits.items():
+            for policy, constraints in policy_set.lookup(mode, user, self.query_action):
+                new = self.constraints_mask(constraints) & user_bits & ~matched
+                if new:
+                    matched |= new
+                    for i in iter_bits(new):
+                        policies[i] = policy
+                if user_bits & ~matched == 0:
+                    break
+        self._levels[key] = (matched, policies)
+        return matched, policies
+
+    def evaluate(self, hierarchy):
+        """[(decision, policy, level)] per user for one endpoint, same order of checks as evaluate_fdp"""
+        decisions = [(NO_PERMISSION, None, None)] * len(self.index.users)
+        decided = 0
+        for mode, decision in (("prohibition", DENIED), ("permission", ALLOWED)):
+            for level_name, policy_refs in hierarchy:
+                matched, policies = self.level_mask(policy_refs, mode)
+                new = matched & ~decided
+                if not new:
+                    continue
+                decided |= new
+                for i in iter_bits(new):
+                    decisions[i] = (decision, policies[i], level_name)
+                if decided == self.index.all:
+                    return decisions
+        return decisions
+
+
+def compute_access_matrix(crawled_fdps, users, prepared_queries, policy_store=None):
+    """crawled_fdps: list of (fdp_uri, FDP), users: list of (user_graph, user), prepared_queries: tuples as
+    returned by prepare_queries (only the query parts are used). Never runs a query."""
+    endpoints = []
+    hierarchies = []
+    for fdp_uri, fdp in crawled_fdps:
+        for hierarchy, endpoint_url in iter_endpoints(fdp):
+            endpoints.append((fdp_uri, endpoint_url))
+            hierarchies.append(hierarchy)
+
+    matrix = AccessMatrix([user for _, user in users], endpoints)
+    for query_graph, query_sbj, query_action, _, _ in prepared_queries:
+        evaluator = MatrixEvaluator(users, query_graph, query_sbj, query_action, policy_store=policy_store)
+        for e, hierarchy in enumerate(hierarchies):
+            matrix.cells[(query_sbj, e)] = evaluator.evaluate(hierarchy)
+    return matrix
+
+def load_users(input_user_graphs, input_graph_type):
+    """Every foaf:Person of every user graph (or file) as a (user_graph, user) tuple"""
+    users = []
+    for input_user_graph in input_user_graphs:
+        user_graph = Graph().parse(input_user_graph, format="turtle") if input_graph_type == 'path' else input_user_graph
+        for user in user_graph.subjects(RDF.type, FOAF.Person, unique=True):
+            users.append((user_graph, user))
+    return users
+
+def access_matrix(fdp_uris, input_user_graphs, input_query_graph, input_graph_type, crawl_options=None):
+    """Crawl the FDPs once and compute the access matrix of all users in input_user_graphs for the queries
+    in input_query_graph. Returns an AccessMatrix, see to_dataframe / pivot."""
+    users = load_users(input_user_graphs, input_graph_type)
+    if not users:
+        raise ValueError("No foaf:Person found in the user graphs")
+    query_graph = Graph().parse(input_query_graph, format="turtle") if input_graph_type == 'path' else input_query_graph
+    prepared_queries = prepare_queries(users[0][0], query_graph, 'graph')
+    crawled = list(zip(fdp_uris, crawl_fdps(fdp_uris, **(crawl_options or {}))))
+    return compute_access_matrix(crawled, users, prepared_queries)
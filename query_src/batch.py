@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import time
+
+from .fdp_crawler import crawl_fdps, prepare_queries, iter_evaluate_crawled
+from .decision_cache import DecisionCache
+from .query_runner import QueryExecutor
+
+logger = logging.getLogger(__name__)
+
+RESULT_KEYS = ["query", "fdp", "endpoint", "allowed", "reason", "policy", "row_count", "truncated", "truncated_reason", "spill_path", "cached"]
+
+
+def read_batch_requests(path):
+    """Read a JSON lines file with one request per line, e.g.
+    {"id": "bob-q1", "user": "users/bob.ttl", "query": "questions/query1.ttl"}
+    Relative paths are resolved against the directory of the batch file."""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    batch = []
+    with open(path) as f:
+        for line_nr, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            request.setdefault("id", str(line_nr))
+            for key in ("user", "query"):
+                if key not in request:
+                    raise ValueError(f"Request on line {line_nr} of {path} has no '{key}'")
+                request[key] = os.path.join(base_dir, request[key])
+            batch.append(request)
+    return batch
+
+def result_line(request_id, res, include_data):
+    line = {"request_id": request_id}
+    for key in RESULT_KEYS:
+        if key in res:
+            line[key] = str(res[key]) if key == "policy" and res[key] is not None else res[key]
+    if include_data and "data" in res:
+        line["data"] = res["data"]
+    return line
+
+def run_batch(fdp_uris, batch, out_file, include_data=True, crawl_options=None, query_executor=None):
+    """Evaluate many (user graph, query graph) requests against a single crawl of every FDP. Writes one JSON
+    line per request and endpoint to out_file (an open text file) and returns the throughput numbers."""
+    stats = {"requests": len(batch), "failed_requests": 0, "decisions": 0, "queries": 0}
+    start = time.perf_counter()
+
+    fdps = crawl_fdps(fdp_uris, **(crawl_options or {}))
+    crawled = list(zip(fdp_uris, fdps))
+    stats["crawl_seconds"] = time.perf_counter() - start
+
+    # One decision cache for the whole batch: its keys include the user, action and the attributes the
+    # constraints look at, so requests that only differ in e.g. the query text share all decisions.
+    decision_cache = DecisionCache()
+    owns_executor = query_executor is None
+    if owns_executor:
+        query_executor = QueryExecutor()
+
+    eval_start = time.perf_counter()
+    try:
+        for request in batch:
+            try:
+                prepared_queries = prepare_queries(request["user"], request["query"], 'path')
+                if not prepared_queries:
+                    stats["failed_requests"] += 1
+                    out_file.write(json.dumps({"request_id": request["id"], "error": "Could not deduce action from query."}) + "\n")
+                    continue
+
+                for event, res in iter_evaluate_crawled(crawled, prepared_queries, decision_cache, query_executor):
+                    if event == "decision":
+                        stats["decisions"] += 1
+                        if res["allowed"]:
+                            stats["queries"] += 1
+                            continue # Written once the data is in
+                    out_file.write(json.dumps(result_line(request["id"], res, include_data)) + "\n")
+            except Exception as e:
+                # One broken request (e.g. a missing or unparsable user or query file) must not stop the batch
+                logger.exception("Request %s failed", request["id"])
+                stats["failed_requests"] += 1
+                out_file.write(json.dumps({"request_id": request["id"], "error": str(e)}) + "\n")
+    finally:
+        if owns_executor:
+            query_executor.shutdown()
+
+    stats["evaluation_seconds"] = time.perf_counter() - eval_start
+    stats["total_seconds"] = time.perf_counter() - start
+    stats["requests_per_second"] = stats["requests"] / stats["evaluation_seconds"] if stats["evaluation_seconds"] else 0.0
+    stats["decisions_per_second"] = stats["decisions"] / stats["evaluation_seconds"] if stats["evaluation_seconds"] else 0.0
+    stats["decision_cache"] = decision_cache.stats()
+    return stats
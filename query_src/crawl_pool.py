@@ -0,0 +1,159 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from urllib.parse import urlsplit
+
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_TIMEOUT = 10 # seconds, passed on to requests as the per-request timeout
+DEFAULT_RATE_PER_HOST = None # requests per second to one host, None for no limit
+
+
+class HostLimiter:
+    """Caps the number of requests that are in flight to a single host at the same time.
+    The global cap is the size of the thread pool, this one stops us from hammering one FDP server.
+    With rate_per_host requests to the same host are also spaced at least 1 / rate_per_host seconds apart.
+    Never blocks: the CrawlPool asks it which hosts may start a request now. Not thread safe on its own,
+    the pool calls it under its lock."""
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST, rate_per_host=DEFAULT_RATE_PER_HOST):
+        self.max_per_host = max_per_host
+        self.rate_per_host = rate_per_host
+        self._in_flight = {} # host -> requests running
+        self._next_start = {} # host -> earliest time the next request may start
+
+    def wait(self, host, now):
+        """Seconds until a request to host may start (0 for right away), None while all its slots are taken"""
+        if self._in_flight.get(host, 0) >= self.max_per_host:
+            return None
+        return max(0.0, self._next_start.get(host, now) - now)
+
+    def start(self, host, now):
+        self._in_flight[host] = self._in_flight.get(host, 0) + 1
+        if self.rate_per_host:
+            self._next_start[host] = max(now, self._next_start.get(host, now)) + 1 / self.rate_per_host
+
+    def finish(self, host):
+        self._in_flight[host] -= 1
+        if not self._in_flight[host]:
+            del self._in_flight[host]
+
+
+class CrawlPool:
+    """Thread pool used by the concurrent crawler. Only leaf fetches are submitted to this pool
+    (never a task that itself waits on the pool) so a single pool can be shared by several FDP crawls.
+
+    Fetches are not run first come first served. Every fetch is submitted for an owner (the FDP it is for),
+    and the next fetch to run is the one whose owner has had the fewest fetches since it last went idle.
+    The owners with work waiting take turns, so one large FDP cannot hold up the crawls of small ones.
+    Fetches wait in a queue per host and are only handed to a thread once their host has a free slot and
+    its rate limit allows it, so a slow or rate limited host never holds threads the other hosts could use."""
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_per_host=DEFAULT_MAX_PER_HOST, timeout=DEFAULT_TIMEOUT,
+                 rate_per_host=DEFAULT_RATE_PER_HOST):
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.limiter = HostLimiter(max_per_host, rate_per_host=rate_per_host)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fdp-crawl")
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queues = {} # host -> heap of (turn, seq, owner, future, fn, url)
+        self._seq = itertools.count()
+        self._turns = {} # owner -> fetches submitted since the owner had nothing waiting or running
+        self._active = {} # owner -> fetches waiting or running
+        self._running = 0
+        self._timer = None # Wakes the pool up when a rate limited host may start its next fetch
+        self._timer_at = None
+
+    def submit(self, fn, url, owner=None):
+        """Schedule fn(url, timeout=...). Returns a Future."""
+        future = Future()
+        host = urlsplit(str(url)).netloc
+        with self._lock:
+            if not self._active.get(owner):
+                self._turns[owner] = 0
+            turn = self._turns[owner]
+            self._turns[owner] = turn + 1
+            self._active[owner] = self._active.get(owner, 0) + 1
+            heapq.heappush(self._queues.setdefault(host, []), (turn, next(self._seq), owner, future, fn, url))
+            self._dispatch()
+        return future
+
+    def _dispatch(self):
+        # Called with the lock held. Starts the first fetch in line among the hosts that may start one now,
+        # until all threads are busy or nothing can start yet.
+        while self._running < self.max_workers:
+            now = time.monotonic()
+            best = None
+            wake = None
+            for host, queue in self._queues.items():
+                wait = self.limiter.wait(host, now)
+                if wait is None:
+                    continue
+                if wait > 0:
+                    wake = wait if wake is None else min(wake, wait)
+                elif best is None or queue[0][:2] < self._queues[best][0][:2]:
+                    best = host
+            if best is None:
+                if wake is not None:
+                    self._wake_at(now + wake)
+                return
+            queue = self._queues[best]
+            _, _, owner, future, fn, url = heapq.heappop(queue)
+            if not queue:
+                del self._queues[best]
+            self.limiter.start(best, now)
+            self._running += 1
+            self.executor.submit(self._run, best, owner, future, fn, url)
+
+    def _wake_at(self, at):
+        if self._timer_at is not None and self._timer_at <= at:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(at - time.monotonic(), self._wakeup)
+        self._timer.daemon = True
+        self._timer_at = at
+        self._timer.start()
+
+    def _wakeup(self):
+        with self._lock:
+            self._timer = self._timer_at = None
+            self._dispatch()
+
+    def _run(self, host, owner, future, fn, url):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(url, timeout=self.timeout))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            with self._lock:
+                self.limiter.finish(host)
+                self._running -= 1
+                self._active[owner] -= 1
+                if not self._active[owner]:
+                    del self._active[owner], self._turns[owner]
+                self._dispatch()
+                if not self._running and not self._queues:
+                    self._idle.notify_all()
+
+    def map(self, fn, urls, owner=None):
+        """Run fn(url, timeout=...) for all urls in parallel. Results are returned in the order of urls."""
+        futures = [self.submit(fn, url, owner=owner) for url in urls]
+        return [f.result() for f in futures]
+
+    def shutdown(self):
+        with self._lock:
+            while self._running or self._queues:
+                self._idle.wait()
+            if self._timer is not None:
+                self._timer.cancel()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,54 @@
+from collections import Counter
+
+from .policy_checker import check_policy
+from .policy_store import get_default_policy_store
+from .instrumentation import inc
+
+
+class DecisionCache:
+    """Memoizes check_policy results. Endpoints under the same catalog share the FDP and catalog level
+    policies, so their decisions only have to be computed once. The key contains everything a decision can
+    depend on: the policy references, the mode, the user, the action and the values of the user/query
+    attributes that the constraints of these policies refer to."""
+    def __init__(self, policy_store=None):
+        self.policy_store = policy_store or get_default_policy_store()
+        self._decisions = {}
+        self.computed = Counter() # level_name -> number of decisions evaluated
+        self.reused = Counter() # level_name -> number of decisions served from the cache
+
+    def decision_key(self, policy_refs, query_graph, query_sbj, query_action, user_graph, user, mode):
+        policy_set = self.policy_store.get_policy_set(policy_refs)
+        attributes = tuple(
+            (left, query_graph.value(query_sbj, left), user_graph.value(user, left))
+            for left in sorted(policy_set.operands, key=str)
+        )
+        return (policy_set.policy_refs, mode, user, query_action, attributes)
+
+    def check(self, level_name, policy_refs, query_graph, query_sbj, query_action, user_graph, user, endpoint_url, mode):
+        """Same arguments and return value as check_policy, with the hierarchy level in front for the statistics."""
+        key = self.decision_key(policy_refs, query_graph, query_sbj, query_action, user_graph, user, mode)
+        decision = self._decisions.get(key)
+        if decision is not None:
+            self.reused[level_name] += 1
+            inc("decisions", level=level_name, cache="hit")
+            return decision
+
+        decision = check_policy(policy_refs, query_graph, query_sbj, query_action, user_graph, user, endpoint_url,
+                                mode, policy_store=self.policy_store)
+        self._decisions[key] = decision
+        self.computed[level_name] += 1
+        inc("decisions", level=level_name, cache="miss")
+        return decision
+
+    def stats(self):
+        return {
+            "decisions": len(self._decisions),
+            "computed": dict(self.computed),
+            "reused": dict(self.reused),
+        }
+
+    def summary(self):
+        levels = ", ".join(f"{level} {self.computed[level]}/{self.reused[level]}"
+                           for level in sorted(set(self.computed) | set(self.reused)))
+        return (f"Decisions: {sum(self.computed.values())} computed, {sum(self.reused.values())} reused "
+                f"(computed/reused per level: {levels})")
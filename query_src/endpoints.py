@@ -0,0 +1,312 @@
+"""What the SPARQL endpoints found in the FDPs are, and which of them are down.
+
+A CapabilityCache probes an endpoint once per ttl: first a GET for its SPARQL 1.1 service description, and
+if there is none a POST of an empty ASK query. The probe tells whether the URL is a SPARQL endpoint at all,
+what kind of triplestore it is (from the Server header or the URL) and which result formats it offers.
+Endpoints that don't answer the probe are 'unknown' and fall back to the old check on the URL, so policy
+decisions don't change while a triplestore is down. Failed probes are cached for the shorter failure_ttl.
+
+Probes only run in the background (after a refresh of the RefreshScheduler, or after the service crawled an
+FDP), never while a request is evaluated: supported() and peek() only read the cache, and an endpoint that
+was not probed yet is judged by its URL. Probes go through the CircuitBreaker as well, so a dead host is not
+probed again during its cool-down.
+
+A CircuitBreaker keeps track of queries that fail or time out. After failure_threshold failures in a row an
+endpoint is skipped for cooldown seconds, then one query is let through to see if it is back."""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from rdflib import Graph, Namespace, RDF
+
+from .instrumentation import span, inc
+
+logger = logging.getLogger(__name__)
+
+SD = Namespace("http://www.w3.org/ns/sparql-service-description#")
+
+DEFAULT_PROBE_TTL = 3600 # seconds
+DEFAULT_FAILURE_TTL = 300 # seconds, for endpoints that did not answer the probe
+DEFAULT_PROBE_TIMEOUT = 5 # seconds
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 120 # seconds
+
+SPARQL_JSON = "application/sparql-results+json"
+# Result formats as named in service descriptions (http://www.w3.org/ns/formats/)
+FORMATS = {
+    "http://www.w3.org/ns/formats/SPARQL_Results_JSON": SPARQL_JSON,
+    "http://www.w3.org/ns/formats/SPARQL_Results_XML": "application/sparql-results+xml",
+    "http://www.w3.org/ns/formats/SPARQL_Results_CSV": "text/csv",
+    "http://www.w3.org/ns/formats/SPARQL_Results_TSV": "text/tab-separated-values",
+}
+# Substring of the Server header -> endpoint type
+SERVERS = (("allegro", "allegrograph"), ("virtuoso", "virtuoso"), ("fuseki", "fuseki"), ("jetty", "fuseki"),
+           ("graphdb", "graphdb"), ("blazegraph", "blazegraph"), ("stardog", "stardog"))
+URL_KEYWORDS = ("allegrograph", "sparql") # The check that was used before endpoints were probed
+
+
+def looks_like_sparql(url):
+    return any(kw in url for kw in URL_KEYWORDS)
+
+def detect_type(url, server_header):
+    server_header = (server_header or "").lower()
+    for needle, endpoint_type in SERVERS:
+        if needle in server_header:
+            return endpoint_type
+    return "allegrograph" if "allegrograph" in url else "sparql"
+
+
+class EndpointCapabilities:
+    """Outcome of one probe. queryable is True or False if the probe could tell, None if the endpoint did
+    not answer. result_formats is empty when the endpoint didn't say."""
+    def __init__(self, url, queryable=None, endpoint_type=None, result_formats=(), requires_auth=False,
+                 source=None, error=None):
+        self.url = url
+        self.queryable = queryable
+        self.type = endpoint_type
+        self.result_formats = tuple(result_formats)
+        self.requires_auth = requires_auth
+        self.source = source # "service-description", "ask" or None
+        self.error = error
+        self.probed_at = time.time()
+
+    @property
+    def supported(self):
+        """Whether queries are sent to this endpoint. Unknown endpoints fall back to looks_like_sparql."""
+        if self.queryable is None:
+            return looks_like_sparql(self.url)
+        return self.queryable
+
+    @property
+    def returns_json(self):
+        return not self.result_formats or SPARQL_JSON in self.result_formats
+
+    def to_dict(self):
+        return {"url": self.url, "queryable": self.queryable, "type": self.type,
+                "result_formats": list(self.result_formats), "requires_auth": self.requires_auth,
+                "source": self.source, "error": self.error, "probed_at": self.probed_at}
+
+
+def probe_endpoint(url, session=None, timeout=DEFAULT_PROBE_TIMEOUT):
+    """Find out what url is. Never raises, a failed probe gives queryable None."""
+    http = session or requests
+    try:
+        response = http.get(url, headers={"Accept": "text/turtle, application/rdf+xml;q=0.9"}, timeout=timeout)
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        if response.status_code == 200 and content_type in ("text/turtle", "application/rdf+xml"):
+            description = Graph().parse(data=response.text, format="turtle" if content_type == "text/turtle" else "xml")
+            service = description.value(predicate=RDF.type, object=SD.Service)
+            if service is not None:
+                formats = [FORMATS.get(str(f), str(f)) for f in description.objects(service, SD.resultFormat)]
+                return EndpointCapabilities(url, True, detect_type(url, response.headers.get("Server")), formats,
+                                            source="service-description")
+
+        response = http.post(url, data={"query": "ASK {}"}, timeout=timeout,
+                             headers={"Accept": SPARQL_JSON, "Content-Type": "application/x-www-form-urlencoded"})
+        endpoint_type = detect_type(url, response.headers.get("Server"))
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        if response.status_code in (401, 403):
+            # Queries are sent with the credentials of the user, the probe has none
+            return EndpointCapabilities(url, True, endpoint_type, requires_auth=True, source="ask")
+        if response.status_code == 200 and "sparql-results" in content_type:
+            return EndpointCapabilities(url, True, endpoint_type, [content_type], source="ask")
+        if response.status_code >= 500:
+            return EndpointCapabilities(url, None, endpoint_type, source="ask",
+                                        error=f"ASK returned {response.status_code}")
+        return EndpointCapabilities(url, False, endpoint_type, source="ask",
+                                    error=f"ASK returned {response.status_code} {content_type or 'without content type'}")
+    except requests.RequestException as e:
+        return EndpointCapabilities(url, None, error=str(e))
+    except Exception as e: # rdflib parser errors don't share a base class
+        return EndpointCapabilities(url, None, error=f"Could not read the service description: {e}")
+
+
+class CapabilityCache:
+    """EndpointCapabilities per endpoint URL. Concurrent callers for the same endpoint wait for one probe."""
+    def __init__(self, ttl=DEFAULT_PROBE_TTL, failure_ttl=DEFAULT_FAILURE_TTL, timeout=DEFAULT_PROBE_TIMEOUT,
+                 max_workers=8, prober=probe_endpoint, circuit_breaker=None):
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.prober = prober
+        self._circuit_breaker = circuit_breaker # None for the shared default, False for none
+        self.session = requests.Session()
+        self._entries = {} # url -> EndpointCapabilities
+        self._probing = {} # url -> Event
+        self._lock = threading.Lock()
+        self._background = None # executor for probe_in_background, created on first use
+
+    @property
+    def circuit_breaker(self):
+        return get_default_circuit_breaker() if self._circuit_breaker is None else self._circuit_breaker
+
+    def peek(self, url):
+        """The last probe of url, however old, or None if it was never probed. Never sends a request."""
+        with self._lock:
+            return self._entries.get(url)
+
+    def supported(self, url):
+        """Whether queries are sent to url, from the cache only. Endpoints that were not probed yet are
+        judged by their URL."""
+        capabilities = self.peek(url)
+        return capabilities.supported if capabilities is not None else looks_like_sparql(url)
+
+    def _fresh(self, capabilities):
+        ttl = self.ttl if capabilities.queryable is not None else self.failure_ttl
+        return time.time() - capabilities.probed_at < ttl
+
+    def get(self, url):
+        """Capabilities of url, probing it if the cache has nothing fresh. Blocks, so only for background work."""
+        while True:
+            with self._lock:
+                capabilities = self._entries.get(url)
+                if capabilities is not None and self._fresh(capabilities):
+                    inc("probe_cache", cache="hit")
+                    return capabilities
+                probing = self._probing.get(url)
+                if probing is None:
+                    probing = self._probing[url] = threading.Event()
+                    break
+            probing.wait()
+
+        inc("probe_cache", cache="miss")
+        try:
+            breaker = self.circuit_breaker
+            if breaker and not breaker.allow(url):
+                # Down, don't wait for it again. Keep what we knew, the next probe after the cool-down updates it.
+                return self.peek(url) or EndpointCapabilities(url, None, error="Skipped after repeated failures")
+            with span("probe", uri=url) as tags:
+                capabilities = self.prober(url, session=self.session, timeout=self.timeout)
+                tags["status"] = {True: "ok", False: "unsupported", None: "failed"}[capabilities.queryable]
+            if breaker:
+                if capabilities.queryable is None:
+                    breaker.record_failure(url)
+                else:
+                    breaker.record_success(url)
+            if capabilities.queryable is None:
+                logger.info("Could not probe %s (%s), deciding on its URL", url, capabilities.error)
+            elif not capabilities.queryable:
+                logger.warning("%s is not a SPARQL endpoint: %s", url, capabilities.error)
+            with self._lock:
+                self._entries[url] = capabilities
+            return capabilities
+        finally:
+            with self._lock:
+                del self._probing[url]
+            probing.set()
+
+    def probe_all(self, urls):
+        """Probe every url that is not cached yet, in parallel"""
+        with self._lock:
+            missing = list(dict.fromkeys(url for url in urls
+                                         if url not in self._entries or not self._fresh(self._entries[url])))
+        if len(missing) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing)), thread_name_prefix="probe") as executor:
+                list(executor.map(self.get, missing))
+        elif missing:
+            self.get(missing[0])
+
+    def probe_in_background(self, urls):
+        """probe_all in a background thread, returns right away"""
+        urls = list(urls)
+        with self._lock:
+            if self._background is None:
+                self._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="probe-background")
+            background = self._background
+        background.submit(self._probe_quietly, urls)
+
+    def _probe_quietly(self, urls):
+        try:
+            self.probe_all(urls)
+        except Exception:
+            logger.exception("Probing endpoints failed")
+
+    def invalidate(self, url=None):
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(url, None)
+
+    def stats(self):
+        with self._lock:
+            return {url: capabilities.to_dict() for url, capabilities in self._entries.items()}
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = {} # url -> consecutive failures
+        self._open_until = {} # url -> time until which the endpoint is skipped
+        self._trial = set() # urls with a query in flight after their cool-down
+        self._lock = threading.Lock()
+
+    def allow(self, url):
+        """Whether a query may be sent to url now. After the cool-down one query at a time is let through."""
+        with self._lock:
+            open_until = self._open_until.get(url)
+            if open_until is None:
+                return True
+            if time.time() < open_until or url in self._trial:
+                return False
+            self._trial.add(url)
+            return True
+
+    def retry_in(self, url):
+        with self._lock:
+            return max(0.0, self._open_until.get(url, 0) - time.time())
+
+    def record_success(self, url):
+        with self._lock:
+            self._failures.pop(url, None)
+            self._open_until.pop(url, None)
+            self._trial.discard(url)
+
+    def record_failure(self, url):
+        with self._lock:
+            failures = self._failures[url] = self._failures.get(url, 0) + 1
+            self._trial.discard(url)
+            if failures >= self.failure_threshold:
+                if url not in self._open_until or time.time() >= self._open_until[url]:
+                    logger.warning("%s failed %d times in a row, skipping it for %ss", url, failures, self.cooldown)
+                    inc("circuit_opened")
+                self._open_until[url] = time.time() + self.cooldown
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {url: {"failures": self._failures.get(url, 0), "retry_in": max(0.0, until - now)}
+                    for url, until in self._open_until.items()}
+
+
+_default_capabilities = None
+_default_breaker = None
+_default_lock = threading.Lock()
+
+def get_default_capability_cache():
+    global _default_capabilities
+    with _default_lock:
+        if _default_capabilities is None:
+            _default_capabilities = CapabilityCache()
+        return _default_capabilities
+
+def set_default_capability_cache(cache):
+    global _default_capabilities
+    with _default_lock:
+        _default_capabilities = cache
+
+def get_default_circuit_breaker():
+    global _default_breaker
+    with _default_lock:
+        if _default_breaker is None:
+            _default_breaker = CircuitBreaker()
+        return _default_breaker
+
+def set_default_circuit_breaker(breaker):
+    global _default_breaker
+    with _default_lock:
+        _default_breaker = breaker
@@ -1,68 +1,82 @@
-import requests
+import logging
+import time
 import rdflib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from rdflib import Graph
-from rdflib.namespace import DCAT, XSD, Namespace, RDF, FOAF
-from .policy_checker import check_policy, deduce_action_from_query
-from .query_runner import run_query
+from rdflib.namespace import DCAT, DCTERMS, Namespace, RDF, FOAF
+from .policy_checker import deduce_action_from_query
+from .query_runner import QueryExecutor, QUERY_CANCELLED
+from .http_cache import get_default_cache
+from .policy_store import get_default_policy_store
+from .decision_cache import DecisionCache
+from .crawl_pool import CrawlPool, DEFAULT_MAX_WORKERS, DEFAULT_MAX_PER_HOST, DEFAULT_TIMEOUT, DEFAULT_RATE_PER_HOST
+from .resources import Distribution, Dataset, Catalog, FDP, LEVELS, CHILDREN, policy_ref, compact, intern_uri
+from .policy_index import PolicyClosure
+from .frontier import CrawlFrontier
+from .endpoints import get_default_capability_cache
+from .snapshot import load_snapshot, save_snapshot
+from .instrumentation import span, inc
+from .metadata_extract import ACCEPT, parse_document
 
 LDP = Namespace("http://www.w3.org/ns/ldp#")
 ODRL = Namespace("http://www.w3.org/ns/odrl/2/")
 EX = Namespace("http://example.org/")
 
-class PolicyAwareResource:
-    def __init__(self, uri):
-        self.uri = uri
-        self.policies = []
+logger = logging.getLogger(__name__)
 
-class Distribution(PolicyAwareResource):
-    def __init__(self, uri):
-        super().__init__(uri)
-        self.sparql_endpoints = []
-
-class Dataset(PolicyAwareResource):
-    def __init__(self, uri):
-        super().__init__(uri)
-        self.distributions = []
-
-class Catalog(PolicyAwareResource):
-    def __init__(self, uri):
-        super().__init__(uri)
-        self.datasets = []
+def parse_rdf_graph(url, timeout=None, level=None):
+    """Fetch and parse an FDP document. Goes through the on-disk HTTP cache, so unchanged documents
+    are not downloaded again (see http_cache.py for the ttl and revalidation)."""
+    g, _ = fetch_rdf_document(url, timeout=timeout, level=level)
+    return g
 
-class FDP(PolicyAwareResource):
-    def __init__(self, base_uri):
-        super().__init__(base_uri)
-        self.catalogs = []
+def fetch_rdf_document(url, timeout=None, previous=None, level=None):
+    """Like parse_rdf_graph, but also returns the response (None if the request failed) for its validators.
+    If previous is the resource from an earlier crawl the document is always revalidated with the server,
+    and when its ETag / Last-Modified still match the graph is not parsed at all and None is returned.
 
-def parse_rdf_graph(url):
+    N-Triples are requested first. If the server sends them only the triples the crawler uses end up in the
+    graph (see metadata_extract.py), otherwise the full turtle document is parsed."""
     g = rdflib.Graph()
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        g.parse(data=response.text, format="turtle")
+        with span("fetch", uri=url, level=level) as tags:
+            response = get_default_cache().get(url, timeout=timeout, accept=ACCEPT, revalidate=previous is not None)
+            tags["cache"] = "revalidated" if response.revalidated else "hit" if response.from_cache else "miss"
     except Exception as e:
-        print(f"Failed to parse RDF from {url}: {e}")
-    return g
+        logger.error("Failed to fetch RDF from %s: %s", url, e)
+        return g, None
 
-def extract_policies(graph, subject, include_fallback=False):
+    if previous is not None and is_unchanged(previous, response):
+        return None, response
+    try:
+        with span("parse", uri=url, level=level) as tags:
+            g, tags["format"] = parse_document(response.text, response.content_type)
+    except Exception as e:
+        logger.error("Failed to parse RDF from %s: %s", url, e)
+    return g, response
+
+def is_unchanged(previous, response):
+    if response.etag and previous.etag:
+        return response.etag == previous.etag
+    if response.last_modified and previous.last_modified:
+        return response.last_modified == previous.last_modified
+    return False
+
+def extract_policies(graph, subject, include_fallback=False, ref_table=None):
     """Find ODRL policies included in an FDP resource file. The fallback checks if any policies are present
     in a resource file if it didn't find any based on the given URI. This is as a fallback in case the 
-    self referencing URI doesn't match the given URI."""
-    policies = []
+    self referencing URI doesn't match the given URI. ref_table is the RefTable of the crawl, if any."""
+    refs = list(graph.objects(subject, ODRL.hasPolicy))
+    if len(refs) == 0 and include_fallback:
+        refs = [ref for _, ref in graph.subject_objects(ODRL.hasPolicy)]
 
-    for ref in graph.objects(subject, ODRL.hasPolicy) :
+    # BNode policies only keep their own triples, not the graph of the whole document
+    policies = []
+    for ref in refs:
         if isinstance(ref, rdflib.BNode):
-            policies.append((ref, graph))
+            policies.append(policy_ref(ref, PolicyClosure.from_graph(graph, ref)))
         else:
-            policies.append((ref, None))
-
-    if len(policies) == 0 and include_fallback:
-        for _, ref in graph.subject_objects(ODRL.hasPolicy):
-            if isinstance(ref, rdflib.BNode):
-                policies.append((ref, graph))
-            else:
-                policies.append((ref, None))
-        
+            policies.append(policy_ref(ref, ref_table=ref_table))
     return policies
 
 def navigate_down_fdp(graph, uri, nav_predicate=LDP.contains):
@@ -78,54 +92,214 @@ def navigate_down_fdp(graph, uri, nav_predicate=LDP.contains):
     if len(uris) > 0:
         return uris
 
-    print('falling back')
+    logger.debug("No %s found for %s, falling back to all %s objects in the document", nav_predicate, uri, nav_predicate)
     # Fallback
     for _, cat_uri in graph.subject_objects(nav_predicate):
             uris.append(cat_uri)
-    return uris
+    return list(dict.fromkeys(uris)) # The same resource may be contained by several subjects
+
+
 
 
+def document_key(url, previous=None):
+    """Key of a fetch in the CrawlFrontier. A revalidation against an earlier crawl may come back as 'not
+    changed' (no graph), so it is only shared with fetches against the same validators."""
+    if previous is None:
+        return (str(url), None)
+    return (str(url), previous.etag, previous.last_modified)
 
+def crawl_fdp(base_uri, frontier=None):
+    frontier = frontier or CrawlFrontier()
+    def parse(uri, level, ancestors):
+        if not frontier.admit(uri, ancestors, len(ancestors)):
+            return None
+        graph, _ = frontier.fetch(document_key(uri), lambda: fetch_rdf_document(str(uri), level=level))
+        return graph
 
-def crawl_fdp(base_uri):
     fdp = FDP(base_uri)
-    g_base = parse_rdf_graph(base_uri)
-    fdp.policies.extend(extract_policies(g_base, rdflib.URIRef(base_uri), include_fallback=True))
+    g_base = parse(base_uri, "FDP", ())
+    if g_base is None:
+        return compact(fdp)
+    fdp.policies.extend(extract_policies(g_base, rdflib.URIRef(base_uri), include_fallback=True, ref_table=frontier.ref_table))
 
     for cat_uri in navigate_down_fdp(g_base, base_uri):
-        print(cat_uri)
+        g_cat = parse(cat_uri, "Catalog", (fdp.uri,))
+        if g_cat is None:
+            continue
         catalog = Catalog(str(cat_uri))
-        g_cat = parse_rdf_graph(str(cat_uri))
-        catalog.policies.extend(extract_policies(g_cat, cat_uri, include_fallback=True))
+        catalog.policies.extend(extract_policies(g_cat, cat_uri, include_fallback=True, ref_table=frontier.ref_table))
 
         for ds_uri in navigate_down_fdp(g_cat, cat_uri):
+            g_ds = parse(ds_uri, "Dataset", (fdp.uri, catalog.uri))
+            if g_ds is None:
+                continue
             dataset = Dataset(str(ds_uri))
-            g_ds = parse_rdf_graph(str(ds_uri))
-            dataset.policies.extend(extract_policies(g_ds, ds_uri, include_fallback=True))
+            dataset.policies.extend(extract_policies(g_ds, ds_uri, include_fallback=True, ref_table=frontier.ref_table))
 
             for dist_uri in navigate_down_fdp(g_ds, ds_uri):
+                g_dist = parse(dist_uri, "Distribution", (fdp.uri, catalog.uri, dataset.uri))
+                if g_dist is None:
+                    continue
                 distribution = Distribution(str(dist_uri))
-                g_dist = parse_rdf_graph(str(dist_uri))
-                distribution.policies.extend(extract_policies(g_dist, dist_uri, include_fallback=True))
+                distribution.policies.extend(extract_policies(g_dist, dist_uri, include_fallback=True, ref_table=frontier.ref_table))
 
                 for sparql_endpoint in g_dist.objects(dist_uri, DCAT.accessURL): # Does not have the same fallback
                     distribution.sparql_endpoints.append(str(sparql_endpoint))
-                    print(sparql_endpoint)
 
                 dataset.distributions.append(distribution)
             catalog.datasets.append(dataset)
         fdp.catalogs.append(catalog)
-    return fdp
+    return compact(fdp)
+
+def crawl_fdp_concurrent(base_uri, pool, previous=None, stats=None, frontier=None):
+    """Builds the same tree as crawl_fdp, but walks the FDP level by level. All ldp:contains children
+    of one level (e.g. every dataset of every catalog) are fetched in parallel through the CrawlPool.
+
+    If previous (the FDP of an earlier crawl, e.g. from a snapshot) is given the crawl is incremental: known
+    nodes are revalidated with a conditional GET, and nodes whose HTTP validators did not change are taken
+    over from previous without parsing or extracting anything. Children that are no longer listed are dropped. stats (a dict) is filled with the number of parsed, unchanged, new and removed nodes,
+    the number of documents that could not be fetched (failed) and of links that were not followed because
+    of a cycle or a crawl limit (skipped).
+
+    frontier is the CrawlFrontier of the run, shared with the crawls of the other FDPs. A new one is used if
+    not given. Fetches are submitted to the pool with this FDP as owner, see CrawlPool."""
+    if stats is None:
+        stats = {}
+    for key in ("parsed", "unchanged", "new", "removed", "failed", "skipped"):
+        stats.setdefault(key, 0)
+    frontier = frontier or CrawlFrontier()
+
+    root = None
+    # (parent, parent children attribute, uri, previous node, uris of the parent and everything above it).
+    # uris are always str: navigate_down_fdp gives URIRefs, previous nodes and fetches use str.
+    pending = [(None, None, intern_uri(base_uri), previous, ())]
+    if not frontier.admit(base_uri, (), 0):
+        stats["skipped"] += 1
+        return compact(FDP(base_uri))
+    for node_cls, children_attr in LEVELS:
+        previous_nodes = {uri: prev for _, _, uri, prev, _ in pending if prev is not None}
+        level = node_cls.__name__
+        documents = frontier.fetch_all(
+            pool, lambda url, timeout: fetch_rdf_document(url, timeout=timeout, previous=previous_nodes.get(url), level=level),
+            [(document_key(uri, prev), uri) for _, _, uri, prev, _ in pending], owner=base_uri)
+
+        # Attach in the same order as the sequential crawl so both modes give identical trees
+        next_pending = []
+        for (parent, parent_attr, uri, prev, ancestors), (graph, response) in zip(pending, documents):
+            node = node_cls(uri)
+            node_uri = rdflib.URIRef(uri)
+            node.fetched_at = time.time()
+            if response is None:
+                stats["failed"] += 1
+            if response is not None:
+                node.etag, node.last_modified = response.etag, response.last_modified
+            elif prev is not None:
+                graph = None # Fetch failed, keep what we knew instead of dropping the whole subtree
+                node.etag, node.last_modified = prev.etag, prev.last_modified
+
+            # graph is None only if the server said not modified, or the fetch failed. A document that was
+            # downloaded again is always used, whatever its dct:modified says.
+            if graph is None:
+                stats["unchanged"] += 1
+                node.modified = prev.modified
+                node.policies = prev.policies
+                if node_cls is Distribution:
+                    node.sparql_endpoints = list(prev.sparql_endpoints)
+                children = [(child.uri, child) for child in getattr(prev, children_attr)] if children_attr else []
+            else:
+                stats["parsed" if prev is not None else "new"] += 1
+                modified = graph.value(node_uri, DCTERMS.modified)
+                node.modified = str(modified) if modified is not None else None
+                node.policies.extend(extract_policies(graph, node_uri, include_fallback=True, ref_table=frontier.ref_table))
+                if node_cls is Distribution:
+                    for sparql_endpoint in graph.objects(node_uri, DCAT.accessURL): # Does not have the same fallback
+                        node.sparql_endpoints.append(str(sparql_endpoint))
+                children = []
+                if children_attr:
+                    previous_children = {child.uri: child for child in getattr(prev, children_attr)} if prev is not None else {}
+                    for child_uri in navigate_down_fdp(graph, uri):
+                        child_uri = intern_uri(child_uri)
+                        children.append((child_uri, previous_children.pop(child_uri, None)))
+                    stats["removed"] += len(previous_children)
+
+            if parent is None:
+                root = node
+            else:
+                getattr(parent, parent_attr).append(node)
+            path = ancestors + (node.uri,)
+            for child_uri, prev_child in children:
+                if frontier.admit(child_uri, path, len(path)):
+                    next_pending.append((node, children_attr, child_uri, prev_child, path))
+                else:
+                    stats["skipped"] += 1
+        pending = next_pending
+    return compact(root)
+
+def iter_crawl_fdps(fdp_uris, concurrent=True, max_workers=DEFAULT_MAX_WORKERS, max_per_host=DEFAULT_MAX_PER_HOST,
+                    timeout=DEFAULT_TIMEOUT, max_parallel_fdps=4, snapshot_path=None, snapshot_max_age=None,
+                    rate_per_host=DEFAULT_RATE_PER_HOST, max_depth=None, max_nodes=None):
+    """Crawl all given FDPs and yield (fdp_uri, FDP) tuples as the crawls finish. In concurrent mode
+    several FDPs are crawled at the same time and share one fetch pool, so max_workers is a global limit.
+    All crawls of one call share a CrawlFrontier: a document is fetched only once, even if it is listed by
+    several FDPs, and max_nodes is a limit for all FDPs together (see frontier.py).
+
+    With a snapshot_path (an SQLite file, see snapshot.py) an FDP whose snapshot is younger than
+    snapshot_max_age seconds is loaded from it without any request. Older snapshots are the starting point
+    of an incremental crawl, and the result is written back to the snapshot file."""
+    frontier = CrawlFrontier(max_depth=max_depth, max_nodes=max_nodes)
+    if not concurrent:
+        if snapshot_path is None:
+            for fdp_uri in fdp_uris:
+                yield fdp_uri, crawl_fdp(fdp_uri, frontier=frontier)
+            return
+        max_workers, max_parallel_fdps = 1, 1
+
+    with CrawlPool(max_workers=max_workers, max_per_host=max_per_host, timeout=timeout, rate_per_host=rate_per_host) as pool:
+        def crawl(fdp_uri):
+            if snapshot_path is None:
+                return crawl_fdp_concurrent(fdp_uri, pool, frontier=frontier)
+            previous, crawled_at = load_snapshot(snapshot_path, fdp_uri)
+            if previous is not None and snapshot_max_age is not None and time.time() - crawled_at < snapshot_max_age:
+                return previous
+            stats = {}
+            fdp = crawl_fdp_concurrent(fdp_uri, pool, previous=previous, stats=stats, frontier=frontier)
+            save_snapshot(snapshot_path, fdp)
+            logger.info("Crawled %s: %d new, %d changed, %d unchanged, %d removed nodes",
+                        fdp_uri, stats['new'], stats['parsed'], stats['unchanged'], stats['removed'])
+            return fdp
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_parallel_fdps, len(fdp_uris)))) as fdp_executor:
+            futures = {fdp_executor.submit(crawl, fdp_uri): fdp_uri for fdp_uri in fdp_uris}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+    logger.info("Crawled %d nodes, %d documents shared, %d cycles, %d links past the crawl limits",
+                frontier.nodes, frontier.stats["shared"], frontier.stats["cycles"], frontier.stats["truncated"])
+
+def crawl_fdps(fdp_uris, **crawl_options):
+    """Crawl all given FDPs and return the FDP objects in the same order as fdp_uris"""
+    fdps = dict(iter_crawl_fdps(fdp_uris, **crawl_options))
+    return [fdps[fdp_uri] for fdp_uri in fdp_uris]
 
 def check_if_supported(url):
-    """Check what this endpoint is and if it is automatically queryable"""
-    supported_keywords = ['allegrograph', 'sparql']
-    for kw in supported_keywords:
-        if kw in url:
-            return True
-    return False
+    """Check what this endpoint is and if it is automatically queryable. Only reads what the background
+    endpoint probes found (see endpoints.py), endpoints that were not probed yet are judged by their URL."""
+    return get_default_capability_cache().supported(url)
+
+def endpoint_urls(fdp):
+    return [url for catalog in fdp.catalogs for dataset in catalog.datasets
+            for distribution in dataset.distributions for url in distribution.sparql_endpoints]
+
+def probe_endpoints(fdp, background=False):
+    """Probe all endpoints of a crawled FDP, so check_if_supported knows what they are. Sends requests to
+    every endpoint, so never call this while evaluating a request (use background=True there)."""
+    if background:
+        get_default_capability_cache().probe_in_background(endpoint_urls(fdp))
+    else:
+        get_default_capability_cache().probe_all(endpoint_urls(fdp))
 
-def prepare_query(input_user_graph, input_query_graph, input_graph_type):
+def prepare_queries(input_user_graph, input_query_graph, input_graph_type):
+    """Returns one (query_graph, query_sbj, query_action, user_graph, user) tuple for every odrl:Action in the
+    query graph, sorted by query subject. Queries whose action can't be deduced are left out."""
     if input_graph_type == 'path':
         user_graph  = Graph().parse(input_user_graph,  format="turtle")
         query_graph = Graph().parse(input_query_graph, format="turtle")
@@ -135,115 +309,227 @@ def prepare_query(input_user_graph, input_query_graph, input_graph_type):
     else:
         raise TypeError(f"Unknown input type {input_graph_type}")
 
-    # Find all unique sbj that are ODRL Actions. Use this for extracting attributes
-    i = 0
-    for query_sbj in query_graph.subjects(RDF.type, ODRL.Action, unique=True):
-        i += 1
-    if i > 1:
-        print(f"WARNING: CURRENTLY ONLY SUPPORTING ONE QUERY. ONLY EXECUTING {query_sbj}")
-
-    query_action = deduce_action_from_query(query_graph.value(query_sbj, EX.queryText))
-    if query_action is None:
-        print("Could not deduce action from query.")
-        return False
-
     i = 0
     for user in user_graph.subjects(RDF.type, FOAF.Person, unique=True): # Assumes this declaration!
         i += 1
     if i > 1:
-        print(f"WARNING: CURRENTLY ONLY SUPPORTING ONE USER PER FILE. USING PROFILE {user}")
-
-    ########
-    
-    return query_graph, query_sbj, query_action, user_graph, user
+        logger.warning("Currently only supporting one user per file. Using profile %s", user)
 
-def query_orchestrator(fdp_uris, input_user_graph, input_query_graph, input_graph_type):
-    """Main function that crawls all provided FDPs, orchestrates policy checking and query execution"""
-
-    # Maybe also put this into one or more objects?
-    # Extract all required information for later matching etc. in the right variables
-    print("STARTING NEW RUN")
-    query_graph, query_sbj, query_action, user_graph, user = prepare_query(input_user_graph, input_query_graph, input_graph_type)
-    results = []
-
-    for fdp_uri in fdp_uris:
-        print(f"\nProcessing FDP: {fdp_uri}")
-        fdp = crawl_fdp(fdp_uri) 
-        # This returns an FDP object with nested in it. Each object points down and has a set of policies
-        # 1. Catalog
-        # 2. Dataset
-        # 3. Distribution
-        # 4. Endpoints (Assumed to be triplestores)
-
-        # Find each endpoint and do all below code for all defined endpoints
-        for catalog in fdp.catalogs:
-            for dataset in catalog.datasets:
-                for distribution in dataset.distributions:
-                    for endpoint_url in distribution.sparql_endpoints:
-                        # Check what this endpoint is - only continue if it is a supported Triplestore
-                        if not check_if_supported(endpoint_url):
-                            print(f"ERROR: URL {endpoint_url} is not supported in the current version.")
-                            continue
-
-                        res = {
-                            "fdp": fdp_uri,
-                            "endpoint": endpoint_url,
-                            "allowed": None
-                        }
-
-                        #print(f"Checking access for endpoint: {endpoint_url}")
-
-                        hierarchy = [
-                            ("FDP", fdp.policies),
-                            ("Catalog", catalog.policies),
-                            ("Dataset", dataset.policies),
-                            ("Distribution", distribution.policies),
-                        ]
+    # Find all unique sbj that are ODRL Actions. Use this for extracting attributes
+    prepared = []
+    for query_sbj in sorted(query_graph.subjects(RDF.type, ODRL.Action, unique=True), key=str):
+        query_action = deduce_action_from_query(query_graph.value(query_sbj, EX.queryText))
+        if query_action is None:
+            logger.error("Could not deduce action from query %s.", query_sbj)
+            continue
+        prepared.append((query_graph, query_sbj, query_action, user_graph, user))
+    return prepared
 
+def prepare_query(input_user_graph, input_query_graph, input_graph_type):
+    """Single query version of prepare_queries. Returns the prepared tuple of the first query, or False
+    if no query with a known action was found."""
+    prepared = prepare_queries(input_user_graph, input_query_graph, input_graph_type)
+    if not prepared:
+        return False
+    if len(prepared) > 1:
+        logger.warning("Query graph has %d queries, only using %s", len(prepared), prepared[0][1])
+    return prepared[0]
+
+def query_signature(query_graph, query_sbj, query_action, operands):
+    """Everything about a query that the policies can look at: the action and the values of the query attributes
+    that their constraints read (operands, e.g. the purpose). Queries with the same signature get the same
+    decision at every endpoint, per request values such as a timestamp or the query text don't matter."""
+    attributes = sorted((str(p), str(o)) for p in operands for o in query_graph.objects(query_sbj, p))
+    return query_action, tuple(attributes)
+
+def group_queries(prepared_queries, operands):
+    """Group prepared query tuples by query_signature, keeping the order of first appearance"""
+    groups = {}
+    for prepared in prepared_queries:
+        query_graph, query_sbj, query_action, _, _ = prepared
+        groups.setdefault(query_signature(query_graph, query_sbj, query_action, operands), []).append(prepared)
+    return list(groups.values())
+
+def policy_operands(fdp, policy_store):
+    """leftOperands of all constraints of the policies used anywhere in a crawled FDP. The policy sets are
+    compiled (and cached by the store) here, evaluating the FDP uses the same ones."""
+    operands = set()
+    todo = [fdp]
+    while todo:
+        node = todo.pop()
+        operands.update(policy_store.get_policy_set(node.policies).operands)
+        children_attr = CHILDREN[type(node)]
+        if children_attr is not None:
+            todo.extend(getattr(node, children_attr))
+    return operands
+
+def attach_query_result(res, success, response):
+    """Store the outcome of run_query in the result dict of a permitted endpoint"""
+    if success:
+        res["data"] = response.rows
+        res["row_count"] = response.row_count
+        res["truncated"] = response.truncated
+        res["cached"] = response.from_cache
+        if response.truncated:
+            res["truncated_reason"] = response.truncated_reason
+        if response.spill_path:
+            res["spill_path"] = response.spill_path
+    elif response == QUERY_CANCELLED:
+        res["data"] = None # Access was granted, the query just wasn't needed anymore
+        res["skipped"] = True
+    else:
+        res["allowed"] = False
+        res["reason"] = response
+        res["policy"] = None # Empty this because this policy allowed access, not relevant anymore.
+
+def evaluate_fdp(fdp_uri, fdp, query_graph, query_sbj, query_action, user_graph, user, decision_cache):
+    """Decide access for every supported endpoint of a crawled FDP. Yields one res dict per endpoint,
+    res["allowed"] is True for endpoints that may be queried."""
+    # The FDP object has everything nested in it. Each object points down and has a set of policies
+    # 1. Catalog
+    # 2. Dataset
+    # 3. Distribution
+    # 4. Endpoints (Assumed to be triplestores)
+
+    # Find each endpoint and do all below code for all defined endpoints
+    for catalog in fdp.catalogs:
+        for dataset in catalog.datasets:
+            for distribution in dataset.distributions:
+                for endpoint_url in distribution.sparql_endpoints:
+                    # Check what this endpoint is - only continue if it is a supported Triplestore
+                    if not check_if_supported(endpoint_url):
+                        logger.warning("URL %s is not supported in the current version.", endpoint_url)
+                        inc("endpoints", status="unsupported")
+                        continue
+
+                    res = {
+                        "fdp": fdp_uri,
+                        "endpoint": endpoint_url,
+                        "allowed": None
+                    }
+
+                    hierarchy = [
+                        ("FDP", fdp.policies),
+                        ("Catalog", catalog.policies),
+                        ("Dataset", dataset.policies),
+                        ("Distribution", distribution.policies),
+                    ]
+
+                    for level_name, policy_refs in hierarchy:
+                        match, policy = decision_cache.check(level_name, policy_refs, query_graph, query_sbj, query_action, user_graph, user, endpoint_url, mode="prohibition")
+                        if match:
+                            logger.debug("Access to %s denied due to prohibition in policy. At level %s", endpoint_url, level_name)
+                            res["allowed"] = False
+                            res["reason"] = "Denied by prohibition"
+                            res["policy"] = policy
+                            break
+
+                    if res["allowed"] is None:
                         for level_name, policy_refs in hierarchy:
-
-                            #print(f"Evaluating prohibitions at level: {level_name}")
-                            #print(policy_refs)
-                            #if len(policy_refs) > 0:
-                            #    print(policy_refs)
-                            match, policy = check_policy(policy_refs, query_graph, query_sbj, query_action, user_graph, user, endpoint_url, mode="prohibition")
+                            match, policy = decision_cache.check(level_name, policy_refs, query_graph, query_sbj, query_action, user_graph, user, endpoint_url, mode="permission")
                             if match:
-                                print(f"Access to {endpoint_url} denied due to prohibition in policy. At level {level_name}")
-                                
-                                res["allowed"] = False
-                                res["reason"] = "Denied by prohibition"
+                                logger.debug("Access to %s granted by policy. At level %s", endpoint_url, level_name)
+                                res["allowed"] = True
                                 res["policy"] = policy
-                                results.append(res)
-
                                 break
 
-                        if res["allowed"] is None: 
-                            for level_name, policy_refs in hierarchy:
-                                #print(f"Evaluating permissions at level: {level_name}")
-                                #if len(policy_refs) > 0:
-                                #    print(policy_refs)
-                                match, policy = check_policy(policy_refs, query_graph, query_sbj, query_action, user_graph, user, endpoint_url, mode="permission")
-                                if match:
-                                    print(f"Access to {endpoint_url} granted by policy. At level {level_name}")
-                                    res["allowed"] = True
-                                    res["policy"] = policy
-                                    break
-
-                        if res["allowed"] is None:
-                            print(f"Access to {endpoint_url} denied: No applicable permission found.")  
-                            res["reason"] = "No applicable permission found"
-                            results.append(res)
-
-
-                        elif res["allowed"]:
-                            success, response = run_query(query_graph, query_sbj, user_graph, user, endpoint_url)
-                            if success:
-                                res["data"] = response
-                            else:
-                                res["allowed"] = False
-                                res["reason"] = response
-                                res["policy"] = None # Empty this because this policy allowed access, not relevant anymore.
-                            results.append(res)
-
-
-    return results
\ No newline at end of file
+                    if res["allowed"] is None:
+                        logger.debug("Access to %s denied: No applicable permission found.", endpoint_url)
+                        res["reason"] = "No applicable permission found"
+
+                    inc("endpoints", status="allowed" if res["allowed"] else "denied")
+
+                    yield res
+
+def iter_evaluate_crawled(crawled_fdps, prepared_queries, decision_cache, query_executor, submit=None, finish=None):
+    """Evaluate and query already crawled FDPs. crawled_fdps is an iterable of (fdp_uri, FDP) tuples and
+    prepared_queries the list returned by prepare_queries. Yields the same events as iter_query_orchestrator.
+    Used by iter_query_orchestrator, the batch mode, which evaluates many requests against one crawl, and
+    the federated mode.
+
+    Queries with the same action and values for the attributes the policies of the FDP look at (see
+    query_signature) are evaluated once per endpoint, and the decision is copied for every query of the group.
+    Each res dict has the query subject in res["query"].
+
+    submit(res, query_graph, query_sbj, user_graph, user) is called for every decision before its event is
+    yielded and returns the future of the query, or None if no query is sent. By default permitted endpoints
+    are queried through query_executor. finish(res, success, response) stores the outcome of a finished query
+    in res before its "data" event, attach_query_result by default."""
+    if submit is None:
+        def submit(res, query_graph, query_sbj, user_graph, user):
+            if res["allowed"]:
+                return query_executor.submit(query_graph, query_sbj, user_graph, user, res["endpoint"])
+            return None
+    finish = finish or attach_query_result
+
+    pending = {} # query future -> res
+    def finished_queries(block):
+        done = as_completed(list(pending)) if block else [f for f in list(pending) if f.done()]
+        for future in done:
+            res = pending.pop(future)
+            finish(res, *future.result())
+            yield "data", res
+
+    for fdp_uri, fdp in crawled_fdps:
+        logger.info("Processing FDP: %s", fdp_uri)
+        for group in group_queries(prepared_queries, policy_operands(fdp, decision_cache.policy_store)):
+            query_graph, query_sbj, query_action, user_graph, user = group[0]
+            for decision in evaluate_fdp(fdp_uri, fdp, query_graph, query_sbj, query_action, user_graph, user, decision_cache):
+                for query_graph, query_sbj, _, user_graph, user in group:
+                    res = dict(decision, query=str(query_sbj))
+                    future = submit(res, query_graph, query_sbj, user_graph, user)
+                    if future is not None:
+                        pending[future] = res
+                    yield "decision", res
+                yield from finished_queries(block=False)
+    yield from finished_queries(block=True)
+
+def iter_query_orchestrator(fdp_uris, input_user_graph, input_query_graph, input_graph_type, crawl_options=None,
+                            decision_cache=None, query_executor=None):
+    """Streaming version of query_orchestrator. Yields (event, res) tuples as soon as they are known:
+    ("decision", res) for every endpoint once its access decision is made, and for permitted endpoints
+    ("data", res) with the same dict once the query has finished. FDPs are evaluated in the order their
+    crawls finish and queries are sent while the other FDPs are still being crawled."""
+
+    # Extract all required information for later matching etc. in the right variables
+    logger.info("Starting new run")
+    prepared_queries = prepare_queries(input_user_graph, input_query_graph, input_graph_type)
+    if decision_cache is None:
+        decision_cache = DecisionCache()
+    owns_executor = query_executor is None
+    if owns_executor:
+        query_executor = QueryExecutor()
+
+    try:
+        yield from iter_evaluate_crawled(iter_crawl_fdps(fdp_uris, **(crawl_options or {})), prepared_queries,
+                                         decision_cache, query_executor)
+    finally:
+        # Also reached when the caller stops iterating early, e.g. on a Streamlit rerun
+        if owns_executor:
+            query_executor.cancel()
+            query_executor.shutdown()
+
+    policy_stats = get_default_policy_store().stats()
+    logger.info("Policy documents: %d cached, %d fetched, %d reused",
+                policy_stats['documents'], policy_stats['misses'], policy_stats['hits'])
+    logger.info(decision_cache.summary())
+    if query_executor.result_cache:
+        result_stats = query_executor.result_cache.stats()
+        logger.info("Query results: %d cached, %d hits, %d misses (hit rate %.0f%%)", result_stats['entries'],
+                    result_stats['hits'] + result_stats['disk_hits'], result_stats['misses'], 100 * result_stats['hit_rate'])
+
+def query_orchestrator(fdp_uris, input_user_graph, input_query_graph, input_graph_type, crawl_options=None,
+                       decision_cache=None, query_executor=None):
+    """Main function that crawls all provided FDPs, orchestrates policy checking and query execution.
+    crawl_options are passed on to crawl_fdps, e.g. {'concurrent': False} or {'max_per_host': 2}.
+    Policy decisions are memoized in decision_cache (a new DecisionCache per run if not given), so the
+    FDP/Catalog/Dataset level decisions are computed once per node instead of once per endpoint.
+    Queries to permitted endpoints are run concurrently by query_executor (a new QueryExecutor if not given).
+    Returns the list of res dicts, see iter_query_orchestrator for the streaming version."""
+    results = []
+    for event, res in iter_query_orchestrator(fdp_uris, input_user_graph, input_query_graph, input_graph_type,
+                                              crawl_options=crawl_options, decision_cache=decision_cache,
+                                              query_executor=query_executor):
+        if event == "decision":
+            results.append(res)
+    return results
@@ -0,0 +1,152 @@
+"""Federated merge of the query results of all permitted endpoints.
+
+Instead of every endpoint's full result, a FederatedResult holds one combined list of rows, each with the
+endpoints it came from. The LIMIT of the query becomes a global limit: every query is sent with a row cap of
+what is still missing, and once enough rows are in, queries that have not started are skipped and the ones
+still streaming stop reading. Rows come in the order the endpoints answer.
+
+A global limit is only applied when it means the same as on a single endpoint, so not for queries with an
+ORDER BY (the top rows of each endpoint don't give the global top rows) or an OFFSET."""
+import re
+import threading
+
+from .fdp_crawler import prepare_queries, iter_crawl_fdps, iter_evaluate_crawled, attach_query_result, EX
+from .decision_cache import DecisionCache
+from .query_runner import QueryExecutor
+
+_LIMIT = re.compile(r"\bLIMIT\s+(\d+)\s*$", re.IGNORECASE)
+_OFFSET = re.compile(r"\bOFFSET\s+\d+", re.IGNORECASE)
+_ORDER_BY = re.compile(r"\bORDER\s+BY\b", re.IGNORECASE)
+
+
+def global_limit(query_text):
+    """The LIMIT at the end of the query if it can be applied to the merged result, otherwise None"""
+    query_text = str(query_text).strip()
+    match = _LIMIT.search(query_text)
+    if match is None or _OFFSET.search(query_text) or _ORDER_BY.search(query_text):
+        return None
+    return int(match.group(1))
+
+def binding_key(binding):
+    return tuple(sorted((var, tuple(sorted(term.items()))) for var, term in binding.items()))
+
+
+class FederatedResult:
+    """Merged rows of one query. Each row is {"binding": {...}, "sources": [{"fdp": ..., "endpoint": ...}]},
+    with distinct=True equal bindings from several endpoints become one row with all their sources."""
+    def __init__(self, query, limit=None, distinct=False):
+        self.query = query
+        self.limit = limit
+        self.distinct = distinct
+        self.vars = []
+        self.rows = []
+        self._seen = {} # binding_key -> row, only used with distinct
+        # truncated: stopped by the row or byte cap of the endpoint, cancelled: stopped because the limit was reached
+        self.endpoints = {"queried": 0, "skipped": 0, "failed": 0, "truncated": 0, "cancelled": 0}
+
+    @property
+    def full(self):
+        return self.limit is not None and len(self.rows) >= self.limit
+
+    @property
+    def remaining(self):
+        return None if self.limit is None else max(0, self.limit - len(self.rows))
+
+    def add(self, res, result):
+        """Merge the SparqlResult of one endpoint. Returns the number of rows that were new."""
+        source = {"fdp": res["fdp"], "endpoint": res["endpoint"]}
+        for var in result.vars:
+            if var not in self.vars:
+                self.vars.append(var)
+        added = 0
+        for binding in result.rows:
+            if self.distinct:
+                key = binding_key(binding)
+                if key in self._seen:
+                    if source not in self._seen[key]["sources"]:
+                        self._seen[key]["sources"].append(source)
+                    continue
+            if self.full:
+                break
+            row = {"binding": binding, "sources": [source]}
+            self.rows.append(row)
+            if self.distinct:
+                self._seen[key] = row
+            added += 1
+        return added
+
+    def to_dict(self):
+        return {"query": str(self.query), "limit": self.limit, "distinct": self.distinct, "vars": self.vars,
+                "row_count": len(self.rows), "endpoints": self.endpoints, "rows": self.rows}
+
+
+def iter_federated(crawled_fdps, prepared_queries, decision_cache, query_executor, limit=None, distinct=False):
+    """Like iter_evaluate_crawled, but the data of all endpoints goes into one FederatedResult per query subject.
+    Yields the same ("decision", res) and ("data", res) events, res["data"] is not filled in here.
+    Returns {query_sbj: FederatedResult} (as the value of StopIteration, use yield from or federated_query).
+    limit overrides the LIMIT of the queries."""
+    merged = {}
+    cancel = {} # query_sbj -> Event, set once its result is full
+    for query_graph, query_sbj, _, _, _ in prepared_queries:
+        query_limit = limit if limit is not None else global_limit(query_graph.value(query_sbj, EX.queryText))
+        merged[query_sbj] = FederatedResult(query_sbj, limit=query_limit, distinct=distinct)
+        cancel[query_sbj] = threading.Event()
+    by_query = {str(query_sbj): query_sbj for query_sbj in merged} # res["query"] -> query_sbj
+
+    def submit(res, query_graph, query_sbj, user_graph, user):
+        result = merged[query_sbj]
+        if not res["allowed"]:
+            return None
+        if result.full:
+            res["skipped"] = True
+            result.endpoints["skipped"] += 1
+            return None
+        return query_executor.submit(query_graph, query_sbj, user_graph, user, res["endpoint"],
+                                     max_rows=result.remaining, cancelled=cancel[query_sbj])
+
+    def finish(res, success, response):
+        query_sbj = by_query[res["query"]]
+        result = merged[query_sbj]
+        attach_query_result(res, success, response)
+        if res.get("skipped"):
+            result.endpoints["skipped"] += 1
+        elif not success:
+            result.endpoints["failed"] += 1
+        else:
+            result.endpoints["queried"] += 1
+            if response.truncated and response.truncated_reason == "cancelled":
+                result.endpoints["cancelled"] += 1 # Stopped because the global limit was reached
+            elif response.truncated:
+                result.endpoints["truncated"] += 1
+            res["merged_rows"] = result.add(res, response)
+            if result.full:
+                cancel[query_sbj].set() # Skip the queries that haven't started, stop reading the others
+        res.pop("data", None)
+
+    yield from iter_evaluate_crawled(crawled_fdps, prepared_queries, decision_cache, query_executor,
+                                     submit=submit, finish=finish)
+    return merged
+
+def federated_query(fdp_uris, input_user_graph, input_query_graph, input_graph_type, limit=None, distinct=False,
+                    crawl_options=None, decision_cache=None, query_executor=None):
+    """Crawl, decide and query like query_orchestrator, and merge the results of all permitted endpoints.
+    Returns (decisions, {query_sbj: FederatedResult}), decisions being the res dicts of all endpoints."""
+    prepared_queries = prepare_queries(input_user_graph, input_query_graph, input_graph_type)
+    decision_cache = decision_cache or DecisionCache()
+    owns_executor = query_executor is None
+    if owns_executor:
+        query_executor = QueryExecutor()
+    decisions = []
+    try:
+        events = iter_federated(iter_crawl_fdps(fdp_uris, **(crawl_options or {})), prepared_queries, decision_cache,
+                                query_executor, limit=limit, distinct=distinct)
+        while True:
+            try:
+                event, res = next(events)
+            except StopIteration as stop:
+                return decisions, stop.value
+            if event == "decision":
+                decisions.append(res)
+    finally:
+        if owns_executor:
+            query_executor.shutdown()
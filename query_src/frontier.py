@@ -0,0 +1,75 @@
+"""What has been crawled in one run. A CrawlFrontier is shared by all FDP crawls of a run (see iter_crawl_fdps).
+
+- Every document is fetched and parsed once per run. Datasets that are listed in several catalogs, or
+  catalogs shared by several FDPs, still show up at every place they are listed, but their document is
+  taken from the frontier the second time.
+- A link back to one of the resources above it (e.g. a catalog that ldp:contains its FDP, which the fallback
+  of navigate_down_fdp can pick up) is a cycle and is not followed.
+- max_depth (levels below the FDP) and max_nodes (resources in the whole run) bound the crawl. Links past
+  the limits are left out of the tree.
+
+Documents, and the RefTable that the policy references of the crawled trees are interned in, are kept for
+the lifetime of the frontier, so don't keep one around longer than a run."""
+import logging
+import threading
+from concurrent.futures import Future
+
+from .resources import RefTable
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlFrontier:
+    def __init__(self, max_depth=None, max_nodes=None):
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.stats = {"shared": 0, "cycles": 0, "truncated": 0}
+        self._documents = {} # key -> Future of the fetch result
+        self.ref_table = RefTable()
+        self._lock = threading.Lock()
+
+    def admit(self, uri, ancestors, depth):
+        """Whether a link to uri, found at depth (the FDP is 0) below the resources in ancestors, is followed"""
+        uri = str(uri)
+        if uri in ancestors:
+            logger.warning("Not following %s: it links back to a resource above it", uri)
+            with self._lock:
+                self.stats["cycles"] += 1
+            return False
+        with self._lock:
+            if (self.max_depth is not None and depth > self.max_depth) or \
+                    (self.max_nodes is not None and self.nodes >= self.max_nodes):
+                if not self.stats["truncated"]:
+                    logger.warning("Crawl limit reached (max_depth %s, max_nodes %s), %s and further links are left out",
+                                   self.max_depth, self.max_nodes, uri)
+                self.stats["truncated"] += 1
+                return False
+            self.nodes += 1
+        return True
+
+    def _future(self, key, submit):
+        with self._lock:
+            future = self._documents.get(key)
+            if future is not None:
+                self.stats["shared"] += 1
+                return future
+            future = self._documents[key] = submit()
+        return future
+
+    def fetch(self, key, fn):
+        """fn() once per key, in this thread"""
+        future = Future()
+        existing = self._future(key, lambda: future)
+        if existing is future:
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+        return existing.result()
+
+    def fetch_all(self, pool, fn, keyed_urls, owner=None):
+        """fn(url, timeout=...) through the CrawlPool for every (key, url) that has not been fetched under its
+        key before. Results are returned in the order of keyed_urls."""
+        futures = [self._future(key, lambda url=url: pool.submit(fn, url, owner=owner)) for key, url in keyed_urls]
+        return [f.result() for f in futures]
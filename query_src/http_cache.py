@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+from .instrumentation import inc
+
+DEFAULT_CACHE_DIR = os.environ.get("ODRL_HTTP_CACHE_DIR", ".fdp_cache")
+DEFAULT_TTL = 300 # seconds an entry is used without asking the server again
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class CachedResponse:
+    """The parts of a requests.Response the crawler uses, plus where the body came from."""
+    def __init__(self, url, content, encoding, status_code, etag=None, last_modified=None, content_type=None,
+                 from_cache=False, revalidated=False):
+        self.url = url
+        self.content = content
+        self.encoding = encoding
+        self.status_code = status_code
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+        self.from_cache = from_cache # Body was not downloaded in this call
+        self.revalidated = revalidated # Server answered 304 Not Modified
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+
+class HTTPCache:
+    """On-disk cache for GET requests of FDP documents. Each entry is a body file plus a small json file
+    with the ETag / Last-Modified validators. Entries younger than ttl are served without any request,
+    older ones are revalidated with a conditional GET. When the total size of the bodies exceeds max_bytes
+    the least recently used entries are evicted."""
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, session=None):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.session = session or requests.Session()
+        self._lock = threading.RLock()
+        self._index = None # key -> meta dict, loaded lazily from disk
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "evictions": 0}
+
+    # --- Bookkeeping ---
+    def _key(self, url, accept):
+        return hashlib.sha256(f"{accept or ''} {url}".encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + ".body"), os.path.join(self.cache_dir, key + ".json")
+
+    def _load_index(self):
+        if self._index is not None:
+            return self._index
+        self._index = {}
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".json"):
+                    continue
+                key = name[:-len(".json")]
+                body_path, meta_path = self._paths(key)
+                try:
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    meta["last_access"] = os.path.getmtime(body_path)
+                except (OSError, ValueError):
+                    continue # Half written or removed entry, ignore it
+                self._index[key] = meta
+        return self._index
+
+    def _write_entry(self, key, meta, content):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        body_path, meta_path = self._paths(key)
+        # Write to temporary files first so a crash never leaves a body without matching validators
+        for path, mode, data in ((body_path, "wb", content), (meta_path, "w", json.dumps(meta))):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, mode) as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        meta["last_access"] = time.time()
+        self._load_index()[key] = meta
+
+    def _read_body(self, key):
+        body_path, _ = self._paths(key)
+        with open(body_path, "rb") as f:
+            content = f.read()
+        os.utime(body_path) # mtime doubles as last access time for the LRU eviction
+        self._index[key]["last_access"] = time.time()
+        return content
+
+    def _remove(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._load_index().pop(key, None)
+
+    def _evict(self):
+        index = self._load_index()
+        total = sum(meta.get("size", 0) for meta in index.values())
+        for key in sorted(index, key=lambda k: index[k].get("last_access", 0)):
+            if total <= self.max_bytes:
+                break
+            total -= index[key].get("size", 0)
+            self._remove(key)
+            self.stats["evictions"] += 1
+            inc("http_cache_evictions")
+
+    # --- Public API ---
+    def get(self, url, timeout=None, accept=None, revalidate=False):
+        """GET url through the cache. Raises the same exceptions as requests does for failed requests.
+        With revalidate=True a cached entry is always checked with the server, even if it is younger than ttl."""
+        key = self._key(url, accept)
+        with self._lock:
+            meta = self._load_index().get(key)
+            if meta is not None and not revalidate and time.time() - meta["stored_at"] < self.ttl:
+                try:
+                    content = self._read_body(key)
+                    self.stats["hits"] += 1
+                    return self._response(url, meta, content, from_cache=True)
+                except OSError:
+                    meta = None
+
+        headers = {"Accept": accept} if accept else {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        response = self.session.get(url, headers=headers, timeout=timeout)
+
+        with self._lock:
+            if response.status_code == 304 and meta is not None:
+                try:
+                    content = self._read_body(key)
+                except (OSError, KeyError):
+                    content = None
+                if content is not None:
+                    meta["stored_at"] = time.time()
+                    self._write_entry(key, meta, content)
+                    self.stats["revalidated"] += 1
+                    return self._response(url, meta, content, from_cache=True, revalidated=True)
+                # Body vanished in the meantime, drop the entry and fetch it again without validators
+                self._remove(key)
+
+        if response.status_code == 304 and meta is not None:
+            return self.get(url, timeout=timeout, accept=accept, revalidate=revalidate)
+
+        with self._lock:
+            response.raise_for_status()
+            self.stats["misses"] += 1
+            meta = {
+                "url": url,
+                "accept": accept,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "content_type": response.headers.get("Content-Type"),
+                "encoding": response.encoding,
+                "stored_at": time.time(),
+                "size": len(response.content),
+            }
+            if meta["size"] <= self.max_bytes:
+                self._write_entry(key, meta, response.content)
+                self._evict()
+            return self._response(url, meta, response.content)
+
+    def _response(self, url, meta, content, from_cache=False, revalidated=False):
+        return CachedResponse(url, content, meta.get("encoding"), 200, etag=meta.get("etag"),
+                              last_modified=meta.get("last_modified"), content_type=meta.get("content_type"),
+                              from_cache=from_cache, revalidated=revalidated)
+
+    def invalidate(self, url, accept=None):
+        """Drop the cached entry for url so the next get downloads it again."""
+        with self._lock:
+            self._remove(self._key(url, accept))
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._load_index()):
+                self._remove(key)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache():
+    """Cache shared by the crawler. Created on first use so importing the crawler does not touch the disk."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = HTTPCache()
+        return _default_cache
+
+def set_default_cache(cache):
+    """Replace the shared cache, e.g. with a different directory or ttl. Pass None to get a fresh default one."""
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
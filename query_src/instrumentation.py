@@ -0,0 +1,186 @@
+"""Timed spans, counters and latency histograms for the crawl / policy / query pipeline.
+
+    with span("fetch", uri=url, level="Catalog"):
+        ...
+
+Every span is logged at DEBUG level with all its tags and its duration, and recorded in a latency histogram.
+Only the low cardinality tags in METRIC_LABELS become metric labels, URIs only end up in the logs and in
+the trace buffer. metrics_snapshot() and prometheus_text() export everything that was recorded so far,
+start_metrics_server() serves both over HTTP so they can be scraped while the app runs."""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+METRIC_LABELS = ("level", "mode", "status", "cache", "format")
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0) # seconds
+TRACE_SIZE = 1000 # number of finished spans kept for export
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    """Process wide registry. Keys are (name, ((label, value), ...)) tuples."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.trace = deque(maxlen=TRACE_SIZE)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if k in METRIC_LABELS and v is not None))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def record_span(self, name, seconds, tags):
+        self.observe(name, seconds, **tags)
+        with self._lock:
+            self.trace.append({"span": name, "start": time.time() - seconds, "seconds": seconds,
+                               **{k: str(v) for k, v in tags.items()}})
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.trace.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "histograms": [{"name": name, "labels": dict(labels), "count": h.count, "sum": h.sum,
+                                "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], h.counts))}
+                               for (name, labels), h in sorted(self.histograms.items())],
+            }
+
+    def prometheus_text(self, prefix="odrl_"):
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {prefix}{name}_total counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"{prefix}{name}_total{fmt_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {prefix}{name}_seconds histogram")
+                for (n, labels), h in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip([str(b) for b in BUCKETS] + ["+Inf"], h.counts):
+                        cumulative += count
+                        lines.append(f"{prefix}{name}_seconds_bucket{fmt_labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{prefix}{name}_seconds_sum{fmt_labels(labels)} {h.sum}")
+                    lines.append(f"{prefix}{name}_seconds_count{fmt_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def span(name, **tags):
+    """Time a block of work. Exceptions are counted as <name>_errors and raised again."""
+    start = time.perf_counter()
+    try:
+        yield tags # The block may add tags, e.g. tags["cache"] = "hit"
+    except BaseException:
+        metrics.inc(f"{name}_errors", **tags)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.record_span(name, seconds, tags)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("span %s %.4fs %s", name, seconds, " ".join(f"{k}={v}" for k, v in tags.items()))
+
+def inc(name, value=1, **labels):
+    metrics.inc(name, value, **labels)
+
+def metrics_snapshot():
+    return metrics.snapshot()
+
+def recent_spans():
+    with metrics._lock:
+        return list(metrics.trace)
+
+def prometheus_text():
+    return metrics.prometheus_text()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(metrics_snapshot()).encode("utf-8"), "application/json"
+        elif self.path == "/trace.json":
+            body, content_type = json.dumps(recent_spans()).encode("utf-8"), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+def start_metrics_server(port, host="localhost"):
+    """Serve /metrics (Prometheus text), /metrics.json and /trace.json from a background thread.
+    Calling it again returns the running server, so it is safe to call from a Streamlit script."""
+    global _metrics_server
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _metrics_server.daemon_threads = True
+            threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+            logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+        return _metrics_server
+
+def configure_logging(level="INFO"):
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
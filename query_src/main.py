@@ -1,13 +1,90 @@
-from fdp_crawler import query_orchestrator
+"""Command line entry point. Run from the repository root:
 
-#sparql_query = """SELECT * WHERE {?s ?p ?o}"""
-#user = "http://example.org/Bob" # TODO: Include proper authentication here
-#purpose = "http://example.org/research"
+    python -m query_src.main --user users/bob.ttl --query questions/query1.ttl
+    python -m query_src.main --batch questions/batch_example.jsonl --out results.jsonl
+    python -m query_src.main --snapshot crawl_snapshot.sqlite --snapshot-max-age 3600
+    python -m query_src.main --access-matrix users/bob.ttl users/alice.ttl --out matrix.csv
+    python -m query_src.main --federated --distinct --limit 100
 
-user_graph_path = '../users/bob.ttl'
-query_graph_path = '../questions/query1.ttl'
+The batch mode crawls every FDP once and evaluates all requests of the batch file against that crawl."""
+import argparse
+import json
+import sys
 
-with open("../fdp_uris.txt") as f:
-    fdp_uris = [line.strip() for line in f if line.strip()]
+from .fdp_crawler import query_orchestrator
+from .batch import read_batch_requests, run_batch
+from .access_matrix import access_matrix
+from .federation import federated_query
+from .instrumentation import configure_logging, start_metrics_server
 
-query_orchestrator(fdp_uris, user_graph_path, query_graph_path)
\ No newline at end of file
+
+def read_fdp_uris(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate SPARQL queries against ODRL protected FDPs")
+    parser.add_argument("--fdp-uris", default="fdp_uris.txt", help="File with one FDP URI per line")
+    parser.add_argument("--user", default="users/bob.ttl", help="User graph (single run)")
+    parser.add_argument("--query", default="questions/query1.ttl", help="Query graph (single run)")
+    parser.add_argument("--batch", help="JSON lines file with {'id', 'user', 'query'} requests")
+    parser.add_argument("--out", help="Where to write the batch results / access matrix (default: stdout)")
+    parser.add_argument("--access-matrix", nargs="+", metavar="USER_GRAPH",
+                        help="Write which of these users may run --query at which endpoint as CSV, without querying")
+    parser.add_argument("--federated", action="store_true",
+                        help="Merge the results of all permitted endpoints into one result per query")
+    parser.add_argument("--limit", type=int, help="Global row limit of the merged result (default: the query's LIMIT)")
+    parser.add_argument("--distinct", action="store_true", help="Drop duplicate rows from the merged result")
+    parser.add_argument("--no-data", action="store_true", help="Leave the query bindings out of the batch results")
+    parser.add_argument("--snapshot", help="SQLite crawl snapshot to start from and update (incremental re-crawl)")
+    parser.add_argument("--snapshot-max-age", type=float, default=None,
+                        help="Use the snapshot without any request if it is younger than this many seconds")
+    parser.add_argument("--max-depth", type=int, help="Do not crawl more than this many levels below an FDP")
+    parser.add_argument("--max-nodes", type=int, help="Do not crawl more than this many resources in total")
+    parser.add_argument("--rate-per-host", type=float, help="At most this many requests per second to one host")
+    parser.add_argument("--log-level", default="WARNING", help="Python logging level, DEBUG also logs every span")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port while running")
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level.upper())
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    fdp_uris = read_fdp_uris(args.fdp_uris)
+    crawl_options = {"max_depth": args.max_depth, "max_nodes": args.max_nodes, "rate_per_host": args.rate_per_host}
+    if args.snapshot:
+        crawl_options.update(snapshot_path=args.snapshot, snapshot_max_age=args.snapshot_max_age)
+
+    if args.access_matrix:
+        matrix = access_matrix(fdp_uris, args.access_matrix, args.query, 'path', crawl_options=crawl_options)
+        matrix.to_dataframe().to_csv(args.out or sys.stdout, index=False)
+        return
+
+    if args.federated:
+        _, merged = federated_query(fdp_uris, args.user, args.query, 'path', limit=args.limit, distinct=args.distinct,
+                                    crawl_options=crawl_options)
+        for result in merged.values():
+            print(json.dumps(result.to_dict(), default=str))
+        return
+
+    if args.batch is None:
+        results = query_orchestrator(fdp_uris, args.user, args.query, 'path', crawl_options=crawl_options)
+        for res in results:
+            print(json.dumps(res, default=str))
+        return
+
+    batch = read_batch_requests(args.batch)
+    out_file = open(args.out, "w") if args.out else sys.stdout
+    try:
+        stats = run_batch(fdp_uris, batch, out_file, include_data=not args.no_data, crawl_options=crawl_options)
+    finally:
+        if args.out:
+            out_file.close()
+
+    print(f"\nProcessed {stats['requests']} requests ({stats['failed_requests']} failed) against {len(fdp_uris)} FDPs", file=sys.stderr)
+    print(f"Crawl: {stats['crawl_seconds']:.2f}s, evaluation: {stats['evaluation_seconds']:.2f}s, total: {stats['total_seconds']:.2f}s", file=sys.stderr)
+    print(f"Throughput: {stats['requests_per_second']:.1f} requests/s, {stats['decisions_per_second']:.1f} endpoint decisions/s, "
+          f"{stats['queries']} queries sent", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
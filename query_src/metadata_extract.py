@@ -0,0 +1,73 @@
+"""Lightweight extraction of the crawl metadata from FDP documents.
+
+The crawler only looks at a handful of predicates (ldp:contains, odrl:hasPolicy, dcat:accessURL and
+dct:modified), but parsing a whole catalog page into an rdflib Graph costs time and memory for every triple
+in it. FDP servers can return N-Triples (one triple per line), so when the server honours the Accept header
+we only keep the lines that mention one of these predicates and parse those. The triples of inline (BNode)
+policies are kept as well, as check_policy needs them later on: every blank node line, plus the lines of
+rules and constraints that are IRIs (see policy_index.NESTED). Everything else, including text/plain (static
+hosts serve .ttl files like that), still goes through the normal turtle parser."""
+import rdflib
+from rdflib.namespace import DCAT, DCTERMS, Namespace
+
+from .policy_index import NESTED
+
+LDP = Namespace("http://www.w3.org/ns/ldp#")
+ODRL = Namespace("http://www.w3.org/ns/odrl/2/")
+
+CRAWL_PREDICATES = (LDP.contains, ODRL.hasPolicy, DCAT.accessURL, DCTERMS.modified)
+# Prefer N-Triples, but any server that only speaks turtle still gives us something we can parse
+ACCEPT = "application/n-triples, text/turtle;q=0.9, */*;q=0.1"
+NTRIPLES_TYPES = ("application/n-triples",)
+
+_PREDICATE_MARKERS = tuple(f"<{predicate}>" for predicate in CRAWL_PREDICATES)
+_NESTED_MARKERS = frozenset(f"<{predicate}>" for predicate in NESTED)
+
+
+def is_ntriples(content_type):
+    if not content_type:
+        return False
+    return content_type.split(";")[0].strip().lower() in NTRIPLES_TYPES
+
+def filter_ntriples(text):
+    """Yield only the N-Triples lines the crawler needs. Substring tests and splitting on whitespace, no parsing."""
+    lines = []
+    nested = [] # (subject, object) of the rule / constraint links
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split(None, 2)
+        lines.append((parts[0], line))
+        if len(parts) == 3 and parts[1] in _NESTED_MARKERS:
+            nested.append((parts[0], parts[2].rstrip(" .")))
+
+    # IRI rules and constraints that hang below a blank node policy, followed down to the last level
+    wanted = set()
+    changed = True
+    while changed:
+        changed = False
+        for subject, obj in nested:
+            if (subject.startswith("_:") or subject in wanted) and obj.startswith("<") and obj not in wanted:
+                wanted.add(obj)
+                changed = True
+
+    for subject, line in lines:
+        if subject.startswith("_:") or subject in wanted or any(marker in line for marker in _PREDICATE_MARKERS):
+            yield line
+
+def extract_metadata(text):
+    """Parse the crawl relevant triples of an N-Triples document into a (small) Graph. The result
+    answers the same objects/value calls for these predicates as the graph of the full document."""
+    g = rdflib.Graph()
+    # One parse call for all lines, so the blank node labels stay consistent between the triples
+    g.parse(data="\n".join(filter_ntriples(text)), format="nt")
+    return g
+
+def parse_document(text, content_type):
+    """Returns (graph, format) for an FDP document, using the fast path for N-Triples responses."""
+    if is_ntriples(content_type):
+        return extract_metadata(text), "nt"
+    g = rdflib.Graph()
+    g.parse(data=text, format="turtle")
+    return g, "turtle"
@@ -1,6 +1,9 @@
-from rdflib import Graph, Namespace, URIRef, BNode, RDF, FOAF
-import rdflib
-from urllib.parse import urldefrag
+from rdflib import Namespace
+import logging
+from .policy_store import get_default_policy_store
+from .instrumentation import span
+
+logger = logging.getLogger(__name__)
 
 ODRL = Namespace("http://www.w3.org/ns/odrl/2/")
 EX = Namespace("http://example.org/")
@@ -32,84 +35,40 @@ def deduce_action_from_query(query):
     return None
 
 
-def load_policy_graph(policy_refs):
-    """"""
-    g = Graph()
-    loaded_uris = set()
-    for ref, source_graph in policy_refs:
-        if isinstance(ref, URIRef):
-            base_uri, _ = urldefrag(ref)
-            if base_uri not in loaded_uris:
-                #try:
-                    g.parse(base_uri, format="turtle")
-                    loaded_uris.add(base_uri)
-                #except Exception as e:
-                #    print(f"Warning: Failed to load policy from {base_uri}: {e}")
-        elif isinstance(ref, BNode):
-            for triple in source_graph.triples((ref, None, None)):
-                g.add(triple)
-    return g
-
-
-def matches_constraints(policy_graph, rule, query_graph, query_sbj, user_graph, user):
-    """Find all constraints given in an ODRL policy and match them against the user and query graphs.
-    False means one or more of the constraints did not match. True means either all constraints matched or there were no constraints"""
+def matches_constraints(constraints, query_graph, query_sbj, user_graph, user):
+    """Match the pre-extracted (leftOperand, operator, rightOperand) constraints of a compiled rule against
+    the user and query graphs. False means one or more of the constraints did not match. True means either all
+    constraints matched or there were no constraints"""
 
-    i = 0 # Use this to count the number of constraints. Can't get the length of policy_graph.objects() 
-    for constraint in policy_graph.objects(rule, ODRL.constraint):
-        i += 1
+    for left, op, right in constraints:
         # Assume the constraint is described as left = predicate, right = object
-        left = policy_graph.value(constraint, ODRL.leftOperand)
-        op = policy_graph.value(constraint, ODRL.operator)
-        right = policy_graph.value(constraint, ODRL.rightOperand)
-
-        #print(left, op, right)
         if op == ODRL.eq:
             # Search for the predicate in both the query graph and the user graph
-            print(query_graph.value(query_sbj, left))
             if query_graph.value(query_sbj, left) == right:
                 continue
             elif user_graph.value(user, left) == right:
                 continue
         else:
-            print(f"WARNING: ODRL Operator {ODRL.eq} not yet supported.")
+            logger.warning("ODRL Operator %s not yet supported.", op)
 
         return False # No continue so no match in either graph
-    
-    return True # Either no constraints, or passed all constraints
 
+    return True # Either no constraints, or passed all constraints
 
-def check_policy(policy_refs, query_graph, query_sbj, query_action, user_graph, user, endpoint_url, mode):
-    """"""
-    
-    policy_graph = load_policy_graph(policy_refs)
-
-    match = False
-    for ref, _ in policy_refs:
-        policy = ref
-        if (policy, RDF.type, ODRL.Policy) not in policy_graph:
-            print(f"WARNING: Could not find policy {policy} in policy graph. Skipping this.")
-            continue
-        for rule in policy_graph.objects(policy, getattr(ODRL, mode)): # mode = 'permission' or 'prohibition'
-            assignee = policy_graph.objects(rule, ODRL.assignee)
-            action = policy_graph.objects(rule, ODRL.action)
-            target = policy_graph.objects(rule, ODRL.target)
-
-            # Check if targeting matches. Each of these is still very simplistic
-            user_match = user in assignee 
-            action_match = query_action in action
-            target_match = endpoint_url in target # Don't set one target but the target is always the discovered endpoint!
-            target_match = True#
-            print(user_match, action_match, target_match)
-            #print('desired endpoint: ' + endpoint_url)
 
+def check_policy(policy_refs, query_graph, query_sbj, query_action, user_graph, user, endpoint_url, mode, policy_store=None):
+    """Check if any of the policies in policy_refs has a rule of the given mode ('permission' or 'prohibition')
+    that applies to this user, action and query. Uses the compiled rule index, so finding the candidate rules is
+    a single dict lookup on (mode, user, action). The target is not checked: it is always the discovered endpoint."""
+    if policy_store is None:
+        policy_store = get_default_policy_store()
+    with span("rule_evaluation", mode=mode, uri=endpoint_url):
+        policy_set = policy_store.get_policy_set(policy_refs)
 
-            if user_match and action_match and target_match:
-                if matches_constraints(policy_graph, rule, query_graph, query_sbj, user_graph, user):
-                    return True, ref
-                
-                else:
-                    print(f"access denied by policy {policy}")
+        for policy, constraints in policy_set.lookup(mode, user, query_action):
+            if matches_constraints(constraints, query_graph, query_sbj, user_graph, user):
+                return True, policy
+            else:
+                logger.debug("Constraints of %s did not match", policy)
 
     return False, None
-
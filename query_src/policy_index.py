@@ -0,0 +1,121 @@
+from rdflib import Namespace, RDF, BNode
+
+ODRL = Namespace("http://www.w3.org/ns/odrl/2/")
+
+MODES = ("permission", "prohibition")
+# Rules and constraints are usually BNodes, but may be IRIs described in the same document
+NESTED = (ODRL.permission, ODRL.prohibition, ODRL.obligation, ODRL.constraint)
+
+
+class PolicyClosure:
+    """The triples of one BNode policy, including those of its rules and constraints, cut out of the
+    document it was found in. The crawled tree keeps these instead of the whole parsed document. Has the
+    few Graph methods the policy code uses on a source graph (triples, objects, value and in)."""
+    __slots__ = ("_triples",)
+
+    def __init__(self, triples):
+        self._triples = tuple(triples)
+
+    @classmethod
+    def from_graph(cls, graph, bnode):
+        triples = []
+        todo = [bnode]
+        seen = set()
+        while todo:
+            node = todo.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            for triple in graph.triples((node, None, None)):
+                triples.append(triple)
+                if isinstance(triple[2], BNode) or triple[1] in NESTED:
+                    todo.append(triple[2])
+        return cls(triples)
+
+    def triples(self, pattern):
+        s, p, o = pattern
+        for triple in self._triples:
+            if (s is None or triple[0] == s) and (p is None or triple[1] == p) and (o is None or triple[2] == o):
+                yield triple
+
+    def objects(self, subject=None, predicate=None):
+        for _, _, o in self.triples((subject, predicate, None)):
+            yield o
+
+    def value(self, subject=None, predicate=RDF.value, object=None):
+        for s, p, o in self.triples((subject, predicate, object)):
+            return o if object is None else s
+        return None
+
+    def __contains__(self, triple):
+        return any(True for _ in self.triples(triple))
+
+    def __iter__(self):
+        return iter(self._triples)
+
+    def __len__(self):
+        return len(self._triples)
+
+
+class CompiledPolicy:
+    """One ODRL policy turned into plain python data. rules maps (mode, assignee, action) to a list of
+    constraint tuples, one entry per rule. Each constraint is a (leftOperand, operator, rightOperand) tuple."""
+    def __init__(self, uri):
+        self.uri = uri
+        self.rules = {}
+        self.operands = set() # leftOperands used by any constraint, needed to build decision cache keys
+
+    def add_rule(self, mode, assignees, actions, constraints):
+        for assignee in assignees:
+            for action in actions:
+                self.rules.setdefault((mode, assignee, action), []).append(constraints)
+        self.operands.update(left for left, _, _ in constraints)
+
+
+class CompiledPolicySet:
+    """Index over all policies of one hierarchy level. lookup() is a single dict access that returns the
+    candidate rules as (policy, constraints) pairs, in the order the policies were referenced."""
+    def __init__(self, policy_refs, compiled_policies):
+        self.policy_refs = tuple(policy_refs)
+        self.rules = {}
+        self.operands = set()
+        self.missing = []
+        for ref, compiled in zip(self.policy_refs, compiled_policies):
+            if compiled is None:
+                self.missing.append(ref)
+                continue
+            for key, constraint_list in compiled.rules.items():
+                entries = self.rules.setdefault(key, [])
+                for constraints in constraint_list:
+                    entries.append((ref, constraints))
+            self.operands.update(compiled.operands)
+
+    def lookup(self, mode, assignee, action):
+        return self.rules.get((mode, assignee, action), ())
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.rules.values())
+
+
+def compile_policy(graph, policy):
+    """Extract all permissions and prohibitions of policy from graph. Returns None if the graph does
+    not declare policy as an odrl:Policy."""
+    if (policy, RDF.type, ODRL.Policy) not in graph:
+        return None
+
+    compiled = CompiledPolicy(policy)
+    for mode in MODES:
+        for rule in graph.objects(policy, ODRL[mode]):
+            assignees = tuple(graph.objects(rule, ODRL.assignee))
+            actions = tuple(graph.objects(rule, ODRL.action))
+            # Targets are not compiled: the target is always the endpoint that was discovered while crawling
+            constraints = tuple(
+                (graph.value(c, ODRL.leftOperand), graph.value(c, ODRL.operator), graph.value(c, ODRL.rightOperand))
+                for c in graph.objects(rule, ODRL.constraint)
+            )
+            compiled.add_rule(mode, assignees, actions, constraints)
+    return compiled
+
+def compile_document(graph):
+    """Compile every policy defined in a policy document. Returns a dict policy -> CompiledPolicy."""
+    return {policy: compile_policy(graph, policy) for policy in graph.subjects(RDF.type, ODRL.Policy, unique=True)}
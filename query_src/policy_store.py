@@ -0,0 +1,175 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urldefrag
+
+from rdflib import Graph, BNode
+
+from .http_cache import get_default_cache
+from .policy_index import CompiledPolicySet, compile_document, compile_policy
+from .instrumentation import span, inc
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_DOCUMENTS = 256
+DEFAULT_TTL = 300 # seconds
+DEFAULT_RETRY_AFTER = 30 # seconds before a failed reload is tried again
+
+
+class PolicyDocumentStore:
+    """Parsed policy documents keyed by their defragmented URI, so policy.ttl#a and policy.ttl#b
+    share one download and one parse. Least recently used documents are dropped once more than
+    max_documents are held, and documents older than ttl are loaded again. An expired document is still served
+    while it is loaded again in the background, so a policy server that is down doesn't fail evaluations. If the
+    reload fails the old document is kept, and it is tried again after retry_after seconds.
+    Every document is compiled into CompiledPolicy objects when it is loaded, and the CompiledPolicySet
+    of each combination of policy references is kept as well, so check_policy never walks a graph."""
+    def __init__(self, max_documents=DEFAULT_MAX_DOCUMENTS, ttl=DEFAULT_TTL, timeout=None, retry_after=DEFAULT_RETRY_AFTER):
+        self.max_documents = max_documents
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.timeout = timeout
+        self._documents = OrderedDict() # base_uri -> (loaded_at, graph, {policy: CompiledPolicy})
+        self._policy_sets = OrderedDict() # tuple of policy refs -> (compiled_at, CompiledPolicySet)
+        self._loading = {} # base_uri -> Event, so concurrent callers wait for one fetch instead of each fetching
+        self._reloader = None # Executor for reloads of expired documents, created on first use
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, uri):
+        """Return the parsed graph of the document that defines uri."""
+        return self._get_entry(uri)[1]
+
+    def get_compiled_policy(self, ref, source_graph=None):
+        """CompiledPolicy for a policy reference as stored by extract_policies. BNode policies are compiled
+        from the graph they were found in. Returns None if the policy could not be found."""
+        if isinstance(ref, BNode):
+            return compile_policy(source_graph, ref)
+        return self._get_entry(ref)[2].get(ref)
+
+    def get_policy_set(self, policy_refs):
+        """CompiledPolicySet for a list of (ref, source_graph) tuples."""
+        key = tuple(ref for ref, _ in policy_refs)
+        with self._lock:
+            entry = self._policy_sets.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl:
+                self._policy_sets.move_to_end(key)
+                return entry[1]
+
+        policy_set = CompiledPolicySet(key, [self.get_compiled_policy(ref, source_graph) for ref, source_graph in policy_refs])
+        for ref in policy_set.missing:
+            logger.warning("Could not find policy %s in policy graph. Skipping this.", ref)
+        with self._lock:
+            self._policy_sets[key] = (time.time(), policy_set)
+            self._policy_sets.move_to_end(key)
+            while len(self._policy_sets) > self.max_documents:
+                self._policy_sets.popitem(last=False)
+        return policy_set
+
+    def _get_entry(self, uri):
+        base_uri, _ = urldefrag(str(uri))
+        while True:
+            with self._lock:
+                entry = self._documents.get(base_uri)
+                if entry is not None:
+                    self._documents.move_to_end(base_uri)
+                    self.hits += 1
+                    if time.time() - entry[0] < self.ttl:
+                        inc("policy_documents", cache="hit")
+                    else:
+                        inc("policy_documents", cache="stale")
+                        if base_uri not in self._loading:
+                            self._loading[base_uri] = threading.Event()
+                            if self._reloader is None:
+                                self._reloader = ThreadPoolExecutor(max_workers=2, thread_name_prefix="policy-reload")
+                            self._reloader.submit(self._reload, base_uri)
+                    return entry
+                loading = self._loading.get(base_uri)
+                if loading is None:
+                    loading = self._loading[base_uri] = threading.Event()
+                    self.misses += 1
+                    inc("policy_documents", cache="miss")
+                    break
+            loading.wait() # Someone else is fetching this document, use their result
+
+        try:
+            return self._store(base_uri)
+        finally:
+            with self._lock:
+                self._loading.pop(base_uri).set()
+
+    def _reload(self, base_uri):
+        """Load an expired document again, in the background. The old one is kept if that fails."""
+        try:
+            self._store(base_uri)
+            with self._lock:
+                self._policy_sets.clear() # May hold policies of the old document
+        except Exception as e:
+            inc("policy_reload_failures")
+            logger.warning("Reloading policy document %s failed, still using the one loaded before: %s", base_uri, e)
+            with self._lock:
+                entry = self._documents.get(base_uri)
+                if entry is not None:
+                    # Expires again in retry_after seconds
+                    self._documents[base_uri] = (time.time() - self.ttl + min(self.retry_after, self.ttl),) + entry[1:]
+        finally:
+            with self._lock:
+                self._loading.pop(base_uri).set()
+
+    def _store(self, base_uri):
+        with span("policy_load", uri=base_uri):
+            g = self._load(base_uri)
+            entry = (time.time(), g, compile_document(g))
+        with self._lock:
+            self._documents[base_uri] = entry
+            self._documents.move_to_end(base_uri)
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def _load(self, base_uri):
+        response = get_default_cache().get(base_uri, timeout=self.timeout, accept="text/turtle")
+        # publicID makes relative IRIs such as <#policyA> resolve against the document, like g.parse(base_uri) did
+        return Graph().parse(data=response.text, format="turtle", publicID=base_uri)
+
+    def invalidate(self, uri):
+        base_uri, _ = urldefrag(str(uri))
+        with self._lock:
+            self._documents.pop(base_uri, None)
+            self._policy_sets.clear() # Cheap to rebuild and we don't track which sets used this document
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self._policy_sets.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "policy_sets": len(self._policy_sets),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_default_policy_store():
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = PolicyDocumentStore()
+        return _default_store
+
+def set_default_policy_store(store):
+    global _default_store
+    with _default_store_lock:
+        _default_store = store
@@ -1,20 +1,59 @@
 from SPARQLWrapper import SPARQLWrapper, JSON
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
 import requests
+from requests.adapters import HTTPAdapter
 from rdflib import Namespace
+from .sparql_results import read_sparql_json, DEFAULT_MAX_ROWS, DEFAULT_MAX_BYTES, CHUNK_SIZE
+from .instrumentation import span, inc
+from .result_cache import get_default_result_cache, result_key
+from .endpoints import get_default_capability_cache, get_default_circuit_breaker, EndpointCapabilities, detect_type
+
+logger = logging.getLogger(__name__)
 
 EX = Namespace("http://example.org/")
 
-def run_query(query_graph, query_sbj, user_graph, user, endpoint_url):
-    if 'allegrograph' in endpoint_url:
-        return run_query_agraph(query_graph, query_sbj, user_graph, user, endpoint_url)
-    else:
-        print(f"Endpoint {endpoint_url} is not in supported endpoint types!")
-        return None
-        #raise Warning(f"Endpoint {endpoint_url} is not in supported endpoint types!")
-
-def run_query_agraph(query_graph, query_sbj, user_graph, user, endpoint_url):
-    """Send a query to an Agraphs server. Current implementation using requests instead of agraph-python
-    because requests is very lightweight."""
+DEFAULT_QUERY_WORKERS = 8
+DEFAULT_QUERY_TIMEOUT = 30 # seconds, per endpoint
+QUERY_CANCELLED = "Query cancelled"
+
+def run_query(query_graph, query_sbj, user_graph, user, endpoint_url, session=None, timeout=None, result_options=None,
+              capabilities=None):
+    """Returns (True, SparqlResult) on success and (False, error message) otherwise.
+    result_options are passed on to read_sparql_json (max_rows, max_bytes, spill_path, should_stop).
+    What kind of endpoint this is comes from its last background probe (capabilities, looked up in the cache if
+    not given, see endpoints.py). An endpoint that was not probed yet is sent a standard SPARQL protocol query."""
+    if capabilities is None:
+        capabilities = get_default_capability_cache().peek(endpoint_url)
+    if capabilities is None:
+        capabilities = EndpointCapabilities(endpoint_url, endpoint_type=detect_type(endpoint_url, None))
+    if not capabilities.supported:
+        logger.warning("Endpoint %s is not in supported endpoint types!", endpoint_url)
+        return False, f"Endpoint {endpoint_url} is not a supported SPARQL endpoint"
+    if not capabilities.returns_json:
+        return False, f"Endpoint {endpoint_url} does not return SPARQL JSON results, only {', '.join(capabilities.result_formats)}"
+    if capabilities.type == 'allegrograph':
+        return run_query_agraph(query_graph, query_sbj, user_graph, user, endpoint_url, session=session, timeout=timeout,
+                                result_options=result_options)
+    return run_query_sparql(query_graph, query_sbj, user_graph, user, endpoint_url, session=session, timeout=timeout,
+                            result_options=result_options)
+
+def run_query_agraph(query_graph, query_sbj, user_graph, user, endpoint_url, session=None, timeout=None, result_options=None):
+    """Send a query to an Agraphs server. AllegroGraph speaks the standard SPARQL protocol, so this is
+    run_query_sparql, kept apart for when agraph-python specifics are needed."""
+    return run_query_sparql(query_graph, query_sbj, user_graph, user, endpoint_url, session=session, timeout=timeout,
+                            result_options=result_options)
+
+def run_query_sparql(query_graph, query_sbj, user_graph, user, endpoint_url, session=None, timeout=None, result_options=None):
+    """POST a query to a SPARQL 1.1 protocol endpoint. Current implementation using requests because requests is
+    very lightweight. The response is streamed and read binding by binding, so a huge result set never has to
+    fit in memory (see sparql_results.py). Server errors (5xx) are raised as requests.HTTPError, so they count
+    as failures of the endpoint."""
     headers = {
         'Accept':"application/sparql-results+json",
         "Content-Type": "application/x-www-form-urlencoded"
@@ -28,16 +67,137 @@ def run_query_agraph(query_graph, query_sbj, user_graph, user, endpoint_url):
     
     username = user_graph.value(user, EX.userName) 
     password = user_graph.value(user, EX.password)
-    print("AUTH ",username,password)
     auth = (username, password) if username and password else None
-    print(auth)
 
-    response = requests.post(endpoint_url, headers=headers, data=data, auth=auth)
+    response = (session or requests).post(endpoint_url, headers=headers, data=data, auth=auth, timeout=timeout, stream=True)
+
+    with response:
+        if response.status_code >= 500:
+            response.raise_for_status()
+        if response.status_code == 200:
+            try:
+                return True, read_sparql_json(response.iter_content(chunk_size=CHUNK_SIZE), **(result_options or {}))
+            except ValueError as e:
+                return False, f"SPARQL query failed: {e}"
+        else:
+            return False, f"SPARQL query failed: {response.status_code}\n{response.text}"
+
+
+class QueryExecutor:
+    """Sends the permitted queries to all endpoints at the same time. One requests.Session is shared so
+    connections to a host are kept alive and reused, max_workers caps the number of queries in flight and
+    every request gets timeout seconds. cancel() skips all queries that have not been sent yet and stops reading
+    the responses that are still coming in. Results are read with the max_rows / max_bytes caps, and written
+    to a file in spill_dir if one is given.
+
+    Successful results are kept in result_cache (the shared default ResultCache if not given, result_cache=False
+    disables it), so running the same query for the same user again doesn't hit the endpoint. Only permitted
+    queries are submitted, so the policy check still happens for every request before the cache is looked at.
+
+    Endpoints that time out or fail repeatedly are skipped for a while by circuit_breaker (the shared default
+    CircuitBreaker if not given, False disables it), so a dead triplestore doesn't cost a timeout every run."""
+    def __init__(self, max_workers=DEFAULT_QUERY_WORKERS, timeout=DEFAULT_QUERY_TIMEOUT, max_rows=DEFAULT_MAX_ROWS,
+                 max_bytes=DEFAULT_MAX_BYTES, spill_dir=None, result_cache=None, circuit_breaker=None):
+        self.timeout = timeout
+        self.result_cache = get_default_result_cache() if result_cache is None else result_cache
+        self.circuit_breaker = get_default_circuit_breaker() if circuit_breaker is None else circuit_breaker
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.session = requests.Session()
+        # The session is shared by the queries of all users, a cookie set for one user must not be sent for another
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sparql-query")
+        self.cancelled = threading.Event()
+
+    def _run(self, query_graph, query_sbj, user_graph, user, endpoint_url, max_rows=None, cancelled=None):
+        def should_stop():
+            return self.cancelled.is_set() or (cancelled is not None and cancelled.is_set())
+
+        if should_stop():
+            return False, QUERY_CANCELLED
+        if max_rows is None:
+            max_rows = self.max_rows
+        elif self.max_rows is not None:
+            max_rows = min(max_rows, self.max_rows)
+        key = None
+        if self.result_cache:
+            # max_rows / max_bytes change what a result contains, so they are part of the key as well
+            key = result_key(endpoint_url, query_graph.value(query_sbj, EX.queryText), user,
+                             user_graph.value(user, EX.userName), user_graph.value(user, EX.password),
+                             options=(max_rows, self.max_bytes))
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return True, cached
+        if self.circuit_breaker and not self.circuit_breaker.allow(endpoint_url):
+            inc("circuit_skips")
+            return False, (f"Endpoint {endpoint_url} is skipped after repeated failures, "
+                           f"next try in {self.circuit_breaker.retry_in(endpoint_url):.0f}s")
+        result_options = {
+            "max_rows": max_rows,
+            "max_bytes": self.max_bytes,
+            "should_stop": should_stop,
+        }
+        if self.spill_dir:
+            name = hashlib.sha1(f"{endpoint_url} {query_sbj} {time.time()}".encode("utf-8")).hexdigest()
+            result_options["spill_path"] = os.path.join(self.spill_dir, name + ".jsonl.gz")
+        with span("query", uri=endpoint_url) as tags:
+            try:
+                result = run_query(query_graph, query_sbj, user_graph, user, endpoint_url, session=self.session,
+                                   timeout=self.timeout, result_options=result_options)
+            except requests.Timeout:
+                result = False, f"SPARQL query timed out after {self.timeout} seconds"
+                tags["status"] = "timeout"
+            except requests.RequestException as e:
+                result = False, f"SPARQL query failed: {e}"
+                tags["status"] = "error"
+            except Exception as e:
+                # E.g. a response that is not valid SPARQL JSON. Still recorded, or a trial query after the
+                # cool-down would keep the endpoint skipped for good.
+                logger.exception("Query to %s failed", endpoint_url)
+                result = False, f"SPARQL query failed: {e}"
+                tags["status"] = "error"
+            tags.setdefault("status", "ok" if result[0] else "failed")
+        if self.circuit_breaker:
+            # Only timeouts, connection and server errors count, an endpoint that answers is up
+            if tags["status"] in ("timeout", "error"):
+                self.circuit_breaker.record_failure(endpoint_url)
+            else:
+                self.circuit_breaker.record_success(endpoint_url)
+        if not result[0]:
+            logger.warning("Query to %s failed: %s", endpoint_url, result[1])
+        elif key is not None:
+            self.result_cache.put(key, result[1])
+        return result
+
+    def submit(self, query_graph, query_sbj, user_graph, user, endpoint_url, max_rows=None, cancelled=None):
+        """Schedule one query, returns a Future that resolves to the (success, response) tuple of run_query.
+        max_rows lowers the row cap for this query only. cancelled is an optional threading.Event that cancels
+        just this query (and whatever else was submitted with it), where cancel() stops everything."""
+        return self.executor.submit(self._run, query_graph, query_sbj, user_graph, user, endpoint_url,
+                                    max_rows=max_rows, cancelled=cancelled)
+
+    def run_all(self, jobs):
+        """Run a list of (query_graph, query_sbj, user_graph, user, endpoint_url) jobs concurrently.
+        Returns the (success, response) tuples in the same order as jobs."""
+        futures = [self.submit(*job) for job in jobs]
+        return [f.result() for f in futures]
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
 
-    if response.status_code == 200:
-        return True, response.json()["results"]["bindings"]
-    else:
-        return False, f"SPARQL query failed: {response.status_code}\n{response.text}"
+    def __exit__(self, *exc):
+        self.shutdown()
 
 
 def run_query_TODO(query, dataset_uri):
@@ -49,6 +209,6 @@ def run_query_TODO(query, dataset_uri):
     sparql.setCredentials('user', 'pass')
 
     results = sparql.query().convert()
-    print(results)
+    logger.debug(results)
 
 
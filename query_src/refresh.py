@@ -0,0 +1,192 @@
+"""Background re-crawling of FDPs (stale-while-revalidate).
+
+A RefreshScheduler keeps the last good crawl of every FDP it knows in memory and re-crawls each of them every
+interval seconds (plus or minus jitter, so FDPs added together don't stay in lock step). Re-crawls are
+incremental against the previous tree, see crawl_fdp_concurrent. get() always answers from memory, and from
+the snapshot file for FDPs it has not crawled yet, so evaluations never wait on the network. Only an FDP that
+was never crawled before and has no snapshot has to be crawled in the foreground once.
+FDPs whose crawl fails are retried with exponential backoff, up to max_backoff seconds."""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .crawl_pool import CrawlPool, DEFAULT_MAX_WORKERS, DEFAULT_MAX_PER_HOST, DEFAULT_TIMEOUT, DEFAULT_RATE_PER_HOST
+from .fdp_crawler import crawl_fdp_concurrent, probe_endpoints
+from .frontier import CrawlFrontier
+from .snapshot import load_snapshot, save_snapshot
+from .instrumentation import span, inc
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 300 # seconds between two crawls of the same FDP
+DEFAULT_JITTER = 0.1 # fraction of the interval
+DEFAULT_MAX_BACKOFF = 3600 # seconds
+
+
+class FDPState:
+    def __init__(self, fdp_uri):
+        self.fdp_uri = fdp_uri
+        self.fdp = None # last good crawl
+        self.crawled_at = None
+        self.last_attempt = None
+        self.last_duration = None
+        self.last_stats = None
+        self.failures = 0 # consecutive failed crawls
+        self.error = None
+        self.next_refresh = 0.0
+        self.refreshing = False
+        self.done = threading.Event() # set once the first crawl (or snapshot load) finished
+
+
+class RefreshScheduler:
+    def __init__(self, fdp_uris=(), interval=DEFAULT_INTERVAL, jitter=DEFAULT_JITTER, max_backoff=DEFAULT_MAX_BACKOFF,
+                 snapshot_path=None, max_workers=DEFAULT_MAX_WORKERS, max_per_host=DEFAULT_MAX_PER_HOST,
+                 timeout=DEFAULT_TIMEOUT, max_parallel_fdps=2, rate_per_host=DEFAULT_RATE_PER_HOST, max_depth=None,
+                 max_nodes=None):
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.snapshot_path = snapshot_path
+        self.pool = CrawlPool(max_workers=max_workers, max_per_host=max_per_host, timeout=timeout, rate_per_host=rate_per_host)
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes # per refresh of one FDP
+        self.executor = ThreadPoolExecutor(max_workers=max_parallel_fdps, thread_name_prefix="fdp-refresh")
+        self._states = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.random = random.Random()
+        for fdp_uri in fdp_uris:
+            self.add(fdp_uri)
+
+    def add(self, fdp_uri):
+        """Start tracking an FDP. Its snapshot, if there is one, is served until the first refresh is done."""
+        with self._lock:
+            if fdp_uri in self._states:
+                return self._states[fdp_uri]
+            state = self._states[fdp_uri] = FDPState(fdp_uri)
+        if self.snapshot_path is not None:
+            fdp, crawled_at = load_snapshot(self.snapshot_path, fdp_uri)
+            if fdp is not None:
+                state.fdp, state.crawled_at = fdp, crawled_at
+                state.next_refresh = crawled_at + self._delay(0)
+                state.done.set()
+                self.executor.submit(probe_endpoints, fdp)
+        self._wakeup.set()
+        return state
+
+    def _delay(self, failures):
+        delay = self.interval if failures == 0 else min(self.interval * 2 ** failures, self.max_backoff)
+        return delay * (1 + self.random.uniform(-self.jitter, self.jitter))
+
+    # --- Serving ---
+    def get(self, fdp_uris):
+        """(fdp_uri, FDP) tuples from memory, however old. FDPs that have never been crawled are added and
+        waited for. Stale ones keep being served while their refresh runs in the background."""
+        states = [self.add(fdp_uri) for fdp_uri in fdp_uris]
+        for state in states:
+            if not state.done.is_set():
+                self.refresh_now(state.fdp_uri)
+                state.done.wait()
+        return [(state.fdp_uri, state.fdp) for state in states]
+
+    def refresh_now(self, fdp_uri):
+        """Schedule a refresh right away, unless one is already running"""
+        state = self.add(fdp_uri)
+        with self._lock:
+            if state.refreshing:
+                return
+            state.refreshing = True
+        self.executor.submit(self._refresh, state)
+
+    # --- Crawling ---
+    def _refresh(self, state):
+        start = time.time()
+        stats = {}
+        error = None
+        try:
+            with span("refresh", uri=state.fdp_uri) as tags:
+                frontier = CrawlFrontier(max_depth=self.max_depth, max_nodes=self.max_nodes)
+                fdp = crawl_fdp_concurrent(state.fdp_uri, self.pool, previous=state.fdp, stats=stats, frontier=frontier)
+                if stats["failed"]:
+                    error = f"{stats['failed']} documents could not be fetched"
+                tags["status"] = "failed" if error else "ok"
+        except Exception as e:
+            logger.exception("Refreshing %s failed", state.fdp_uri)
+            fdp, error = None, str(e)
+
+        with self._lock:
+            state.last_attempt = start
+            state.last_duration = time.time() - start
+            state.last_stats = stats
+            if fdp is not None:
+                # A partly failed crawl still holds the previous data for what could not be fetched,
+                # but its age is only reset by a complete crawl
+                state.fdp = fdp
+                if not error or state.crawled_at is None:
+                    state.crawled_at = start
+            state.failures = state.failures + 1 if error else 0
+            state.error = error
+            state.next_refresh = time.time() + self._delay(state.failures)
+            state.refreshing = False
+        if fdp is not None and self.snapshot_path is not None:
+            save_snapshot(self.snapshot_path, fdp, crawled_at=state.crawled_at)
+        if error:
+            inc("refresh_failures")
+            logger.warning("Refresh of %s failed (%d in a row, next try in %.0fs): %s", state.fdp_uri,
+                           state.failures, state.next_refresh - time.time(), error)
+        else:
+            logger.info("Refreshed %s in %.2fs: %d new, %d changed, %d unchanged, %d removed nodes", state.fdp_uri,
+                        state.last_duration, stats['new'], stats['parsed'], stats['unchanged'], stats['removed'])
+        state.done.set() # Also on failure, so get() returns (an FDP of None) instead of hanging
+        self._wakeup.set()
+        if fdp is not None:
+            probe_endpoints(fdp) # After done, get() only reads the probe results and never waits for them
+
+    def _run(self):
+        while not self._stopped.is_set():
+            now = time.time()
+            with self._lock:
+                states = list(self._states.values())
+            for state in states:
+                if not state.refreshing and state.next_refresh <= now:
+                    self.refresh_now(state.fdp_uri)
+            with self._lock:
+                waiting = [s.next_refresh for s in self._states.values() if not s.refreshing]
+            timeout = max(0.05, min(waiting) - time.time()) if waiting else self.interval
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="fdp-refresh-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.executor.shutdown(wait=True)
+        self.pool.shutdown()
+
+    def freshness(self):
+        """Per FDP: age of the served crawl, duration of the last refresh, failures and when the next refresh is"""
+        now = time.time()
+        with self._lock:
+            return {
+                state.fdp_uri: {
+                    "age_seconds": now - state.crawled_at if state.crawled_at is not None else None,
+                    "last_refresh_seconds": state.last_duration,
+                    "last_stats": state.last_stats,
+                    "refreshing": state.refreshing,
+                    "failures": state.failures,
+                    "error": state.error,
+                    "next_refresh_in": max(0.0, state.next_refresh - now),
+                }
+                for state in self._states.values()
+            }
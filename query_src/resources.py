@@ -0,0 +1,110 @@
+"""The FDP hierarchy as built by the crawler. Each resource points down and has a set of policies.
+
+Large FDPs give hundreds of thousands of these objects, so they are kept small: the classes use __slots__,
+URIs and policy references are interned (a URI that appears at many nodes, like a shared policy or endpoint,
+is stored once), and once a tree is complete compact() turns its lists into tuples. BNode policies hold a
+PolicyClosure with only their own triples instead of the graph of the whole document.
+
+Policy references are interned in a RefTable that belongs to one crawl or snapshot load and goes away with
+it, so a long running process doesn't keep every URI it has ever seen."""
+import sys
+
+from rdflib import URIRef
+
+
+def intern_uri(uri):
+    return sys.intern(str(uri))
+
+class RefTable:
+    """The shared URIRefs and (ref, None) policy references of one crawl or snapshot load"""
+    __slots__ = ("_uri_refs", "_policy_refs")
+
+    def __init__(self):
+        self._uri_refs = {} # str -> the one URIRef instance used for it
+        self._policy_refs = {} # URIRef -> the one (ref, None) tuple used for it
+
+    def uri_ref(self, ref):
+        """The shared URIRef for ref"""
+        key = str(ref)
+        uri_ref = self._uri_refs.get(key)
+        if uri_ref is None:
+            uri_ref = self._uri_refs.setdefault(key, URIRef(key))
+        return uri_ref
+
+    def policy_ref(self, ref):
+        ref = self.uri_ref(ref)
+        entry = self._policy_refs.get(ref)
+        if entry is None:
+            entry = self._policy_refs.setdefault(ref, (ref, None))
+        return entry
+
+def policy_ref(ref, source=None, ref_table=None):
+    """A (ref, source) policy reference as stored in resource.policies. References to policy documents
+    (source None) are shared between all resources that got them from the same ref_table."""
+    if source is not None:
+        return (ref, source)
+    if ref_table is None:
+        return (URIRef(str(ref)), None)
+    return ref_table.policy_ref(ref)
+
+
+class PolicyAwareResource:
+    __slots__ = ("uri", "policies", "fetched_at", "modified", "etag", "last_modified")
+
+    def __init__(self, uri):
+        self.uri = intern_uri(uri)
+        self.policies = []
+        # Fetch information, used by the snapshot store and the incremental crawl
+        self.fetched_at = None
+        self.modified = None # dct:modified as stated in the document of the resource
+        self.etag = None
+        self.last_modified = None
+
+class Distribution(PolicyAwareResource):
+    __slots__ = ("sparql_endpoints",)
+
+    def __init__(self, uri):
+        super().__init__(uri)
+        self.sparql_endpoints = []
+
+class Dataset(PolicyAwareResource):
+    __slots__ = ("distributions",)
+
+    def __init__(self, uri):
+        super().__init__(uri)
+        self.distributions = []
+
+class Catalog(PolicyAwareResource):
+    __slots__ = ("datasets",)
+
+    def __init__(self, uri):
+        super().__init__(uri)
+        self.datasets = []
+
+class FDP(PolicyAwareResource):
+    __slots__ = ("catalogs",)
+
+    def __init__(self, base_uri):
+        super().__init__(base_uri)
+        self.catalogs = []
+
+# The hierarchy from top to bottom, with the attribute that holds the children of each level
+LEVELS = ((FDP, "catalogs"), (Catalog, "datasets"), (Dataset, "distributions"), (Distribution, None))
+CHILDREN = {cls: children_attr for cls, children_attr in LEVELS}
+
+
+def compact(root):
+    """Freeze a finished tree: every list (children, policies, endpoints) becomes a tuple, which has no spare
+    capacity. Nothing is appended to a tree after its crawl, an incremental crawl builds new nodes."""
+    todo = [root]
+    while todo:
+        node = todo.pop()
+        node.policies = tuple(node.policies)
+        children_attr = CHILDREN[type(node)]
+        if children_attr is None:
+            node.sparql_endpoints = tuple(intern_uri(url) for url in node.sparql_endpoints)
+        else:
+            children = tuple(getattr(node, children_attr))
+            setattr(node, children_attr, children)
+            todo.extend(children)
+    return root
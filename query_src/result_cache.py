@@ -0,0 +1,231 @@
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from .instrumentation import inc
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024 # counted as the size of the SPARQL responses
+DEFAULT_TTL = 300 # seconds
+DEFAULT_MAX_DISK_BYTES = 1024 * 1024 * 1024
+
+# String literals and IRIs are copied as they are, everything in between is normalized
+_LITERAL_OR_IRI = re.compile(r'("""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|<[^<>"{}|^`\\\s]*>)')
+_PREFIX_DECL = re.compile(r'^\s*PREFIX\s+([A-Za-z][\w.-]*)?:\s*<([^>]*)>', re.IGNORECASE)
+
+
+def normalize_query(query):
+    """Canonical form of a SPARQL query for the cache key: comments dropped, whitespace collapsed and
+    prefixed names expanded to full IRIs, so the order, names and use of PREFIX declarations don't matter.
+    Only meant for comparing queries, the original text is what gets sent to the endpoint."""
+    parts = _LITERAL_OR_IRI.split(str(query))
+    # Even parts are plain query text, odd parts literals/IRIs
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"#[^\n]*", " ", parts[i])
+
+    prefixes = {}
+    body = []
+    i = 0
+    while i < len(parts):
+        if i % 2 == 0 and i + 1 < len(parts):
+            match = _PREFIX_DECL.match(parts[i] + parts[i + 1])
+            if match and match.end() == len(parts[i]) + len(parts[i + 1]):
+                # The declaration is the end of this text part plus the IRI that follows it
+                prefixes[match.group(1) or ""] = match.group(2)
+                i += 2
+                continue
+        body.append(parts[i])
+        i += 1
+
+    normalized = []
+    for part in body:
+        if not _LITERAL_OR_IRI.fullmatch(part):
+            for prefix, iri in prefixes.items():
+                part = re.sub(rf"(?<![\w?$:<]){re.escape(prefix)}:((?:[\w-](?:[\w.-]*[\w-])?)?)",
+                              lambda m, iri=iri: f"<{iri}{m.group(1)}>", part)
+            part = " ".join(part.split())
+        normalized.append(part)
+    return " ".join(p for p in normalized if p)
+
+def credentials_digest(username, password):
+    """Hash of the credentials that are sent to the endpoint, never stored in the clear"""
+    if not username and not password:
+        return ""
+    return hashlib.sha256(f"{username or ''}\0{password or ''}".encode("utf-8")).hexdigest()
+
+def result_key(endpoint_url, query, user, username=None, password=None, options=()):
+    """Cache key of one query. The principal is part of the key: endpoints may answer differently per account.
+    The user IRI only comes from the (uploaded) user graph, so the credentials that are actually sent are in the
+    key as well. A hit then needs the same username and password the endpoint accepted, not just the same IRI.
+    options holds anything else that changes the result, e.g. the row limit it was read with."""
+    text = "\n".join([str(endpoint_url), normalize_query(query), str(user), credentials_digest(username, password),
+                      repr(tuple(options))])
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Recent SPARQL results in memory, least recently used first out once there are more than max_entries
+    or their responses add up to more than max_bytes. With a spill_dir, entries pushed out of memory are
+    pickled to disk (up to max_disk_bytes) and loaded again on the next hit. Entries expire after ttl seconds.
+
+    Only results of permitted queries are stored, and the cache is consulted after the policy check, never
+    instead of it: a user only ever gets a cached result for a query they were just allowed to run."""
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, spill_dir=None,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.max_disk_bytes = max_disk_bytes
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        self._entries = OrderedDict() # key -> (stored_at, SparqlResult)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spilled = 0
+
+    @staticmethod
+    def cacheable(result):
+        """Cancelled reads are incomplete in a way that depends on timing, so they are never stored."""
+        if result.truncated and result.truncated_reason == "cancelled":
+            return False
+        return result.spill_path is None or os.path.exists(result.spill_path)
+
+    def get(self, key):
+        """Returns a copy of the cached SparqlResult with from_cache set, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] >= self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                inc("result_cache", cache="hit")
+                return self._copy(entry[1])
+
+        entry = self._read_spilled(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                inc("result_cache", cache="miss")
+                return None
+            self.disk_hits += 1
+            inc("result_cache", cache="disk")
+            self._store(key, *entry)
+            return self._copy(entry[1])
+
+    def put(self, key, result):
+        if not self.cacheable(result):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._store(key, time.time(), result)
+
+    def _store(self, key, stored_at, result):
+        self._entries[key] = (stored_at, result)
+        self._bytes += result.bytes_read
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            old_key, (old_stored_at, old_result) = self._entries.popitem(last=False)
+            self._bytes -= old_result.bytes_read
+            self.evictions += 1
+            if self.spill_dir and time.time() - old_stored_at < self.ttl:
+                self._spill(old_key, old_stored_at, old_result)
+
+    def _drop(self, key):
+        _, result = self._entries.pop(key)
+        self._bytes -= result.bytes_read
+
+    @staticmethod
+    def _copy(result):
+        result = copy.copy(result) # Rows are shared, but callers only read them
+        result.from_cache = True
+        return result
+
+    # --- Disk spill ---
+    def _path(self, key):
+        return os.path.join(self.spill_dir, key + ".pickle")
+
+    def _spill(self, key, stored_at, result):
+        try:
+            with open(self._path(key), "wb") as f:
+                pickle.dump((stored_at, result), f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.spilled += 1
+            self._trim_disk()
+        except OSError as e:
+            logger.warning("Could not spill cached result to %s: %s", self.spill_dir, e)
+
+    def _read_spilled(self, key):
+        if not self.spill_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                stored_at, result = pickle.load(f)
+            os.remove(path) # It moves back into memory
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if time.time() - stored_at >= self.ttl or not self.cacheable(result):
+            return None
+        return stored_at, result
+
+    def _trim_disk(self):
+        files = [os.path.join(self.spill_dir, name) for name in os.listdir(self.spill_dir) if name.endswith(".pickle")]
+        files = sorted(((os.path.getmtime(path), os.path.getsize(path), path) for path in files), reverse=True)
+        total = 0
+        for mtime, size, path in files:
+            total += size
+            if total > self.max_disk_bytes or time.time() - mtime >= self.ttl:
+                os.remove(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self.spill_dir:
+                for name in os.listdir(self.spill_dir):
+                    if name.endswith(".pickle"):
+                        os.remove(os.path.join(self.spill_dir, name))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "spilled": self.spilled,
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_result_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache(spill_dir=os.environ.get("ODRL_RESULT_CACHE_DIR"))
+        return _default_cache
+
+def set_default_result_cache(cache):
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
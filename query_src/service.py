@@ -0,0 +1,291 @@
+"""Long running evaluation service. Keeps the crawled FDPs, the policy store, the HTTP cache and the query
+connection pool warm between requests, so only the first request after a start pays for the crawl.
+
+    python -m query_src.service --port 8765 --fdp-uris fdp_uris.txt
+
+POST /evaluate with {"fdp_uris": [...], "user": <turtle>, "query": <turtle>} returns all results at once,
+add "stream": true to get JSON lines events ({"event": "decision"|"data", "res": {...}}) as they come in,
+closed by a {"event": "done", "server_seconds": ...} line. GET /stats has the cache statistics and request
+latencies, GET /metrics the Prometheus metrics. ServiceClient is the python side of this API."""
+import argparse
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from rdflib import Graph
+
+from .fdp_crawler import crawl_fdps, prepare_queries, iter_evaluate_crawled, probe_endpoints
+from .decision_cache import DecisionCache
+from .http_cache import get_default_cache
+from .policy_store import get_default_policy_store
+from .query_runner import QueryExecutor
+from .endpoints import get_default_capability_cache
+from .refresh import RefreshScheduler
+from .instrumentation import span, prometheus_text, configure_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+DEFAULT_CRAWL_MAX_AGE = 600 # seconds a crawl is reused before the FDP is crawled again
+LATENCY_WINDOW = 1000 # number of recent requests the latency percentiles are computed over
+
+
+class EvaluationService:
+    """Everything that should outlive a single request. Crawls are kept per FDP URI for crawl_max_age
+    seconds, decisions are still made for every request (with a DecisionCache per request, as the
+    orchestrator does), and queries go through one shared QueryExecutor and its result cache.
+
+    With a (started) RefreshScheduler the crawls come from the scheduler instead: requests are answered from
+    the last good crawl right away and FDPs are re-crawled in the background (see refresh.py)."""
+    def __init__(self, crawl_options=None, crawl_max_age=DEFAULT_CRAWL_MAX_AGE, query_executor=None, scheduler=None):
+        self.scheduler = scheduler
+        self.crawl_options = crawl_options or {}
+        self.crawl_max_age = crawl_max_age
+        self.query_executor = query_executor or QueryExecutor()
+        self._crawled = {} # fdp_uri -> (crawled_at, FDP)
+        self._crawl_lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._latency_lock = threading.Lock()
+        self.requests = 0
+
+    def get_crawled(self, fdp_uris, refresh=False):
+        """(fdp_uri, FDP) tuples for fdp_uris, crawling the ones that are missing or too old"""
+        if self.scheduler is not None:
+            if refresh:
+                for fdp_uri in fdp_uris:
+                    self.scheduler.refresh_now(fdp_uri) # Serve what we have, the next request gets the new crawl
+            return [(fdp_uri, fdp) for fdp_uri, fdp in self.scheduler.get(fdp_uris) if fdp is not None]
+
+        def stale(fdp_uri):
+            entry = self._crawled.get(fdp_uri)
+            return refresh or entry is None or time.time() - entry[0] >= self.crawl_max_age
+
+        if any(stale(fdp_uri) for fdp_uri in fdp_uris):
+            # One crawl at a time: concurrent requests for the same FDPs wait for it instead of crawling again
+            with self._crawl_lock:
+                missing = [fdp_uri for fdp_uri in dict.fromkeys(fdp_uris) if stale(fdp_uri)]
+                if missing:
+                    crawled_at = time.time()
+                    for fdp_uri, fdp in zip(missing, crawl_fdps(missing, **self.crawl_options)):
+                        self._crawled[fdp_uri] = (crawled_at, fdp)
+                        probe_endpoints(fdp, background=True)
+        return [(fdp_uri, self._crawled[fdp_uri][1]) for fdp_uri in fdp_uris]
+
+    def iter_evaluate(self, fdp_uris, user_graph, query_graph, refresh=False):
+        """Same (event, res) stream as iter_query_orchestrator, on the warm crawl. Every res gets a
+        result_id, so the "data" event of an endpoint can be matched with its "decision" event."""
+        start = time.perf_counter()
+        try:
+            with span("request"):
+                prepared_queries = prepare_queries(user_graph, query_graph, 'graph')
+                crawled = self.get_crawled(fdp_uris, refresh=refresh)
+                result_ids = itertools.count()
+                for event, res in iter_evaluate_crawled(crawled, prepared_queries, DecisionCache(), self.query_executor):
+                    if event == "decision":
+                        # The "data" event of this endpoint comes later with the same dict
+                        res["result_id"] = next(result_ids)
+                    yield event, res
+        finally:
+            self._record_latency(time.perf_counter() - start)
+
+    def evaluate(self, fdp_uris, user_graph, query_graph, refresh=False):
+        results = []
+        for event, res in self.iter_evaluate(fdp_uris, user_graph, query_graph, refresh=refresh):
+            if event == "decision":
+                results.append(res)
+        return results
+
+    def _record_latency(self, seconds):
+        with self._latency_lock:
+            self._latencies.append(seconds)
+            self.requests += 1
+
+    def stats(self):
+        with self._latency_lock:
+            latencies = sorted(self._latencies)
+            requests_served = self.requests
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+        return {
+            "requests": requests_served,
+            "latency_seconds": {"p50": percentile(0.5), "p95": percentile(0.95), "max": latencies[-1] if latencies else None},
+            "crawled_fdps": (self.scheduler.freshness() if self.scheduler is not None else
+                             {fdp_uri: {"crawled_at": crawled_at} for fdp_uri, (crawled_at, _) in self._crawled.items()}),
+            "policy_store": get_default_policy_store().stats(),
+            "http_cache": dict(get_default_cache().stats),
+            "result_cache": self.query_executor.result_cache.stats() if self.query_executor.result_cache else None,
+            "endpoints": get_default_capability_cache().stats(),
+            "circuit_breaker": self.query_executor.circuit_breaker.stats() if self.query_executor.circuit_breaker else None,
+        }
+
+    def shutdown(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        self.query_executor.shutdown()
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, body):
+        data = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self._send_json(200, self.server.service.stats())
+        elif self.path == "/metrics":
+            data = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path != "/evaluate":
+            self.send_error(404)
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            fdp_uris = body["fdp_uris"]
+            user_graph = Graph().parse(data=body["user"], format="turtle")
+            query_graph = Graph().parse(data=body["query"], format="turtle")
+        except Exception as e:
+            self._send_json(400, {"error": f"Invalid request: {e}"})
+            return
+
+        start = time.perf_counter()
+        events = self.server.service.iter_evaluate(fdp_uris, user_graph, query_graph, refresh=body.get("refresh", False))
+        if not body.get("stream"):
+            try:
+                results = [res for event, res in events if event == "decision"]
+            except Exception as e:
+                logger.exception("Evaluation failed")
+                self._send_json(500, {"error": str(e)})
+                return
+            self._send_json(200, {"results": results, "server_seconds": time.perf_counter() - start})
+            return
+
+        # No Content-Length: the stream ends when the connection is closed (HTTP/1.0)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            for event, res in events:
+                self.wfile.write(json.dumps({"event": event, "res": res}, default=str).encode("utf-8") + b"\n")
+                self.wfile.flush()
+            done = {"event": "done", "server_seconds": time.perf_counter() - start}
+        except (BrokenPipeError, ConnectionResetError):
+            events.close() # Client went away, stop evaluating for it
+            return
+        except Exception as e:
+            logger.exception("Evaluation failed")
+            done = {"event": "error", "error": str(e), "server_seconds": time.perf_counter() - start}
+        self.wfile.write(json.dumps(done).encode("utf-8") + b"\n")
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def serve(service=None, port=DEFAULT_PORT, host="localhost"):
+    """Start the service in a background thread. Returns the server, call server.shutdown() when done."""
+    server = ThreadingHTTPServer((host, port), _ServiceHandler)
+    server.daemon_threads = True
+    server.service = service or EvaluationService()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Evaluation service listening on http://%s:%s", host, server.server_address[1])
+    return server
+
+
+class ServiceClient:
+    """Talks to a running evaluation service. Graphs can be given as rdflib Graphs or turtle text."""
+    def __init__(self, base_url, timeout=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.last_server_seconds = None # Server side latency of the last finished request
+
+    @staticmethod
+    def _turtle(graph):
+        return graph if isinstance(graph, str) else graph.serialize(format="turtle")
+
+    def _body(self, fdp_uris, user_graph, query_graph, refresh, stream):
+        return {"fdp_uris": list(fdp_uris), "user": self._turtle(user_graph), "query": self._turtle(query_graph),
+                "refresh": refresh, "stream": stream}
+
+    def iter_evaluate(self, fdp_uris, user_graph, query_graph, refresh=False):
+        body = self._body(fdp_uris, user_graph, query_graph, refresh, stream=True)
+        with self.session.post(f"{self.base_url}/evaluate", json=body, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if message["event"] == "done":
+                    self.last_server_seconds = message["server_seconds"]
+                elif message["event"] == "error":
+                    self.last_server_seconds = message["server_seconds"]
+                    raise RuntimeError(f"Evaluation service failed: {message['error']}")
+                else:
+                    yield message["event"], message["res"]
+
+    def evaluate(self, fdp_uris, user_graph, query_graph, refresh=False):
+        body = self._body(fdp_uris, user_graph, query_graph, refresh, stream=False)
+        response = self.session.post(f"{self.base_url}/evaluate", json=body, timeout=self.timeout)
+        response.raise_for_status()
+        result = response.json()
+        self.last_server_seconds = result["server_seconds"]
+        return result["results"]
+
+    def stats(self):
+        response = self.session.get(f"{self.base_url}/stats", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the ODRL evaluation service")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--fdp-uris", help="File with FDP URIs to crawl at startup, so the first request is warm")
+    parser.add_argument("--crawl-max-age", type=float, default=DEFAULT_CRAWL_MAX_AGE,
+                        help="Seconds a crawl is reused before the FDP is crawled again")
+    parser.add_argument("--snapshot", help="SQLite crawl snapshot, makes re-crawls after a restart incremental")
+    parser.add_argument("--refresh-interval", type=float,
+                        help="Re-crawl the FDPs in the background every this many seconds and never crawl during a request")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level.upper())
+
+    fdp_uris = []
+    if args.fdp_uris:
+        with open(args.fdp_uris) as f:
+            fdp_uris = [line.strip() for line in f if line.strip()]
+    crawl_options = {"snapshot_path": args.snapshot} if args.snapshot else {}
+    scheduler = None
+    if args.refresh_interval:
+        scheduler = RefreshScheduler(fdp_uris, interval=args.refresh_interval, snapshot_path=args.snapshot).start()
+    service = EvaluationService(crawl_options=crawl_options, crawl_max_age=args.crawl_max_age, scheduler=scheduler)
+    service.get_crawled(fdp_uris)
+    server = serve(service, port=args.port, host=args.host)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
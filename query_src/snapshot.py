@@ -0,0 +1,146 @@
+import sqlite3
+import time
+from contextlib import closing
+
+from rdflib import Graph, BNode
+
+from .resources import LEVELS, Distribution, RefTable, policy_ref, compact
+from .policy_index import PolicyClosure
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    fdp_uri TEXT PRIMARY KEY,
+    crawled_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    fdp_uri TEXT NOT NULL,
+    parent_id INTEGER,
+    position INTEGER NOT NULL,
+    level TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    fetched_at REAL,
+    modified TEXT,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE INDEX IF NOT EXISTS nodes_by_fdp ON nodes (fdp_uri, parent_id, position);
+CREATE TABLE IF NOT EXISTS policies (
+    node_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    ref TEXT NOT NULL,
+    bnode_triples TEXT -- N-Triples of a BNode policy with its nested rules, NULL for URI policies
+);
+CREATE INDEX IF NOT EXISTS policies_by_node ON policies (node_id);
+CREATE TABLE IF NOT EXISTS endpoints (
+    node_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS endpoints_by_node ON endpoints (node_id);
+"""
+
+LEVEL_CLASSES = {node_cls.__name__: (node_cls, children_attr) for node_cls, children_attr in LEVELS}
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.executescript(SCHEMA)
+    return conn
+
+def _bnode_closure(source, bnode):
+    """All triples describing a BNode policy, including the BNodes of its rules and constraints"""
+    closure = Graph()
+    for triple in PolicyClosure.from_graph(source, bnode):
+        closure.add(triple)
+    # Skolemize so the BNode labels survive the round trip through N-Triples
+    return closure.skolemize().serialize(format="nt")
+
+def _delete(conn, fdp_uri):
+    node_ids = "SELECT id FROM nodes WHERE fdp_uri = ?"
+    conn.execute(f"DELETE FROM policies WHERE node_id IN ({node_ids})", (fdp_uri,))
+    conn.execute(f"DELETE FROM endpoints WHERE node_id IN ({node_ids})", (fdp_uri,))
+    conn.execute("DELETE FROM nodes WHERE fdp_uri = ?", (fdp_uri,))
+    conn.execute("DELETE FROM snapshots WHERE fdp_uri = ?", (fdp_uri,))
+
+def save_snapshot(path, fdp, crawled_at=None):
+    """Store a crawled FDP tree in the SQLite file at path, replacing an older snapshot of the same FDP."""
+    with closing(_connect(path)) as conn, conn:
+        _delete(conn, fdp.uri)
+        conn.execute("INSERT INTO snapshots (fdp_uri, crawled_at) VALUES (?, ?)", (fdp.uri, crawled_at or time.time()))
+
+        todo = [(fdp, None, 0)]
+        while todo:
+            node, parent_id, position = todo.pop()
+            node_id = conn.execute(
+                "INSERT INTO nodes (fdp_uri, parent_id, position, level, uri, fetched_at, modified, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (fdp.uri, parent_id, position, type(node).__name__, node.uri, node.fetched_at, node.modified,
+                 node.etag, node.last_modified)
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO policies (node_id, position, ref, bnode_triples) VALUES (?, ?, ?, ?)",
+                [(node_id, i, str(ref), _bnode_closure(source_graph, ref) if isinstance(ref, BNode) else None)
+                 for i, (ref, source_graph) in enumerate(node.policies)]
+            )
+            if isinstance(node, Distribution):
+                conn.executemany("INSERT INTO endpoints (node_id, position, url) VALUES (?, ?, ?)",
+                                 [(node_id, i, url) for i, url in enumerate(node.sparql_endpoints)])
+
+            _, children_attr = LEVEL_CLASSES[type(node).__name__]
+            if children_attr:
+                for i, child in enumerate(getattr(node, children_attr)):
+                    todo.append((child, node_id, i))
+
+def load_snapshot(path, fdp_uri):
+    """Rebuild the FDP tree stored for fdp_uri. Returns (FDP, crawled_at), or (None, None) if there is none."""
+    with closing(_connect(path)) as conn:
+        row = conn.execute("SELECT crawled_at FROM snapshots WHERE fdp_uri = ?", (fdp_uri,)).fetchone()
+        if row is None:
+            return None, None
+        crawled_at = row[0]
+
+        policies = {}
+        ref_table = RefTable() # Shared by this tree only
+        for node_id, ref, bnode_triples in conn.execute(
+                "SELECT p.node_id, p.ref, p.bnode_triples FROM policies p JOIN nodes n ON n.id = p.node_id "
+                "WHERE n.fdp_uri = ? ORDER BY p.node_id, p.position", (fdp_uri,)):
+            if bnode_triples is None:
+                policies.setdefault(node_id, []).append(policy_ref(ref, ref_table=ref_table))
+            else:
+                source_graph = Graph().parse(data=bnode_triples, format="nt").de_skolemize()
+                policies.setdefault(node_id, []).append(policy_ref(BNode(ref), PolicyClosure(source_graph)))
+
+        endpoints = {}
+        for node_id, url in conn.execute(
+                "SELECT e.node_id, e.url FROM endpoints e JOIN nodes n ON n.id = e.node_id "
+                "WHERE n.fdp_uri = ? ORDER BY e.node_id, e.position", (fdp_uri,)):
+            endpoints.setdefault(node_id, []).append(url)
+
+        root = None
+        nodes = {}
+        for node_id, parent_id, level, uri, fetched_at, modified, etag, last_modified in conn.execute(
+                "SELECT id, parent_id, level, uri, fetched_at, modified, etag, last_modified FROM nodes "
+                "WHERE fdp_uri = ? ORDER BY parent_id IS NOT NULL, parent_id, position", (fdp_uri,)):
+            node_cls, _ = LEVEL_CLASSES[level]
+            node = node_cls(uri)
+            node.fetched_at, node.modified, node.etag, node.last_modified = fetched_at, modified, etag, last_modified
+            node.policies = policies.get(node_id, [])
+            if isinstance(node, Distribution):
+                node.sparql_endpoints = endpoints.get(node_id, [])
+            nodes[node_id] = node
+            if parent_id is None:
+                root = node
+            else:
+                parent = nodes[parent_id]
+                getattr(parent, LEVEL_CLASSES[type(parent).__name__][1]).append(node)
+    return (compact(root) if root is not None else None), crawled_at
+
+def list_snapshots(path):
+    """(fdp_uri, crawled_at) for every FDP in the snapshot file"""
+    with closing(_connect(path)) as conn:
+        return conn.execute("SELECT fdp_uri, crawled_at FROM snapshots ORDER BY fdp_uri").fetchall()
+
+def delete_snapshot(path, fdp_uri):
+    with closing(_connect(path)) as conn, conn:
+        _delete(conn, fdp_uri)
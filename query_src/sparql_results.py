@@ -0,0 +1,192 @@
+import codecs
+import gzip
+import json
+import os
+
+DEFAULT_MAX_ROWS = 10000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_PREVIEW_ROWS = 100 # rows kept in memory when the full result is spilled to disk
+CHUNK_SIZE = 64 * 1024
+
+
+class ResultTruncated(Exception):
+    pass
+
+
+class SparqlResult:
+    """Outcome of reading an application/sparql-results+json response. rows holds the bindings that were
+    kept in memory, row_count the number of bindings that were read. If the result was spilled, all read
+    bindings are in spill_path (gzipped json lines, one binding per line, see iter_spilled_rows)."""
+    def __init__(self):
+        self.vars = []
+        self.rows = []
+        self.boolean = None # Only set for ASK queries
+        self.row_count = 0
+        self.bytes_read = 0
+        self.truncated = False
+        self.truncated_reason = None
+        self.spill_path = None
+        self.from_cache = False # Set on copies handed out by a ResultCache
+
+
+class _JSONStream:
+    """Minimal pull tokenizer over a stream of byte chunks. Only keeps the unread part of the input in memory."""
+    def __init__(self, chunks, max_bytes=None, should_stop=None):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self.max_bytes = max_bytes
+        self.should_stop = should_stop
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def _fill(self):
+        if self.eof:
+            return False
+        if self.should_stop is not None and self.should_stop():
+            raise ResultTruncated("cancelled")
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self.eof = True
+            self.buf = self.buf[self.pos:] + self._decoder.decode(b"", final=True)
+            self.pos = 0
+            return False
+        self.bytes_read += len(chunk)
+        if self.max_bytes is not None and self.bytes_read > self.max_bytes:
+            raise ResultTruncated(f"byte limit of {self.max_bytes} reached")
+        self.buf = self.buf[self.pos:] + self._decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non whitespace character, or None at the end of the input"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Invalid SPARQL JSON result: expected {char!r}, found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode one complete JSON value, reading more input until it is complete"""
+        self.peek()
+        while True:
+            try:
+                obj, end = self._json.raw_decode(self.buf, self.pos)
+                # A value that ends exactly at the end of the buffer might continue in the next chunk (numbers)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise ValueError("Invalid SPARQL JSON result: could not decode value")
+            self._fill()
+
+    def key(self):
+        """Decode an object key and the colon after it"""
+        key = self.value()
+        if not isinstance(key, str):
+            raise ValueError("Invalid SPARQL JSON result: object key is not a string")
+        self.expect(":")
+        return key
+
+    def object_members(self):
+        """Iterate over the keys of the object at the current position. The caller must consume each value."""
+        self.expect("{")
+        first = True
+        while True:
+            if self.peek() == "}":
+                self.pos += 1
+                return
+            if not first:
+                self.expect(",")
+            first = False
+            yield self.key()
+
+    def array_items(self):
+        """Iterate over the items of the array at the current position, each item decoded on its own"""
+        self.expect("[")
+        first = True
+        while True:
+            if self.peek() == "]":
+                self.pos += 1
+                return
+            if not first:
+                self.expect(",")
+            first = False
+            yield self.value()
+
+
+def iter_bindings(chunks, result, max_bytes=None, should_stop=None):
+    """Yield the bindings of a SPARQL JSON result one by one while reading the chunks. result (a SparqlResult)
+    is filled in with the variables, the ASK boolean and the number of bytes read as they are encountered."""
+    stream = _JSONStream(chunks, max_bytes=max_bytes, should_stop=should_stop)
+    try:
+        for key in stream.object_members():
+            if key == "head":
+                result.vars = stream.value().get("vars", [])
+            elif key == "boolean":
+                result.boolean = stream.value()
+            elif key == "results":
+                for results_key in stream.object_members():
+                    if results_key == "bindings":
+                        for binding in stream.array_items():
+                            result.bytes_read = stream.bytes_read
+                            yield binding
+                    else:
+                        stream.value()
+            else:
+                stream.value()
+    finally:
+        result.bytes_read = stream.bytes_read
+
+def read_sparql_json(chunks, max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES, spill_path=None,
+                     keep_rows=None, should_stop=None):
+    """Read a SPARQL JSON result from an iterable of byte chunks (e.g. response.iter_content()) without ever
+    holding the whole response in memory. Reading stops, and the result is marked as truncated, after max_rows
+    bindings or max_bytes bytes. If spill_path is given every binding is written there and only the first
+    keep_rows (default DEFAULT_PREVIEW_ROWS) are kept in memory."""
+    result = SparqlResult()
+    if keep_rows is None:
+        keep_rows = DEFAULT_PREVIEW_ROWS if spill_path else max_rows
+
+    spill = None
+    if spill_path:
+        os.makedirs(os.path.dirname(spill_path) or ".", exist_ok=True)
+        spill = gzip.open(spill_path, "wt", encoding="utf-8")
+        result.spill_path = spill_path
+    try:
+        for binding in iter_bindings(chunks, result, max_bytes=max_bytes, should_stop=should_stop):
+            if max_rows is not None and result.row_count >= max_rows:
+                result.truncated = True
+                result.truncated_reason = f"row limit of {max_rows} reached"
+                break
+            result.row_count += 1
+            if keep_rows is None or len(result.rows) < keep_rows:
+                result.rows.append(binding)
+            if spill is not None:
+                spill.write(json.dumps(binding, separators=(",", ":")))
+                spill.write("\n")
+    except ResultTruncated as e:
+        result.truncated = True
+        result.truncated_reason = str(e)
+    finally:
+        if spill is not None:
+            spill.close()
+    return result
+
+def iter_spilled_rows(spill_path):
+    """Read back the bindings written by read_sparql_json(spill_path=...)"""
+    with gzip.open(spill_path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
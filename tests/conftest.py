@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from query_src.http_cache import HTTPCache, set_default_cache
+from query_src.policy_store import PolicyDocumentStore, set_default_policy_store
+
+
+class DocumentServer:
+    """Serves documents (path -> turtle text) from a local HTTP server, with an ETag per body so conditional
+    GETs get a 304 while a document is unchanged. documents can be changed while the server runs."""
+    def __init__(self):
+        self.documents = {}
+        self.requests = [] # (method, path) of every request
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(("GET", self.path))
+                body = server.documents.get(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = body.encode("utf-8")
+                etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/turtle")
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("localhost", 0), Handler)
+        self.base_url = f"http://localhost:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return self.base_url + path
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def document_server():
+    server = DocumentServer()
+    yield server
+    server.shutdown()
+
+@pytest.fixture
+def fresh_caches(tmp_path):
+    """Empty HTTP cache and policy store for one test"""
+    set_default_cache(HTTPCache(cache_dir=str(tmp_path / "http_cache"), ttl=0))
+    set_default_policy_store(PolicyDocumentStore())
+    yield
+    set_default_cache(None)
+    set_default_policy_store(None)
@@ -0,0 +1,41 @@
+from rdflib import Graph, RDF, FOAF
+
+from benchmarks.synthetic_fdp import serve
+from query_src.access_matrix import ALLOWED, DENIED, NO_PERMISSION, compute_access_matrix, iter_bits
+from query_src.decision_cache import DecisionCache
+from query_src.fdp_crawler import crawl_fdps, evaluate_fdp, prepare_queries
+
+DECISIONS = {True: ALLOWED, False: DENIED, None: NO_PERMISSION}
+
+
+def test_iter_bits():
+    assert list(iter_bits(0)) == []
+    assert list(iter_bits(0b101001)) == [0, 3, 5]
+    assert list(iter_bits(1 << 200)) == [200]
+
+def test_matrix_agrees_with_evaluate_fdp(fresh_caches):
+    server, synthetic = serve(catalogs=3, datasets=3, distributions=2, users=8, constraint_fraction=0.5,
+                              prohibition_fraction=0.3, bnode_fraction=0.3, seed=3)
+    try:
+        fdp = crawl_fdps([synthetic.fdp_uri])[0]
+    finally:
+        server.shutdown()
+    user_graphs = [Graph().parse(data=synthetic.user_graph(i), format="turtle") for i in range(8)]
+    users = [(user_graph, user_graph.value(None, RDF.type, FOAF.Person)) for user_graph in user_graphs]
+    seen = set()
+    for purpose in ("research", "commercial"):
+        # Both queries are ex:Q1, so one matrix per query
+        query_graph = Graph().parse(data=synthetic.query_graph(purpose=purpose), format="turtle")
+        (query,) = prepare_queries(user_graphs[0], query_graph, 'graph')
+        matrix = compute_access_matrix([(synthetic.fdp_uri, fdp)], users, [query])
+        query_graph, query_sbj, query_action, _, _ = query
+        for column, (user_graph, user) in enumerate(users):
+            results = list(evaluate_fdp(synthetic.fdp_uri, fdp, query_graph, query_sbj, query_action, user_graph, user,
+                                        DecisionCache()))
+            assert [endpoint for _, endpoint in matrix.endpoints] == [res["endpoint"] for res in results]
+            for e, res in enumerate(results):
+                decision, policy, _ = matrix.cells[(query_sbj, e)][column]
+                assert decision == DECISIONS[res["allowed"]]
+                assert policy == res.get("policy")
+                seen.add(decision)
+    assert seen == {ALLOWED, DENIED, NO_PERMISSION} # The synthetic FDP covers every outcome
@@ -0,0 +1,30 @@
+import io
+import json
+import os
+
+from query_src.batch import run_batch
+from query_src.query_runner import QueryExecutor
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_broken_request_does_not_stop_the_batch(tmp_path):
+    broken_query = tmp_path / "broken.ttl"
+    broken_query.write_text("this is not turtle")
+    batch = [
+        {"id": "missing", "user": str(tmp_path / "nobody.ttl"), "query": os.path.join(REPO, "questions", "query1.ttl")},
+        {"id": "unparsable", "user": os.path.join(REPO, "users", "bob.ttl"), "query": str(broken_query)},
+        {"id": "fine", "user": os.path.join(REPO, "users", "bob.ttl"), "query": os.path.join(REPO, "questions", "query1.ttl")},
+    ]
+    out = io.StringIO()
+    executor = QueryExecutor(result_cache=False, circuit_breaker=False)
+    try:
+        stats = run_batch([], batch, out, query_executor=executor)
+    finally:
+        executor.shutdown()
+
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [line["request_id"] for line in lines] == ["missing", "unparsable"]
+    assert all(line["error"] for line in lines)
+    assert stats["requests"] == 3
+    assert stats["failed_requests"] == 2
@@ -0,0 +1,91 @@
+import time
+
+import requests
+from rdflib import Graph, Literal, URIRef
+
+from query_src import query_runner
+from query_src.endpoints import CircuitBreaker
+from query_src.query_runner import QueryExecutor, EX
+from query_src.sparql_results import SparqlResult
+
+ENDPOINT = "http://example.org/sparql"
+
+
+def query_job():
+    query_graph = Graph()
+    query = URIRef("http://example.org/query")
+    query_graph.add((query, EX.queryText, Literal("SELECT * WHERE { ?s ?p ?o }")))
+    return query_graph, query, Graph(), URIRef("http://example.org/Bob"), ENDPOINT
+
+
+def test_opens_after_threshold_and_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=0.1)
+    breaker.record_failure(ENDPOINT)
+    assert breaker.allow(ENDPOINT)
+    breaker.record_failure(ENDPOINT)
+    assert not breaker.allow(ENDPOINT)
+    assert 0 < breaker.retry_in(ENDPOINT) <= 0.1
+    time.sleep(0.11)
+    assert breaker.allow(ENDPOINT) # The trial
+    assert not breaker.allow(ENDPOINT) # Only one at a time
+    breaker.record_success(ENDPOINT)
+    assert breaker.allow(ENDPOINT)
+    assert breaker.stats() == {}
+
+def test_failed_trial_opens_again():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+    breaker.record_failure(ENDPOINT)
+    time.sleep(0.06)
+    assert breaker.allow(ENDPOINT)
+    breaker.record_failure(ENDPOINT)
+    assert not breaker.allow(ENDPOINT)
+
+
+def test_executor_skips_an_endpoint_that_keeps_failing(monkeypatch):
+    calls = []
+    def failing_query(*args, **kwargs):
+        calls.append(args)
+        raise requests.ConnectionError("down")
+    monkeypatch.setattr(query_runner, "run_query", failing_query)
+    executor = QueryExecutor(result_cache=False, circuit_breaker=CircuitBreaker(failure_threshold=2, cooldown=60))
+    try:
+        results = executor.run_all([query_job()] * 4)
+    finally:
+        executor.shutdown()
+    assert len(calls) == 2
+    assert not any(success for success, _ in results)
+    assert "skipped after repeated failures" in results[-1][1]
+
+def test_unexpected_error_frees_the_trial(monkeypatch):
+    def broken_response(*args, **kwargs):
+        raise ValueError("Invalid SPARQL JSON result")
+    monkeypatch.setattr(query_runner, "run_query", broken_response)
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+    breaker.record_failure(ENDPOINT)
+    time.sleep(0.06)
+    executor = QueryExecutor(result_cache=False, circuit_breaker=breaker)
+    try:
+        success, message = executor.submit(*query_job()).result()
+        assert not success and "Invalid SPARQL JSON result" in message
+        # The trial counted as a failure, so after the next cool-down another trial is let through
+        time.sleep(0.06)
+        monkeypatch.setattr(query_runner, "run_query", lambda *args, **kwargs: (True, SparqlResult()))
+        assert executor.submit(*query_job()).result()[0]
+        assert breaker.allow(ENDPOINT)
+    finally:
+        executor.shutdown()
+
+def test_executor_without_row_cap(monkeypatch):
+    seen = {}
+    def run_query(*args, result_options=None, **kwargs):
+        seen.update(result_options)
+        return True, SparqlResult()
+    monkeypatch.setattr(query_runner, "run_query", run_query)
+    executor = QueryExecutor(result_cache=False, circuit_breaker=False, max_rows=None)
+    try:
+        assert executor.submit(*query_job(), max_rows=5).result()[0]
+        assert seen["max_rows"] == 5
+        assert executor.submit(*query_job()).result()[0]
+        assert seen["max_rows"] is None
+    finally:
+        executor.shutdown()
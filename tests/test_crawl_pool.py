@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from query_src.crawl_pool import CrawlPool
+
+
+def test_owners_take_turns():
+    started = []
+    release = threading.Event()
+    def fetch(url, timeout=None):
+        started.append(url)
+        if url == "http://host/block":
+            release.wait()
+        return url
+
+    with CrawlPool(max_workers=1, max_per_host=8) as pool:
+        blocker = pool.submit(fetch, "http://host/block", owner="blocker")
+        futures = [pool.submit(fetch, f"http://host/big{i}", owner="big") for i in range(4)]
+        futures += [pool.submit(fetch, f"http://host/small{i}", owner="small") for i in range(2)]
+        release.set()
+        assert [f.result() for f in futures] == [f"http://host/big{i}" for i in range(4)] + ["http://host/small0", "http://host/small1"]
+        blocker.result()
+    assert started[1:] == ["http://host/big0", "http://host/small0", "http://host/big1", "http://host/small1",
+                           "http://host/big2", "http://host/big3"]
+
+def test_slow_host_does_not_hold_the_threads():
+    def fetch(url, timeout=None):
+        if "slow" in url:
+            time.sleep(0.2)
+        return url
+
+    with CrawlPool(max_workers=4, max_per_host=1) as pool:
+        start = time.monotonic()
+        slow = [pool.submit(fetch, f"http://slow/{i}", owner="slow") for i in range(8)]
+        fast = [pool.submit(fetch, f"http://fast/{i}", owner="fast") for i in range(8)]
+        for future in fast:
+            future.result()
+        fast_seconds = time.monotonic() - start
+        for future in slow:
+            future.result()
+    # One thread is busy with the slow host, the fast one finishes with the others long before it
+    assert fast_seconds < 0.2 * 8 / 2
+
+def test_rate_limit_waits_without_a_thread():
+    starts = {}
+    def fetch(url, timeout=None):
+        starts[url] = time.monotonic()
+        return url
+
+    with CrawlPool(max_workers=2, max_per_host=4, rate_per_host=10) as pool:
+        limited = [pool.submit(fetch, f"http://limited/{i}", owner="limited") for i in range(4)]
+        other = [pool.submit(fetch, f"http://other/{i}", owner="other") for i in range(4)]
+        for future in limited + other:
+            future.result()
+    times = sorted(starts[f"http://limited/{i}"] for i in range(4))
+    assert all(later - earlier >= 0.09 for earlier, later in zip(times, times[1:]))
+    # The other host is rate limited as well, but its first request did not wait for the limited host
+    assert starts["http://other/0"] < times[1]
+
+def test_exceptions_are_set_on_the_future():
+    def fetch(url, timeout=None):
+        raise ValueError(url)
+
+    with CrawlPool(max_workers=2) as pool:
+        future = pool.submit(fetch, "http://host/x")
+        with pytest.raises(ValueError, match="http://host/x"):
+            future.result()
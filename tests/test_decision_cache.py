@@ -0,0 +1,48 @@
+from rdflib import Graph, Literal, URIRef
+
+from query_src.decision_cache import DecisionCache
+from query_src.policy_checker import EX, ODRL
+from query_src.policy_store import PolicyDocumentStore
+
+POLICIES = """
+@prefix odrl: <http://www.w3.org/ns/odrl/2/> .
+@prefix ex: <http://example.org/> .
+
+<#research> a odrl:Policy ;
+    odrl:permission [
+        odrl:assignee ex:Alice ; odrl:action odrl:read ;
+        odrl:constraint [ odrl:leftOperand ex:purpose ; odrl:operator odrl:eq ; odrl:rightOperand ex:research ]
+    ] .
+"""
+
+
+def query(purpose, text="SELECT * WHERE { ?s ?p ?o }", requested_at="2024-01-01T00:00:00"):
+    query_graph = Graph()
+    query_graph.add((EX.q, EX.queryText, Literal(text)))
+    query_graph.add((EX.q, EX.purpose, purpose))
+    query_graph.add((EX.q, EX.requestedAt, Literal(requested_at)))
+    return query_graph
+
+
+def test_decisions_are_shared_when_the_constrained_attributes_match(document_server, fresh_caches):
+    document_server.documents["/policies.ttl"] = POLICIES
+    refs = [(URIRef(document_server.url("/policies.ttl#research")), None)]
+    cache = DecisionCache(policy_store=PolicyDocumentStore())
+    user_graph = Graph()
+
+    def check(purpose, user=EX.Alice, **query_options):
+        return cache.check("Catalog", refs, query(purpose, **query_options), EX.q, ODRL.read, user_graph, user,
+                           "http://example.org/sparql", "permission")
+
+    allowed = check(EX.research)
+    assert allowed == (True, refs[0][0])
+    # Other query text and attributes no constraint looks at: same decision, not computed again
+    assert check(EX.research, text="ASK { ?s ?p ?o }", requested_at="2024-06-01T12:00:00") == allowed
+    assert cache.computed["Catalog"] == 1 and cache.reused["Catalog"] == 1
+
+    # The constrained attribute or the user differ: a new decision
+    assert check(EX.education) == (False, None)
+    assert check(EX.research, user=EX.Bob) == (False, None)
+    assert cache.computed["Catalog"] == 3
+    assert cache.stats()["decisions"] == 3
+    assert "3 computed, 1 reused" in cache.summary()
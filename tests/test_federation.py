@@ -0,0 +1,74 @@
+from rdflib import Graph
+
+from benchmarks.synthetic_fdp import serve
+from query_src.federation import FederatedResult, federated_query, global_limit
+from query_src.query_runner import QueryExecutor
+from query_src.sparql_results import SparqlResult
+
+
+def sparql_result(*values):
+    result = SparqlResult()
+    result.vars = ["o"]
+    result.rows = [{"o": {"type": "literal", "value": value}} for value in values]
+    return result
+
+def endpoint(name):
+    return {"fdp": "http://example.org/fdp", "endpoint": f"http://example.org/{name}/sparql"}
+
+
+def test_global_limit():
+    assert global_limit("SELECT * WHERE { ?s ?p ?o } LIMIT 10") == 10
+    assert global_limit("SELECT * WHERE { ?s ?p ?o } limit 10\n") == 10
+    assert global_limit("SELECT * WHERE { ?s ?p ?o }") is None
+    assert global_limit("SELECT * WHERE { ?s ?p ?o } ORDER BY ?s LIMIT 10") is None
+    assert global_limit("SELECT * WHERE { ?s ?p ?o } LIMIT 10 OFFSET 5") is None
+
+def test_merge_stops_at_the_limit():
+    merged = FederatedResult("q", limit=3)
+    assert merged.add(endpoint("a"), sparql_result("1", "2")) == 2
+    assert merged.remaining == 1
+    assert merged.add(endpoint("b"), sparql_result("3", "4")) == 1
+    assert merged.full and merged.remaining == 0
+    assert [row["binding"]["o"]["value"] for row in merged.rows] == ["1", "2", "3"]
+
+def test_distinct_merge_keeps_every_source():
+    merged = FederatedResult("q", distinct=True)
+    merged.add(endpoint("a"), sparql_result("1", "2"))
+    merged.add(endpoint("b"), sparql_result("2", "3"))
+    assert [row["binding"]["o"]["value"] for row in merged.rows] == ["1", "2", "3"]
+    assert merged.rows[1]["sources"] == [endpoint("a"), endpoint("b")]
+    assert merged.to_dict()["row_count"] == 3
+
+
+def federate(query, rows=40, **options):
+    server, synthetic = serve(catalogs=3, datasets=3, distributions=3, users=1, constraint_fraction=0,
+                              prohibition_fraction=0, rows=rows)
+    executor = QueryExecutor(result_cache=False, circuit_breaker=False)
+    try:
+        user_graph = Graph().parse(data=synthetic.user_graph(0), format="turtle")
+        query_graph = Graph().parse(data=synthetic.query_graph(query=query), format="turtle")
+        decisions, merged = federated_query([synthetic.fdp_uri], user_graph, query_graph, 'graph',
+                                            query_executor=executor, **options)
+    finally:
+        executor.shutdown()
+        server.shutdown()
+    (result,) = merged.values()
+    return decisions, result
+
+def test_federated_limit(fresh_caches):
+    decisions, result = federate("SELECT ?s ?p ?o WHERE { ?s ?p ?o } LIMIT 50")
+    allowed = [res for res in decisions if res["allowed"]]
+    assert len(allowed) == 27
+    assert result.limit == 50
+    assert len(result.rows) == 50
+    assert len({row["binding"]["s"]["value"] for row in result.rows}) == 50
+    counts = result.endpoints
+    assert counts["failed"] == 0 and counts["truncated"] == 0
+    assert counts["queried"] + counts["skipped"] == len(allowed)
+    assert counts["skipped"] > 0 # Not every endpoint was needed for 50 rows
+
+def test_federated_without_global_limit(fresh_caches):
+    decisions, result = federate("SELECT ?s ?p ?o WHERE { ?s ?p ?o } ORDER BY ?s LIMIT 50", rows=5)
+    assert result.limit is None
+    assert len(result.rows) == 5 * sum(res["allowed"] for res in decisions)
+    assert result.endpoints["skipped"] == result.endpoints["cancelled"] == 0
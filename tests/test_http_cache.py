@@ -0,0 +1,87 @@
+import os
+
+import pytest
+import requests
+
+from query_src.http_cache import HTTPCache
+
+URL = "http://example.org/fdp.ttl"
+
+
+class FakeSession:
+    """Serves one document with an ETag and answers conditional GETs with 304 while it is unchanged"""
+    def __init__(self, body=b"<a> <b> <c> .", etag='"v1"'):
+        self.body = body
+        self.etag = etag
+        self.requests = [] # headers of every request
+
+    def get(self, url, headers=None, timeout=None):
+        headers = headers or {}
+        self.requests.append(headers)
+        response = requests.Response()
+        response.url = url
+        response.encoding = "utf-8"
+        if headers.get("If-None-Match") == self.etag:
+            response.status_code = 304
+            response._content = b""
+        else:
+            response.status_code = 200
+            response._content = self.body
+            response.headers["ETag"] = self.etag
+            response.headers["Content-Type"] = "text/turtle"
+        return response
+
+
+@pytest.fixture
+def session():
+    return FakeSession()
+
+@pytest.fixture
+def cache(tmp_path, session):
+    return HTTPCache(cache_dir=str(tmp_path), ttl=0, session=session)
+
+
+def test_not_modified_serves_cached_body(cache, session):
+    first = cache.get(URL)
+    assert not first.from_cache
+    second = cache.get(URL)
+    assert session.requests[1]["If-None-Match"] == '"v1"'
+    assert second.revalidated and second.from_cache
+    assert second.status_code == 200
+    assert second.content == first.content
+    assert second.etag == '"v1"'
+    assert cache.stats["revalidated"] == 1
+    assert cache.stats["misses"] == 1
+
+def test_not_modified_refreshes_entry(tmp_path, session):
+    cache = HTTPCache(cache_dir=str(tmp_path), ttl=60, session=session)
+    cache.get(URL)
+    cache.get(URL, revalidate=True)
+    cache.get(URL) # Within the ttl again after the 304
+    assert len(session.requests) == 2
+    assert cache.stats["hits"] == 1
+
+def test_changed_document_is_downloaded(cache, session):
+    cache.get(URL)
+    session.body, session.etag = b"<a> <b> <d> .", '"v2"'
+    response = cache.get(URL)
+    assert not response.revalidated
+    assert response.content == b"<a> <b> <d> ."
+    assert response.etag == '"v2"'
+
+def test_not_modified_without_body_fetches_again(cache, session, tmp_path):
+    cache.get(URL)
+    for name in os.listdir(tmp_path):
+        if name.endswith(".body"):
+            os.remove(tmp_path / name)
+    response = cache.get(URL)
+    # The 304 could not be used, so the document is fetched again without validators
+    assert "If-None-Match" not in session.requests[-1]
+    assert response.content == session.body
+    assert not response.revalidated
+
+def test_entries_survive_a_restart(tmp_path, session):
+    HTTPCache(cache_dir=str(tmp_path), ttl=0, session=session).get(URL)
+    response = HTTPCache(cache_dir=str(tmp_path), ttl=0, session=session).get(URL)
+    assert response.revalidated
+    assert response.text == "<a> <b> <c> ."
@@ -0,0 +1,56 @@
+from query_src.crawl_pool import CrawlPool
+from query_src.fdp_crawler import crawl_fdp_concurrent
+
+PREFIXES = """@prefix ldp: <http://www.w3.org/ns/ldp#> .
+@prefix dct: <http://purl.org/dc/terms/> .
+@prefix odrl: <http://www.w3.org/ns/odrl/2/> .
+"""
+
+
+def catalog_document(server, datasets, policy):
+    contains = "".join(f" ; ldp:contains <{server.url(f'/ds{i}.ttl')}>" for i in datasets)
+    return (PREFIXES + f"<{server.url('/cat.ttl')}> dct:modified \"2024-01-01\" ; "
+            f"odrl:hasPolicy <{server.url('/policies.ttl#' + policy)}>{contains} .")
+
+def serve_fdp(server):
+    server.documents["/fdp.ttl"] = PREFIXES + f"<{server.url('/fdp.ttl')}> ldp:contains <{server.url('/cat.ttl')}> ."
+    server.documents["/cat.ttl"] = catalog_document(server, [0, 1], "c0_p0")
+    for i in range(2):
+        server.documents[f"/ds{i}.ttl"] = PREFIXES + f"<{server.url(f'/ds{i}.ttl')}> dct:modified \"2024-01-01\" ."
+
+def crawl(server, previous=None):
+    stats = {}
+    with CrawlPool(max_workers=4) as pool:
+        fdp = crawl_fdp_concurrent(server.url("/fdp.ttl"), pool, previous=previous, stats=stats)
+    return fdp, stats
+
+def policy_names(node):
+    return [str(ref).split("#")[-1] for ref, _ in node.policies]
+
+
+def test_unchanged_documents_are_taken_over(document_server, fresh_caches):
+    serve_fdp(document_server)
+    first, _ = crawl(document_server)
+    second, stats = crawl(document_server, previous=first)
+    assert stats["unchanged"] == 4
+    assert stats["parsed"] == stats["new"] == 0
+    assert len(second.catalogs[0].datasets) == 2
+    assert policy_names(second.catalogs[0]) == ["c0_p0"]
+
+def test_changed_document_is_used_even_if_dct_modified_is_the_same(document_server, fresh_caches):
+    serve_fdp(document_server)
+    first, _ = crawl(document_server)
+    # A dataset is removed and the policy changes, but the catalog still states the same dct:modified
+    document_server.documents["/cat.ttl"] = catalog_document(document_server, [0], "c1_p0")
+    second, stats = crawl(document_server, previous=first)
+    catalog = second.catalogs[0]
+    assert policy_names(catalog) == ["c1_p0"]
+    assert [dataset.uri for dataset in catalog.datasets] == [document_server.url("/ds0.ttl")]
+    assert stats["parsed"] == 1
+    assert stats["removed"] == 1
+
+    # And it stays that way on the next incremental crawl
+    third, stats = crawl(document_server, previous=second)
+    assert policy_names(third.catalogs[0]) == ["c1_p0"]
+    assert len(third.catalogs[0].datasets) == 1
+    assert stats["parsed"] == 0
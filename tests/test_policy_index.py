@@ -0,0 +1,79 @@
+from rdflib import Graph, Literal, URIRef
+
+from query_src.policy_checker import check_policy, EX
+from query_src.policy_index import CompiledPolicySet, compile_document, compile_policy, ODRL
+from query_src.policy_store import PolicyDocumentStore
+
+POLICIES = """
+@prefix odrl: <http://www.w3.org/ns/odrl/2/> .
+@prefix ex: <http://example.org/> .
+
+<#research> a odrl:Policy ;
+    odrl:permission [
+        odrl:assignee ex:Alice, ex:Bob ; odrl:action odrl:read ;
+        odrl:constraint [ odrl:leftOperand ex:purpose ; odrl:operator odrl:eq ; odrl:rightOperand ex:research ]
+    ] .
+<#noBob> a odrl:Policy ;
+    odrl:prohibition <#bobRule> .
+<#bobRule> odrl:assignee ex:Bob ; odrl:action odrl:read .
+<#open> a odrl:Policy ;
+    odrl:permission [ odrl:assignee ex:Carol ; odrl:action odrl:read ] .
+"""
+READ = ODRL.read
+ALICE, BOB, CAROL = EX.Alice, EX.Bob, EX.Carol
+
+
+def policies(base_uri="http://example.org/policies.ttl"):
+    return Graph().parse(data=POLICIES, format="turtle", publicID=base_uri)
+
+def query(purpose):
+    query_graph = Graph()
+    query_graph.add((EX.q, EX.queryText, Literal("SELECT * WHERE { ?s ?p ?o }")))
+    if purpose is not None:
+        query_graph.add((EX.q, EX.purpose, purpose))
+    return query_graph
+
+
+def test_compile_policy():
+    graph = policies()
+    research = compile_policy(graph, URIRef("http://example.org/policies.ttl#research"))
+    constraints = ((EX.purpose, ODRL.eq, EX.research),)
+    assert research.rules == {("permission", ALICE, READ): [constraints], ("permission", BOB, READ): [constraints]}
+    assert research.operands == {EX.purpose}
+    # Rules may be IRIs described elsewhere in the document
+    no_bob = compile_policy(graph, URIRef("http://example.org/policies.ttl#noBob"))
+    assert no_bob.rules == {("prohibition", BOB, READ): [()]}
+    assert compile_policy(graph, URIRef("http://example.org/policies.ttl#bobRule")) is None
+    assert len(compile_document(graph)) == 3
+
+def test_policy_set_keeps_reference_order_and_missing_refs():
+    compiled = compile_document(policies())
+    refs = [URIRef("http://example.org/policies.ttl#open"), URIRef("http://example.org/policies.ttl#nothing"),
+            URIRef("http://example.org/policies.ttl#research")]
+    policy_set = CompiledPolicySet(refs, [compiled.get(ref) for ref in refs])
+    assert policy_set.missing == [refs[1]]
+    assert [ref for ref, _ in policy_set.lookup("permission", ALICE, READ)] == [refs[2]]
+    assert policy_set.lookup("prohibition", ALICE, READ) == ()
+    assert len(policy_set) == 3
+
+def test_check_policy(document_server, fresh_caches):
+    document_server.documents["/policies.ttl"] = POLICIES
+    ref = lambda name: (URIRef(document_server.url("/policies.ttl#" + name)), None)
+    refs = [ref("research"), ref("noBob"), ref("open")]
+    store = PolicyDocumentStore()
+    user_graph = Graph()
+
+    def check(user, purpose, mode):
+        return check_policy(refs, query(purpose), EX.q, READ, user_graph, user, "http://example.org/sparql", mode,
+                            policy_store=store)
+
+    assert check(ALICE, EX.research, "permission") == (True, ref("research")[0])
+    assert check(ALICE, EX.education, "permission") == (False, None)
+    assert check(ALICE, None, "permission") == (False, None)
+    assert check(BOB, None, "prohibition") == (True, ref("noBob")[0])
+    assert check(CAROL, None, "permission") == (True, ref("open")[0])
+    # Constraints may also be met by the user graph
+    user_graph.add((ALICE, EX.purpose, EX.research))
+    assert check(ALICE, None, "permission") == (True, ref("research")[0])
+    # One download for all the checks
+    assert document_server.requests == [("GET", "/policies.ttl")]
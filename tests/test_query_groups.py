@@ -0,0 +1,63 @@
+from rdflib import Graph, Literal, URIRef
+
+from query_src.fdp_crawler import EX, group_queries, policy_operands, prepare_queries
+from query_src.policy_index import PolicyClosure
+from query_src.policy_store import PolicyDocumentStore
+from query_src.resources import FDP, Catalog, policy_ref, compact
+
+POLICY = """
+@prefix odrl: <http://www.w3.org/ns/odrl/2/> .
+@prefix ex: <http://example.org/> .
+
+ex:catalog odrl:hasPolicy [
+    a odrl:Policy ;
+    odrl:permission [
+        odrl:assignee ex:Alice ; odrl:action odrl:read ;
+        odrl:constraint [ odrl:leftOperand ex:purpose ; odrl:operator odrl:eq ; odrl:rightOperand ex:research ]
+    ]
+] .
+"""
+QUERIES = """
+@prefix ex: <http://example.org/> .
+@prefix odrl: <http://www.w3.org/ns/odrl/2/> .
+
+ex:q1 a odrl:Action ; ex:queryText "SELECT ?s WHERE { ?s ?p ?o }" ; ex:purpose ex:research ;
+    ex:requestedAt "2024-01-01T10:00:00" .
+ex:q2 a odrl:Action ; ex:queryText "SELECT ?o WHERE { ?s ?p ?o }" ; ex:purpose ex:research ;
+    ex:requestedAt "2024-01-01T10:00:05" .
+ex:q3 a odrl:Action ; ex:queryText "SELECT ?p WHERE { ?s ?p ?o }" ; ex:purpose ex:education ;
+    ex:requestedAt "2024-01-01T10:00:00" .
+"""
+USER = """
+@prefix ex: <http://example.org/> .
+@prefix foaf: <http://xmlns.com/foaf/0.1/> .
+ex:Alice a foaf:Person .
+"""
+
+
+def crawled_fdp():
+    document = Graph().parse(data=POLICY, format="turtle")
+    bnode = document.value(EX.catalog, URIRef("http://www.w3.org/ns/odrl/2/hasPolicy"))
+    fdp = FDP("http://example.org/fdp")
+    catalog = Catalog("http://example.org/catalog")
+    catalog.policies.append(policy_ref(bnode, PolicyClosure.from_graph(document, bnode)))
+    fdp.catalogs.append(catalog)
+    return compact(fdp)
+
+def prepared():
+    queries = prepare_queries(Graph().parse(data=USER, format="turtle"), Graph().parse(data=QUERIES, format="turtle"), 'graph')
+    assert len(queries) == 3
+    return queries
+
+def subjects(groups):
+    return sorted(sorted(str(query_sbj).rsplit("/", 1)[-1] for _, query_sbj, _, _, _ in group) for group in groups)
+
+
+def test_only_constrained_attributes_split_groups():
+    operands = policy_operands(crawled_fdp(), PolicyDocumentStore())
+    assert operands == {EX.purpose}
+    # q1 and q2 only differ in their text and timestamp
+    assert subjects(group_queries(prepared(), operands)) == [["q1", "q2"], ["q3"]]
+
+def test_without_constraints_all_queries_of_an_action_share_a_group():
+    assert subjects(group_queries(prepared(), set())) == [["q1", "q2", "q3"]]
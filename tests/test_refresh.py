@@ -0,0 +1,36 @@
+import threading
+import time
+
+from query_src.endpoints import CapabilityCache, EndpointCapabilities, set_default_capability_cache
+from query_src.refresh import RefreshScheduler
+
+PREFIXES = """@prefix ldp: <http://www.w3.org/ns/ldp#> .
+@prefix dcat: <http://www.w3.org/ns/dcat#> .
+"""
+
+
+def test_first_get_does_not_wait_for_endpoint_probes(document_server, fresh_caches):
+    url = document_server.url
+    document_server.documents.update({
+        "/fdp.ttl": PREFIXES + f"<{url('/fdp.ttl')}> ldp:contains <{url('/cat.ttl')}> .",
+        "/cat.ttl": PREFIXES + f"<{url('/cat.ttl')}> ldp:contains <{url('/ds.ttl')}> .",
+        "/ds.ttl": PREFIXES + f"<{url('/ds.ttl')}> ldp:contains <{url('/dist.ttl')}> .",
+        "/dist.ttl": PREFIXES + f"<{url('/dist.ttl')}> dcat:accessURL <http://example.org/sparql> .",
+    })
+    probed = threading.Event()
+    def slow_prober(endpoint_url, session=None, timeout=None):
+        time.sleep(1)
+        probed.set()
+        return EndpointCapabilities(endpoint_url, True)
+    set_default_capability_cache(CapabilityCache(prober=slow_prober, circuit_breaker=False))
+
+    scheduler = RefreshScheduler()
+    try:
+        start = time.monotonic()
+        (fdp_uri, fdp), = scheduler.get([url("/fdp.ttl")])
+        assert time.monotonic() - start < 0.9
+        assert fdp.catalogs[0].datasets[0].distributions[0].sparql_endpoints == ("http://example.org/sparql",)
+        assert probed.wait(5) # The probe still runs, in the background
+    finally:
+        scheduler.stop()
+        set_default_capability_cache(None)
@@ -0,0 +1,29 @@
+from query_src.result_cache import normalize_query, result_key
+
+QUERY = """PREFIX ex: <http://example.org/>
+SELECT ?s WHERE { ?s ex:name "a  # not a comment" } # comment"""
+
+
+def test_normalize_query_ignores_layout_comments_and_prefix_names():
+    same = [
+        QUERY,
+        'PREFIX   ex:<http://example.org/>\nSELECT ?s\nWHERE {\n  ?s ex:name "a  # not a comment"\n}',
+        'PREFIX other: <http://example.org/>\nSELECT ?s WHERE { ?s other:name "a  # not a comment" }',
+        'SELECT ?s WHERE { ?s <http://example.org/name> "a  # not a comment" }',
+    ]
+    assert len({normalize_query(query) for query in same}) == 1
+
+def test_normalize_query_keeps_literals_and_iris():
+    assert normalize_query(QUERY) != normalize_query(QUERY.replace('"a  #', '"a #'))
+    assert normalize_query(QUERY) != normalize_query(QUERY.replace("example.org", "example.com"))
+    assert normalize_query("SELECT ?s WHERE { ?s ?p ?o }") != normalize_query("SELECT ?o WHERE { ?s ?p ?o }")
+
+def test_result_key_depends_on_principal_credentials_and_options():
+    base = result_key("http://example.org/sparql", QUERY, "http://example.org/Bob", "bob", "secret", options=(10,))
+    assert base == result_key("http://example.org/sparql", QUERY.replace("\n", "\n\n  "), "http://example.org/Bob",
+                              "bob", "secret", options=(10,))
+    assert base != result_key("http://example.org/other", QUERY, "http://example.org/Bob", "bob", "secret", options=(10,))
+    assert base != result_key("http://example.org/sparql", QUERY, "http://example.org/Alice", "bob", "secret", options=(10,))
+    assert base != result_key("http://example.org/sparql", QUERY, "http://example.org/Bob", "bob", "wrong", options=(10,))
+    assert base != result_key("http://example.org/sparql", QUERY, "http://example.org/Bob", "bob", "secret", options=(20,))
+    assert "secret" not in base
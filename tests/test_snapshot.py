@@ -0,0 +1,86 @@
+from rdflib import Graph, BNode, URIRef
+
+from query_src.policy_index import PolicyClosure, compile_policy
+from query_src.resources import FDP, Catalog, Dataset, Distribution, policy_ref, compact
+from query_src.snapshot import save_snapshot, load_snapshot
+
+FDP_URI = "http://example.org/fdp"
+DOCUMENT = """
+@prefix odrl: <http://www.w3.org/ns/odrl/2/> .
+@prefix ex: <http://example.org/> .
+
+ex:catalog odrl:hasPolicy [
+    a odrl:Policy ;
+    odrl:permission [
+        odrl:action odrl:read ;
+        odrl:assignee ex:Alice ;
+        odrl:constraint [ odrl:leftOperand ex:purpose ; odrl:operator odrl:eq ; odrl:rightOperand ex:research ]
+    ] ;
+    odrl:prohibition ex:noWrite
+] .
+ex:noWrite odrl:action odrl:write ; odrl:assignee ex:Bob .
+ex:other ex:unrelated "not part of the policy" .
+"""
+
+
+def build_fdp():
+    document = Graph().parse(data=DOCUMENT, format="turtle")
+    bnode = document.value(URIRef("http://example.org/catalog"), URIRef("http://www.w3.org/ns/odrl/2/hasPolicy"))
+    fdp = FDP(FDP_URI)
+    fdp.policies.append(policy_ref(URIRef("http://example.org/policy.ttl#p1")))
+    catalog = Catalog("http://example.org/catalog")
+    catalog.policies.append(policy_ref(bnode, PolicyClosure.from_graph(document, bnode)))
+    dataset = Dataset("http://example.org/dataset")
+    distribution = Distribution("http://example.org/distribution")
+    distribution.sparql_endpoints.append("http://example.org/sparql")
+    dataset.distributions.append(distribution)
+    catalog.datasets.append(dataset)
+    fdp.catalogs.append(catalog)
+    return compact(fdp), bnode
+
+
+def test_bnode_policy_round_trip(tmp_path):
+    fdp, bnode = build_fdp()
+    path = str(tmp_path / "snapshot.sqlite")
+    save_snapshot(path, fdp, crawled_at=1000.0)
+    loaded, crawled_at = load_snapshot(path, FDP_URI)
+
+    assert crawled_at == 1000.0
+    (ref, closure), = loaded.catalogs[0].policies
+    (original_ref, original_closure), = fdp.catalogs[0].policies
+    # The BNode keeps its label, so the policy reference is the same as before
+    assert isinstance(ref, BNode) and ref == bnode
+    assert isinstance(closure, PolicyClosure)
+    assert set(closure) == set(original_closure)
+    assert (None, None, URIRef("http://example.org/other")) not in closure
+
+    original = compile_policy(original_closure, bnode)
+    compiled = compile_policy(closure, ref)
+    assert compiled.rules == original.rules
+    assert len(compiled.rules) == 2 # The permission with its constraint and the IRI-named prohibition
+
+def test_tree_round_trip(tmp_path):
+    fdp, _ = build_fdp()
+    path = str(tmp_path / "snapshot.sqlite")
+    save_snapshot(path, fdp)
+    loaded, _ = load_snapshot(path, FDP_URI)
+
+    assert loaded.policies == fdp.policies
+    distribution = loaded.catalogs[0].datasets[0].distributions[0]
+    assert distribution.uri == "http://example.org/distribution"
+    assert distribution.sparql_endpoints == ("http://example.org/sparql",)
+
+def test_missing_snapshot(tmp_path):
+    assert load_snapshot(str(tmp_path / "snapshot.sqlite"), FDP_URI) == (None, None)
+
+def test_policy_refs_shared_per_load(tmp_path):
+    fdp, _ = build_fdp()
+    fdp.catalogs[0].datasets[0].policies = fdp.policies
+    path = str(tmp_path / "snapshot.sqlite")
+    save_snapshot(path, fdp)
+    first, _ = load_snapshot(path, FDP_URI)
+    second, _ = load_snapshot(path, FDP_URI)
+
+    # Within one tree the reference is stored once, but a tree doesn't keep the one of another load alive
+    assert first.policies[0] is first.catalogs[0].datasets[0].policies[0]
+    assert first.policies[0] == second.policies[0] and first.policies[0] is not second.policies[0]
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from query_src.sparql_results import read_sparql_json, iter_spilled_rows
+
+BINDINGS = [
+    {"s": {"type": "uri", "value": "http://example.org/a"}, "o": {"type": "literal", "value": "Zoë ✓ 日本"}},
+    {"s": {"type": "uri", "value": "http://example.org/b"},
+     "o": {"type": "literal", "value": "12", "datatype": "http://www.w3.org/2001/XMLSchema#integer"}},
+    {"s": {"type": "bnode", "value": "b0"}, "o": {"type": "literal", "value": "with \"quotes\" and \\ and }]"}},
+]
+SELECT = {"head": {"vars": ["s", "o"]}, "results": {"bindings": BINDINGS}}
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", range(1, 8))
+def test_select_in_small_chunks(size):
+    result = read_sparql_json(chunked(json.dumps(SELECT, ensure_ascii=False).encode("utf-8"), size))
+    assert result.vars == ["s", "o"]
+    assert result.rows == BINDINGS
+    assert result.row_count == 3
+    assert not result.truncated
+
+@pytest.mark.parametrize("size", range(1, 8))
+def test_utf8_character_split_over_chunks(size):
+    # Every character of the value takes 2 to 4 bytes, so most chunk sizes cut through one
+    value = "é€😀" * 5
+    data = json.dumps({"head": {"vars": ["o"]}, "results": {"bindings": [{"o": {"type": "literal", "value": value}}]}},
+                      ensure_ascii=False).encode("utf-8")
+    result = read_sparql_json(chunked(data, size))
+    assert result.rows[0]["o"]["value"] == value
+
+@pytest.mark.parametrize("split", range(1, 12))
+def test_number_at_chunk_end(split):
+    # Members around the bindings may hold bare numbers, which are only complete once the next chunk is seen
+    data = b'{"head": {"vars": []}, "count": 1234567890, "results": {"bindings": [{}]}}'
+    start = data.index(b"1234")
+    chunks = [data[:start + split], data[start + split:]]
+    result = read_sparql_json(chunks)
+    assert result.row_count == 1
+
+@pytest.mark.parametrize("size", range(1, 8))
+def test_number_as_last_value(size):
+    result = read_sparql_json(chunked(b'{"head": {"vars": []}, "results": {"bindings": []}, "count": 42}', size))
+    assert result.row_count == 0
+    assert not result.truncated
+
+@pytest.mark.parametrize("size", range(1, 8))
+@pytest.mark.parametrize("boolean", [True, False])
+def test_ask(size, boolean):
+    result = read_sparql_json(chunked(json.dumps({"head": {}, "boolean": boolean}).encode("utf-8"), size))
+    assert result.boolean is boolean
+    assert result.rows == []
+
+def test_row_cap():
+    result = read_sparql_json([json.dumps(SELECT).encode("utf-8")], max_rows=2)
+    assert result.rows == BINDINGS[:2]
+    assert result.row_count == 2
+    assert result.truncated
+    assert result.truncated_reason == "row limit of 2 reached"
+
+def test_byte_cap():
+    many = {"head": {"vars": ["s"]}, "results": {"bindings": [BINDINGS[0]] * 1000}}
+    result = read_sparql_json(chunked(json.dumps(many).encode("utf-8"), 1024), max_bytes=4096)
+    assert result.truncated
+    assert result.truncated_reason == "byte limit of 4096 reached"
+    assert 0 < result.row_count < 1000
+    assert result.bytes_read <= 4096 + 1024
+
+def test_should_stop():
+    result = read_sparql_json(chunked(json.dumps(SELECT).encode("utf-8"), 5), should_stop=lambda: True)
+    assert result.truncated
+    assert result.truncated_reason == "cancelled"
+
+def test_spill(tmp_path):
+    spill_path = str(tmp_path / "result.jsonl.gz")
+    result = read_sparql_json(chunked(json.dumps(SELECT).encode("utf-8"), 3), spill_path=spill_path, keep_rows=1)
+    assert result.rows == BINDINGS[:1]
+    assert result.row_count == 3
+    assert list(iter_spilled_rows(spill_path)) == BINDINGS
+
+def test_invalid_json():
+    with pytest.raises(ValueError):
+        read_sparql_json([b'{"head": {"vars": []}, "results": {"bindings": [{"s": ]}}'])